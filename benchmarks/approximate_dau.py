@@ -0,0 +1,100 @@
+"""
+Accuracy check and benchmark of the approximate daily active users (HyperLogLog sketches, see crud.HLL_PRECISION):
+loads generated events into the DB at DATABASE_URL as benchmarks.end_to_end does (it is dropped and re-created,
+so point it at a local scratch PostgreSQL), then checks that every approximate count (per day, over all days and per
+week, in total and per country) is within MAX_RELATIVE_ERROR of the exact one, and times both.
+
+Run from the project's root folder:
+    DATABASE_URL=postgresql://... python -m benchmarks.approximate_dau [number_of_events ...]
+"""
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+from src import crud
+from src.db import SessionLocal
+from benchmarks.end_to_end import load_events
+from benchmarks.generate_events import generate_events
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+# 4 standard errors of the estimate
+MAX_RELATIVE_ERROR = 4 * 1.04 / crud.HLL_REGISTERS ** 0.5
+START_DATE, END_DATE = datetime.date(2010, 5, 1), datetime.date(2010, 5, 21)
+REPEATS = 5
+
+
+def get_queries():
+    # (exact query, approximate query, arguments)
+    for country in [False, True]:
+        yield crud.get_number_of_daily_active_users, crud.get_approximate_number_of_daily_active_users, (None, country)
+        for i in range((END_DATE - START_DATE).days + 1):
+            yield (crud.get_number_of_daily_active_users, crud.get_approximate_number_of_daily_active_users,
+                   (START_DATE + datetime.timedelta(days=i), country))
+        for granularity in crud.GRANULARITIES:
+            yield (crud.get_number_of_daily_active_users_series, crud.get_approximate_number_of_daily_active_users_series,
+                   (START_DATE, END_DATE, granularity, country))
+
+
+def get_counts(result: dict):
+    # counts by date and country (where returned), as in the rows of either query
+    counts = {}
+    for row in result.values():
+        row = row if isinstance(row, tuple) else (row,)
+        counts[row[1:]] = row[0]
+    return counts
+
+
+def check_accuracy(db):
+    errors = []
+    for exact_query, approximate_query, args in get_queries():
+        exact, approximate = get_counts(exact_query(db, *args)), get_counts(approximate_query(db, *args))
+        assert exact.keys() == approximate.keys(), (approximate_query.__name__, args)
+        for key, count in exact.items():
+            error = abs(approximate[key] - count) / count if count else approximate[key]
+            assert error <= MAX_RELATIVE_ERROR, (approximate_query.__name__, args, key, count, approximate[key])
+            errors.append(error)
+    print(f"Accuracy check passed: {len(errors):,} counts within {MAX_RELATIVE_ERROR:.1%} "
+          f"(mean relative error {statistics.mean(errors):.2%}, max {max(errors):.2%}).", flush=True)
+
+
+def time_query(db, query, *args):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        query(db, *args)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def benchmark(path: str, n_events: int):
+    generate_events(path, n_events)
+    load_events(path, 0)
+    db = SessionLocal()
+    try:
+        print(f"{n_events:,} events:", flush=True)
+        check_accuracy(db)
+        for exact_query, approximate_query, args in [
+            (crud.get_number_of_daily_active_users, crud.get_approximate_number_of_daily_active_users, (None, False)),
+            (crud.get_number_of_daily_active_users, crud.get_approximate_number_of_daily_active_users, (None, True)),
+            (crud.get_number_of_daily_active_users_series, crud.get_approximate_number_of_daily_active_users_series,
+             (START_DATE, END_DATE, 'week', True)),
+        ]:
+            exact_ms, approximate_ms = time_query(db, exact_query, *args), time_query(db, approximate_query, *args)
+            print(f"{exact_query.__name__}{args}: {exact_ms:.1f}ms exact, {approximate_ms:.1f}ms approximate",
+                  flush=True)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*', default=DEFAULT_SIZES, help='numbers of events to generate')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.jsonl')
+        for n_events in args.sizes:
+            benchmark(path, n_events)
@@ -0,0 +1,204 @@
+"""
+Parity check and benchmark of the data cleaning steps in src/initialize.py against the step by step implementation
+they replaced (which filtered a new copy of the events per step, sorted them several times and read the events
+into a Python object per field), on generated events, in one go and in chunks.
+Then reads and cleans larger generated files, reporting the wall time and peak memory of both.
+
+Run from the project's root folder:
+    python -m benchmarks.cleaning_plan [number_of_events ...]
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pycountry
+
+from src.ingest import flatten_events, read_events_in_chunks
+from src.initialize import CleaningState, START_DATE, END_DATE, clean_events
+from src.sessions import pair_login_logout_events, get_sessions, mark_events_in_sessions
+from src.validation import VALID_DEVICE_OS, VALID_TRANSACTION_AMOUNT, VALID_TRANSACTION_CURRENCY
+from benchmarks.generate_events import generate_events
+
+try:
+    import orjson as json
+except ImportError:
+    import json
+
+DEFAULT_SIZES = [1_000_000, 10_000_000]
+PARITY_EVENTS = 300_000
+PARITY_CHUNK_SIZES = [0, 40_000]
+
+
+def legacy_read_events_in_chunks(path: str, chunk_size: int = 0):
+    # a dict per event, flattened into object columns
+    with open(path, 'rb') as f:
+        while True:
+            lines = [line for _, line in zip(range(chunk_size or sys.maxsize), f)]
+            if not lines:
+                break
+            events = flatten_events([json.loads(line) for line in lines if line.strip()])
+            yield events.astype({column: object for column in events.select_dtypes('category').columns})
+            if not chunk_size:
+                break
+
+
+def legacy_is_in(values: pd.Series, keys):
+    return np.fromiter((value in keys for value in values), dtype=bool, count=len(values))
+
+
+def legacy_clean_events(all_events: pd.DataFrame, state: CleaningState):
+    # the original steps (except for the first sort, which is stable now, as ties used to be left in arbitrary order,
+    # and the validation steps, which run before the events of unregistered users are filtered now, as in clean_events;
+    # tests/test_cleaning.py covers that order)
+    all_events = all_events[all_events['event_id'].notna()]
+    all_events = all_events[all_events['event_timestamp'].astype(bool)]
+    all_events = all_events[all_events['user_id'].astype(bool)]
+
+    all_events = all_events.sort_values(by='event_timestamp', kind='stable')
+    all_events = all_events.drop_duplicates(subset='event_id', keep='first')
+    all_events = all_events.loc[~np.isin(all_events['event_id'].to_numpy(dtype='int64'), state.seen_event_ids)]
+    state.seen_event_ids = np.union1d(state.seen_event_ids, all_events['event_id'].to_numpy(dtype='int64'))
+
+    all_events = all_events.query('event_timestamp >= @START_DATE and event_timestamp < @END_DATE')
+    all_events = all_events.loc[all_events['event_type'].isin(['registration', 'login', 'logout', 'transaction'])]
+
+    all_events = (
+        all_events
+        .loc[~((all_events['event_type'] == 'registration') & (
+            all_events.duplicated(subset=['event_type', 'user_id'], keep=False) |
+            legacy_is_in(all_events['user_id'], state.registration_timestamps)
+        ))]
+        .sort_values(by='event_timestamp', kind='stable')
+    )
+
+    alpha_2_codes = [country.alpha_2 for country in pycountry.countries]
+    all_events = all_events.loc[~((all_events['event_type'] == 'registration') &
+                                ~(all_events['country'].isin(alpha_2_codes)))]
+    all_events = all_events.loc[~((all_events['event_type'] == 'registration') &
+                                ~(all_events['device_os'].isin(VALID_DEVICE_OS)))]
+    all_events = all_events.loc[~((all_events['event_type'] == 'transaction') &
+                                ~(all_events['transaction_amount'].isin(VALID_TRANSACTION_AMOUNT)))]
+    all_events = all_events.loc[~((all_events['event_type'] == 'transaction') &
+                                ~(all_events['transaction_currency'].isin(VALID_TRANSACTION_CURRENCY)))]
+
+    registered_user_ids = all_events.loc[all_events['event_type'] == 'registration', 'user_id']
+    all_events = all_events.loc[~(
+        (all_events['event_type'] != 'registration') &
+        ~(all_events['user_id'].isin(registered_user_ids)) &
+        ~legacy_is_in(all_events['user_id'], state.registration_timestamps)
+    )]
+
+    registration_events = all_events[all_events['event_type'] == 'registration']
+    state.registration_timestamps.update(zip(registration_events['user_id'], registration_events['event_timestamp']))
+    registration_timestamps = np.fromiter(
+        (state.registration_timestamps.get(user_id, np.nan) for user_id in all_events['user_id']),
+        dtype=float, count=len(all_events)
+    )
+    all_events = all_events.loc[~(
+        (all_events['event_type'] != 'registration') &
+        (all_events['event_timestamp'] < registration_timestamps)
+    )]
+
+    login_logout_events = all_events[all_events['event_type'].isin(['login', 'logout'])].assign(carried=False)
+    carried_user_ids = [user_id for user_id in all_events['user_id'].unique() if user_id in state.open_sessions]
+    if carried_user_ids:
+        carried_login_events = pd.DataFrame({
+            'event_id': [state.open_sessions[user_id][0] for user_id in carried_user_ids],
+            'event_timestamp': [state.open_sessions[user_id][1] for user_id in carried_user_ids],
+            'event_type': 'login',
+            'user_id': carried_user_ids,
+            'carried': True,
+        })
+        login_logout_events = pd.concat([carried_login_events, login_logout_events], ignore_index=True)
+    login_logout_events = pair_login_logout_events(login_logout_events)
+    login_logout_events = login_logout_events.loc[login_logout_events['valid'] == True]
+    login_logout_events.sort_values(by=['user_id', 'event_timestamp'], inplace=True)
+
+    transaction_events = all_events[all_events['event_type'] == 'transaction'].reset_index(drop=True)
+    transaction_events = transaction_events.loc[
+        mark_events_in_sessions(transaction_events, get_sessions(login_logout_events))
+    ]
+
+    last_valid_login_logout_events = login_logout_events.groupby('user_id').tail(1)
+    for row in last_valid_login_logout_events.itertuples():
+        if row.event_type == 'login':
+            state.open_sessions[row.user_id] = (row.event_id, row.event_timestamp)
+        else:
+            state.open_sessions.pop(row.user_id, None)
+
+    carried_login_events = login_logout_events.loc[login_logout_events['carried'] == True]
+    login_logout_events = login_logout_events.loc[login_logout_events['carried'] == False].drop(columns='carried')
+    carried_login_events = carried_login_events.loc[carried_login_events['matching_login_or_logout_id'].notna()]
+
+    return registration_events, login_logout_events, transaction_events, carried_login_events
+
+
+def legacy_clean_file(path: str, chunk_size: int = 0):
+    state = CleaningState()
+    return [legacy_clean_events(events, state) for events in legacy_read_events_in_chunks(path, chunk_size)], state
+
+
+def clean_file(path: str, chunk_size: int = 0):
+    state = CleaningState()
+    return [clean_events(events, state) for events, _ in read_events_in_chunks(path, chunk_size)], state
+
+
+def normalize(events: pd.DataFrame):
+    # neither the index, the order of the columns, categorical dtypes nor the kind of missing values are loaded
+    events = events.reset_index(drop=True).sort_index(axis='columns')
+    events = events.astype({column: object for column in events.select_dtypes('category').columns})
+    for column in events.select_dtypes(object).columns:
+        events[column] = events[column].where(events[column].notna(), None)
+    return events
+
+
+def assert_states_equal(expected: CleaningState, actual: CleaningState):
+    np.testing.assert_array_equal(expected.seen_event_ids, actual.seen_event_ids)
+    assert expected.registration_timestamps == actual.registration_timestamps
+    assert expected.open_sessions == actual.open_sessions
+
+
+def check_parity(path: str):
+    for chunk_size in PARITY_CHUNK_SIZES:
+        expected_batches, expected_state = legacy_clean_file(path, chunk_size)
+        actual_batches, actual_state = clean_file(path, chunk_size)
+        for expected_batch, actual_batch in zip(expected_batches, actual_batches, strict=True):
+            for expected, actual in zip(expected_batch, actual_batch):
+                pd.testing.assert_frame_equal(normalize(expected), normalize(actual))
+        assert_states_equal(expected_state, actual_state)
+        print(f"Parity check passed (chunk size {chunk_size or 'unlimited'}).", flush=True)
+
+
+def measure(clean_file, path: str, queue: multiprocessing.Queue):
+    start = time.time()
+    clean_file(path)
+    queue.put((time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def benchmark(path: str, n_events: int):
+    # each implementation runs in a fresh process, for its own peak memory
+    results = []
+    for implementation in [legacy_clean_file, clean_file]:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measure, args=(implementation, path, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    (legacy_seconds, legacy_mb), (seconds, mb) = results
+    print(f"{n_events:,} events: {legacy_seconds:.1f}s and {legacy_mb:,.0f}MB before, {seconds:.1f}s and {mb:,.0f}MB now "
+          f"({legacy_seconds / seconds:.1f}x faster, {legacy_mb / mb:.1f}x less memory)", flush=True)
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.jsonl')
+        generate_events(path, PARITY_EVENTS, seed=2)
+        check_parity(path)
+        for n_events in [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES:
+            generate_events(path, n_events)
+            benchmark(path, n_events)
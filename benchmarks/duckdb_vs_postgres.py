@@ -0,0 +1,135 @@
+"""
+Latency benchmark of the game level queries on Postgres (rollups) and on DuckDB (Parquet copy of the events).
+For each size, seeds the DB at DATABASE_URL with generated users, sessions and transactions (it is dropped and
+re-created, so point it at a local scratch PostgreSQL), writes the same events as Parquet, and times every /game/* query on both backends.
+
+Run from the project's root folder:
+    DATABASE_URL=postgresql://... python -m benchmarks.duckdb_vs_postgres [number_of_events ...]
+"""
+import datetime
+import os
+import statistics
+import sys
+import time
+
+import pandas as pd
+from sqlalchemy.sql import text
+
+from src import crud, duckdb_db, models
+from src.db import SessionLocal, engine
+from src.exchange_rates import load_exchange_rates
+from src.parquet import PARQUET_TABLES, clear_parquet, write_parquet_table
+from src.partitions import create_partitions
+from src.schema_versions import drop_schema_versions
+
+DEFAULT_SIZES = [1_000_000, 10_000_000, 100_000_000]
+SESSIONS_PER_USER = 10
+PARQUET_PATH = os.getenv("BENCHMARK_PARQUET_PATH", "./benchmark_parquet")
+EXPORT_CHUNK_SIZE = 1_000_000
+REPEATS = 5
+
+INPUT_DATE = datetime.date(2010, 5, 15)
+START_DATE, END_DATE = datetime.date(2010, 5, 8), datetime.date(2010, 5, 22)
+GAME_QUERIES = ['get_number_of_daily_active_users', 'get_number_of_logins_for_game', 'get_total_revenue_in_usd',
+                'get_number_of_paid_users', 'get_average_number_of_sessions_for_users_with_sessions',
+                'get_average_total_time_spent_in_game']
+
+
+def seed(db, n_users: int, n_sessions: int):
+    drop_schema_versions(db)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    create_partitions(db, datetime.date(2010, 5, 8), datetime.date(2010, 5, 22))
+    params = {'users': n_users, 'sessions': n_sessions}
+    # every user registers on the first day and has sessions spread over the whole window, each with a transaction
+    db.execute(text('INSERT INTO event SELECT generate_series(1, :users * (1 + 3 * :sessions))'), params)
+    db.execute(text('''
+        INSERT INTO "user" (id, country, name, device_os, marketing_campaign)
+        SELECT 'u' || u, (ARRAY['DE', 'ES', 'IT'])[1 + u % 3], 'name' || u, (ARRAY['iOS', 'Android', 'Web'])[1 + u % 3],
+               CASE WHEN u % 2 = 0 THEN 'campaign' END
+        FROM generate_series(1, :users) AS u
+    '''), params)
+    db.execute(text('''
+        INSERT INTO registration (id, event_datetime, user_id)
+        SELECT u, TIMESTAMP '2010-05-08' + (u % 3600) * INTERVAL '1 second', 'u' || u
+        FROM generate_series(1, :users) AS u
+    '''), params)
+    db.execute(text('''
+        INSERT INTO login_logout (id, event_datetime, user_id, is_login, matching_login_or_logout_id)
+        SELECT :users + 2 * ((u - 1) * :sessions + s) + 1 + k,
+               TIMESTAMP '2010-05-08' + (3600 + s * 14 * 86400 / :sessions + k * 600 + u % 3600) * INTERVAL '1 second',
+               'u' || u,
+               k = 0,
+               :users + 2 * ((u - 1) * :sessions + s) + 1 + (1 - k)
+        FROM generate_series(1, :users) AS u, generate_series(0, :sessions - 1) AS s, generate_series(0, 1) AS k
+    '''), params)
+    db.execute(text('''
+        INSERT INTO transaction (id, event_datetime, user_id, transaction_amount, transaction_currency)
+        SELECT :users * (1 + 2 * :sessions) + (u - 1) * :sessions + s + 1,
+               TIMESTAMP '2010-05-08' + (3600 + s * 14 * 86400 / :sessions + 300 + u % 3600) * INTERVAL '1 second',
+               'u' || u, 0.99, 'EUR'
+        FROM generate_series(1, :users) AS u, generate_series(0, :sessions - 1) AS s
+    '''), params)
+    db.commit()
+    crud.refresh_daily_stats(db, datetime.date(2010, 5, 8), datetime.date(2010, 5, 22))
+    db.execute(text('ANALYZE'))
+    db.commit()
+
+
+def export_parquet(path: str = PARQUET_PATH):
+    # the seeded tables, written as initialize() writes the cleaned events
+    clear_parquet(path)
+    with engine.connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        for table in PARQUET_TABLES:
+            for df in pd.read_sql_query(text(f'SELECT * FROM "{table}"'), connection, chunksize=EXPORT_CHUNK_SIZE):
+                write_parquet_table(table, df, path)
+
+
+def get_cases():
+    # every variant of each /game/* endpoint: all time, one date, and the daily and weekly series, by country or not
+    for name in GAME_QUERIES:
+        for country in [False, True]:
+            suffix = ' by country' if country else ''
+            yield f'{name} (all time{suffix})', getattr(crud, name), (None, country)
+            yield f'{name} (date{suffix})', getattr(crud, name), (INPUT_DATE, country)
+            for granularity in crud.GRANULARITIES:
+                yield (f'{name} ({granularity}s{suffix})', getattr(crud, name + '_series'),
+                       (START_DATE, END_DATE, granularity, country))
+
+
+def time_query(query, db, args):
+    query(db, *args)
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        query(db, *args)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def benchmark(n_events: int):
+    n_users = max(1, n_events // (1 + 3 * SESSIONS_PER_USER))
+    db = SessionLocal()
+    start = time.time()
+    seed(db, n_users, SESSIONS_PER_USER)
+    load_exchange_rates(db, force=True)
+    print(f"Seeding Postgres with {n_events:,} events took: {time.time() - start:.1f}s.", flush=True)
+    start = time.time()
+    export_parquet()
+    duckdb_db.create_views(PARQUET_PATH)
+    print(f"Writing them as Parquet took: {time.time() - start:.1f}s.", flush=True)
+
+    duckdb_session = duckdb_db.get_duckdb_session()
+    print(f"{'query':<80} {'postgres':>10} {'duckdb':>10}", flush=True)
+    for label, query, args in get_cases():
+        postgres_ms = time_query(query, db, args)
+        duckdb_ms = time_query(query, duckdb_session, args)
+        print(f"{label:<80} {postgres_ms:>8.1f}ms {duckdb_ms:>8.1f}ms", flush=True)
+    duckdb_session.close()
+    db.close()
+
+
+if __name__ == '__main__':
+    for n_events in [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES:
+        benchmark(n_events)
@@ -0,0 +1,198 @@
+"""
+End-to-end benchmark of the cleaning pipeline and the API, for regression tracking.
+For each size, generates events with benchmarks.generate_events, loads them into the DB at DATABASE_URL with
+initialize()'s pipeline (it is dropped and re-created, so point it at a local scratch PostgreSQL) while timing every stage
+(reading, parsing & flattening, each cleaning step, loading, writing Parquet and quarantining rejected events if enabled,
+rebuilding the rollups, loading the exchange rates), then starts the API on that DB (with the response
+cache disabled) and times every endpoint. The results of all sizes are written to a JSON file.
+
+Run from the project's root folder:
+    DATABASE_URL=postgresql://... python -m benchmarks.end_to_end [number_of_events ...]
+        [--seed 0] [--chunk-size 0] [--repeats 10] [--output benchmark_results.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy.sql import text
+
+from src import models
+from src.db import SessionLocal, engine
+from src.initialize import populate
+from src.instrumentation import PipelineReport
+from src.schema_versions import drop_schema_versions
+from benchmarks.generate_events import generate_events
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+EVENTS_PATH = os.path.abspath(os.getenv("BENCHMARK_EVENTS_PATH", "./benchmark_events.jsonl"))
+PORT = 8003
+BASE_URL = f"http://127.0.0.1:{PORT}"
+# users whose stats are requested (one per request, in turns), and at once by /users/stats
+N_USERS = 100
+
+INPUT_DATE = '2010-05-15'
+START_DATE, END_DATE = '2010-05-08', '2010-05-22'
+USER_ENDPOINTS = ['country', 'name', 'logins', 'days-since-login', 'sessions', 'time-in-game']
+DATED_USER_ENDPOINTS = ['logins', 'days-since-login', 'sessions', 'time-in-game']
+GAME_ENDPOINTS = ['daily-active-users', 'logins', 'revenue', 'paid-users', 'average-number-of-sessions',
+                  'average-total-time-spent']
+
+
+def load_events(path: str, chunk_size: int):
+    """
+    Cleans and loads the events file into a fresh DB with initialize()'s pipeline, and returns what every stage did
+    (as PipelineReport reports it), along with the number of events read and of cleaned events per table.
+    """
+    db = SessionLocal()
+    # (the tables are loaded directly into the live schema, without a schema version)
+    drop_schema_versions(db)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    report = PipelineReport('benchmark')
+    counts = populate(db, report, path, chunk_size)
+    rows = {'events': report.stages['read_lines'].rows_out, **counts}
+    user_ids = [r[0] for r in db.execute(text('SELECT id FROM "user" ORDER BY id LIMIT :n'), {'n': N_USERS})]
+    db.close()
+    return report.to_dict()['stages'], rows, user_ids
+
+
+def get_requests(user_ids: list):
+    # every endpoint, with every kind of parameters it takes, as (label, method, path, query parameters, body);
+    # user level endpoints are requested for each of the users in turns
+    for endpoint in USER_ENDPOINTS:
+        yield f'/user/{endpoint}', 'GET', f'/user/{endpoint}', {'user_id': None}, None
+    for endpoint in DATED_USER_ENDPOINTS:
+        yield f'/user/{endpoint} (date)', 'GET', f'/user/{endpoint}', {'user_id': None, 'input_date': INPUT_DATE}, None
+    yield (f'/users/stats ({len(user_ids)} users)', 'POST', '/users/stats', {},
+           {'user_ids': user_ids, 'start_date': START_DATE, 'end_date': END_DATE})
+    for endpoint in GAME_ENDPOINTS:
+        for country in ['false', 'true']:
+            suffix = ' by country' if country == 'true' else ''
+            yield f'/game/{endpoint} (all time{suffix})', 'GET', f'/game/{endpoint}', {'country': country}, None
+            yield (f'/game/{endpoint} (date{suffix})', 'GET', f'/game/{endpoint}',
+                   {'country': country, 'input_date': INPUT_DATE}, None)
+            for granularity in ['day', 'week']:
+                yield (f'/game/{endpoint} ({granularity}s{suffix})', 'GET', f'/game/{endpoint}',
+                       {'country': country, 'start_date': START_DATE, 'end_date': END_DATE,
+                        'granularity': granularity}, None)
+    yield '/ingest (no new events)', 'POST', '/ingest', {'path': EVENTS_PATH}, None
+    yield '/exchange-rates/reload', 'POST', '/exchange-rates/reload', {}, None
+    yield '/metrics', 'GET', '/metrics', {}, None
+
+
+def time_endpoints(user_ids: list, repeats: int):
+    results = {}
+    with httpx.Client(base_url=BASE_URL, timeout=600) as http:
+        for label, method, path, params, body in get_requests(user_ids):
+            timings, statuses = [], set()
+            # the first request warms up the DB's caches and isn't counted
+            for i in range(repeats + 1):
+                if 'user_id' in params:
+                    params = dict(params, user_id=user_ids[i % len(user_ids)])
+                start = time.perf_counter()
+                response = http.request(method, path, params=params, json=body)
+                if i:
+                    timings.append(time.perf_counter() - start)
+                # 404s are expected for users without a country or name
+                statuses.add(response.status_code)
+            timings.sort()
+            results[label] = {
+                'median_ms': statistics.median(timings) * 1000,
+                'p95_ms': timings[min(len(timings) - 1, int(0.95 * len(timings)))] * 1000,
+                'max_ms': timings[-1] * 1000,
+                'status_codes': sorted(statuses),
+            }
+            print(f"{label:<60} {results[label]['median_ms']:>8.1f}ms", flush=True)
+    return results
+
+
+def wait_until_up(server: subprocess.Popen, timeout: float = 600):
+    deadline = time.time() + timeout
+    while time.time() < deadline and server.poll() is None:
+        try:
+            if httpx.get(BASE_URL + "/health/ready").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("API didn't start.")
+
+
+def benchmark(n_events: int, seed: int, chunk_size: int, repeats: int):
+    start = time.perf_counter()
+    n_generated = generate_events(EVENTS_PATH, n_events, seed)
+    generate_seconds = time.perf_counter() - start
+    print(f"Generated {n_generated:,} events in {generate_seconds:.1f}s.", flush=True)
+
+    stages, rows, user_ids = load_events(EVENTS_PATH, chunk_size)
+    for stage in stages:
+        print(f"{stage['name']:<60} {stage['seconds']:>8.2f}s {stage['rows_in']:>12,} rows in {stage['rows_dropped']:>10,} dropped",
+              flush=True)
+
+    # the API finds the file's events already ingested (up to the watermark), so it starts right away,
+    # and serves every request out of the DB
+    env = dict(os.environ, EVENTS_PATH=EVENTS_PATH, CACHE_BACKEND="none", QUERY_BACKEND="postgres", RESET_DB="")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(PORT), "--log-level", "warning"], env=env
+    )
+    try:
+        start = time.perf_counter()
+        wait_until_up(server)
+        startup_seconds = time.perf_counter() - start
+        endpoints = time_endpoints(user_ids, repeats)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'events': n_events,
+        'generated_events': n_generated,
+        'file_bytes': os.path.getsize(EVENTS_PATH),
+        'generate_seconds': generate_seconds,
+        'stages': stages,
+        'total_seconds': sum(stage['seconds'] for stage in stages),
+        'rows': rows,
+        'api_startup_seconds': startup_seconds,
+        'endpoints': endpoints,
+    }
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*', default=DEFAULT_SIZES, help='numbers of events to generate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=0, help='lines read and cleaned at a time (0 for all)')
+    parser.add_argument('--repeats', type=int, default=10, help='timed requests per endpoint')
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    results = {
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'chunk_size': args.chunk_size,
+        'repeats': args.repeats,
+        'runs': [],
+    }
+    for n_events in args.sizes:
+        print(f"--- {n_events:,} events ---", flush=True)
+        results['runs'].append(benchmark(n_events, args.seed, args.chunk_size, args.repeats))
+        # written after every size, so the results of the smaller sizes are kept if a larger one fails
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}.", flush=True)
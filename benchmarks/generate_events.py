@@ -0,0 +1,265 @@
+"""
+Deterministic generator of synthetic events, in the format of the events file: users register over the game's
+window and play sessions (a login, a logout and maybe some transactions in between), with the dirty cases
+initialize() cleans mixed in at configurable rates: duplicate event ids, events before the user's registration or
+by unregistered users, repeated registrations, unmatched logins & logouts, invalid countries, devices, amounts and
+currencies, invalid event types, missing fields and events outside the window.
+The same seed and number of events always generate the same file.
+
+Events are generated a day at a time and written in (roughly) chronological order, as in the real events file,
+so files of any size are generated in bounded memory.
+
+Run from the project's root folder:
+    python -m benchmarks.generate_events number_of_events [path] [seed]
+"""
+import datetime
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    dumps = orjson.dumps
+except ImportError:
+    import json
+    dumps = lambda event: json.dumps(event).encode()
+
+from src.validation import VALID_DEVICE_OS, VALID_TRANSACTION_AMOUNT, VALID_TRANSACTION_CURRENCY
+
+# the game's window, plus a day before and after it (whose events are filtered out)
+FIRST_DAY = datetime.datetime(2010, 5, 7, tzinfo=datetime.timezone.utc)
+WINDOW_DAYS = 15
+DAY = 86400
+
+COUNTRIES = ['DE', 'ES', 'IT', 'FR', 'GB', 'US', 'RS', 'BR', 'PL', 'NL']
+COUNTRY_WEIGHTS = [0.2, 0.15, 0.15, 0.1, 0.1, 0.1, 0.05, 0.05, 0.05, 0.05]
+MARKETING_CAMPAIGNS = [None, '', 'facebook', 'google', 'tv']
+MARKETING_CAMPAIGN_WEIGHTS = [0.4, 0.1, 0.2, 0.2, 0.1]
+INVALID_COUNTRIES = ['XX', 'Europe', 'Serbia', '']
+INVALID_DEVICE_OS = ['Symbian', 'Windows Phone', '']
+INVALID_TRANSACTION_AMOUNTS = [0.49, 3.99, 100.0, -1.99]
+INVALID_TRANSACTION_CURRENCIES = ['GBP', 'RSD', 'eur']
+INVALID_EVENT_TYPES = ['match_start', 'purchase_attempt']
+
+# events per user over the whole window, and transactions per session, on average
+EVENTS_PER_USER = 30
+TRANSACTIONS_PER_SESSION = 0.3
+MEAN_SESSION_SECONDS = 1800
+MAX_SESSION_SECONDS = 6 * 3600
+
+
+@dataclass
+class DirtyRates:
+    """
+    Share of the users, sessions or events affected by each of the dirty cases.
+    """
+    # of the events (each takes the id of an earlier event)
+    duplicate_event_ids: float = 0.005
+    # of the users (registrations)
+    invalid_countries: float = 0.005
+    invalid_device_os: float = 0.005
+    repeated_registrations: float = 0.005
+    registrations_before_window: float = 0.01
+    # of the sessions
+    unmatched_logins: float = 0.03
+    unmatched_logouts: float = 0.01
+    unregistered_users: float = 0.005
+    sessions_after_window: float = 0.01
+    transactions_outside_sessions: float = 0.01
+    # of the transactions
+    invalid_transaction_amounts: float = 0.01
+    invalid_transaction_currencies: float = 0.01
+    # of the events
+    invalid_event_types: float = 0.005
+    missing_user_ids: float = 0.001
+
+
+def generate_events(path: str, n_events: int, seed: int = 0, rates: DirtyRates = None):
+    """
+    Writes about n_events events to path as JSON lines, and returns the number of events written.
+    """
+    rates = rates or DirtyRates()
+    rng = np.random.default_rng(seed)
+    users = generate_users(rng, max(1, n_events // EVENTS_PER_USER), rates)
+    # the rest of the events are sessions (about 2 events each, plus their transactions), spread over the days
+    # in proportion to the number of users registered by then
+    n_sessions = max(0, n_events - len(users)) / (2 + TRANSACTIONS_PER_SESSION)
+    registered_by_day = np.searchsorted(users['registration_timestamp'].to_numpy(),
+                                        first_day_timestamp() + DAY * np.arange(1, WINDOW_DAYS + 2))
+    weights = registered_by_day.astype(float)
+    weights[-1] *= rates.sessions_after_window * WINDOW_DAYS
+    sessions_per_day = n_sessions * weights / max(1, weights.sum())
+
+    written = 0
+    next_event_id = 1
+    carried = None
+    with open(path, 'wb') as f:
+        for day in range(WINDOW_DAYS + 2):
+            events = [carried] if carried is not None else []
+            events.append(day_registrations(users, day))
+            if day > 0:
+                events.append(day_sessions(rng, users, registered_by_day[day - 1], int(round(sessions_per_day[day - 1])),
+                                           day, rates))
+            events = pd.concat(events, ignore_index=True)
+
+            # events that happen on a later day (logouts of sessions that cross midnight) are written with that day's
+            day_end = first_day_timestamp() + DAY * (day + 1)
+            if day < WINDOW_DAYS + 1:
+                carried = events[events['event_timestamp'] >= day_end]
+                events = events[events['event_timestamp'] < day_end]
+            events = events.sort_values(by='event_timestamp', kind='stable').reset_index(drop=True)
+
+            event_ids = np.arange(next_event_id, next_event_id + len(events))
+            next_event_id += len(events)
+            duplicates = rng.random(len(events)) < rates.duplicate_event_ids
+            event_ids[duplicates] = rng.integers(1, np.maximum(event_ids[duplicates], 2))
+            events['event_id'] = event_ids
+
+            set_dirty_event_fields(rng, events, rates)
+            f.writelines(render_events(events))
+            written += len(events)
+    return written
+
+
+def first_day_timestamp():
+    return int(FIRST_DAY.timestamp())
+
+
+def generate_users(rng: np.random.Generator, n_users: int, rates: DirtyRates):
+    # users sorted by registration time, so the users registered by some time are a prefix of them
+    window_start = first_day_timestamp() + DAY
+    registration_timestamps = rng.integers(window_start, window_start + DAY * WINDOW_DAYS, n_users)
+    before_window = rng.random(n_users) < rates.registrations_before_window
+    registration_timestamps[before_window] = first_day_timestamp() + rng.integers(0, DAY, before_window.sum())
+    registration_timestamps.sort()
+
+    countries = rng.choice(COUNTRIES, n_users, p=COUNTRY_WEIGHTS).astype(object)
+    invalid = rng.random(n_users) < rates.invalid_countries
+    countries[invalid] = rng.choice(INVALID_COUNTRIES, invalid.sum())
+    device_os = rng.choice(VALID_DEVICE_OS, n_users).astype(object)
+    invalid = rng.random(n_users) < rates.invalid_device_os
+    device_os[invalid] = rng.choice(INVALID_DEVICE_OS, invalid.sum())
+    marketing_campaigns = np.array(MARKETING_CAMPAIGNS, dtype=object)[
+        rng.choice(len(MARKETING_CAMPAIGNS), n_users, p=MARKETING_CAMPAIGN_WEIGHTS)
+    ]
+
+    ids = np.arange(n_users)
+    users = pd.DataFrame({
+        'user_id': [f'user-{i}' for i in ids],
+        'registration_timestamp': registration_timestamps,
+        'country': countries,
+        'name': [f'Player {i}' for i in ids],
+        'device_os': device_os,
+        'marketing_campaign': marketing_campaigns,
+    })
+    # some users register again later on (with the same data)
+    users['repeated_registration_timestamp'] = np.where(
+        rng.random(n_users) < rates.repeated_registrations,
+        users['registration_timestamp'] + rng.integers(1, DAY * 3, n_users),
+        -1
+    )
+    return users
+
+
+def day_registrations(users: pd.DataFrame, day: int):
+    day_start = first_day_timestamp() + DAY * day
+    registrations = []
+    for column in ['registration_timestamp', 'repeated_registration_timestamp']:
+        on_day = users[(users[column] >= day_start) & (users[column] < day_start + DAY)]
+        registrations.append(pd.DataFrame({
+            'event_timestamp': on_day[column].to_numpy(),
+            'event_type': 'registration',
+            'user_id': on_day['user_id'].to_numpy(),
+            'country': on_day['country'].to_numpy(),
+            'name': on_day['name'].to_numpy(),
+            'device_os': on_day['device_os'].to_numpy(),
+            'marketing_campaign': on_day['marketing_campaign'].to_numpy(),
+        }))
+    return pd.concat(registrations, ignore_index=True)
+
+
+def day_sessions(rng: np.random.Generator, users: pd.DataFrame, n_registered: int, n_sessions: int, day: int,
+                 rates: DirtyRates):
+    """
+    Sessions started on a day, by users registered by the end of it (so some of them start before the user's
+    registration). The same user may play overlapping sessions, which are then cleaned as repeated logins.
+    """
+    if not n_registered or not n_sessions:
+        return None
+    day_start = first_day_timestamp() + DAY * day
+
+    user_ids = users['user_id'].to_numpy()[rng.integers(0, n_registered, n_sessions)]
+    unregistered = rng.random(n_sessions) < rates.unregistered_users
+    user_ids[unregistered] = [f'ghost-{i}' for i in rng.integers(0, 1000, unregistered.sum())]
+    starts = day_start + rng.integers(0, DAY, n_sessions)
+    durations = np.clip(rng.exponential(MEAN_SESSION_SECONDS, n_sessions), 1, MAX_SESSION_SECONDS).astype(np.int64)
+    ends = starts + durations
+
+    has_logout = rng.random(n_sessions) >= rates.unmatched_logins
+    n_unmatched_logouts = rng.binomial(n_sessions, rates.unmatched_logouts)
+    unmatched_logout_user_ids = user_ids[rng.integers(0, n_sessions, n_unmatched_logouts)]
+
+    n_transactions = rng.poisson(TRANSACTIONS_PER_SESSION, n_sessions)
+    transaction_sessions = np.repeat(np.arange(n_sessions), n_transactions)
+    transaction_timestamps = starts[transaction_sessions] + (
+        rng.random(len(transaction_sessions)) * durations[transaction_sessions]
+    ).astype(np.int64)
+    outside = rng.random(len(transaction_sessions)) < rates.transactions_outside_sessions
+    transaction_timestamps[outside] = ends[transaction_sessions[outside]] + rng.integers(1, 3600, outside.sum())
+    amounts = rng.choice(VALID_TRANSACTION_AMOUNT, len(transaction_sessions))
+    invalid = rng.random(len(transaction_sessions)) < rates.invalid_transaction_amounts
+    amounts[invalid] = rng.choice(INVALID_TRANSACTION_AMOUNTS, invalid.sum())
+    currencies = rng.choice(VALID_TRANSACTION_CURRENCY, len(transaction_sessions)).astype(object)
+    invalid = rng.random(len(transaction_sessions)) < rates.invalid_transaction_currencies
+    currencies[invalid] = rng.choice(INVALID_TRANSACTION_CURRENCIES, invalid.sum())
+
+    return pd.concat([
+        pd.DataFrame({'event_timestamp': starts, 'event_type': 'login', 'user_id': user_ids}),
+        pd.DataFrame({'event_timestamp': ends[has_logout], 'event_type': 'logout', 'user_id': user_ids[has_logout]}),
+        pd.DataFrame({'event_timestamp': day_start + rng.integers(0, DAY, n_unmatched_logouts), 'event_type': 'logout',
+                      'user_id': unmatched_logout_user_ids}),
+        pd.DataFrame({'event_timestamp': transaction_timestamps, 'event_type': 'transaction',
+                      'user_id': user_ids[transaction_sessions], 'transaction_amount': amounts,
+                      'transaction_currency': currencies}),
+    ], ignore_index=True)
+
+
+def set_dirty_event_fields(rng: np.random.Generator, events: pd.DataFrame, rates: DirtyRates):
+    invalid = rng.random(len(events)) < rates.invalid_event_types
+    events.loc[invalid, 'event_type'] = rng.choice(INVALID_EVENT_TYPES, invalid.sum())
+    missing = rng.random(len(events)) < rates.missing_user_ids
+    events.loc[missing, 'user_id'] = None
+
+
+def render_events(events: pd.DataFrame):
+    # event_data has the fields of the event's type (registration or transaction ones, or just user_id)
+    columns = {column: events[column].tolist() if column in events else [None] * len(events)
+               for column in ['event_id', 'event_timestamp', 'event_type', 'user_id', 'country', 'name', 'device_os',
+                              'marketing_campaign', 'transaction_amount', 'transaction_currency']}
+    for i in range(len(events)):
+        event_type = columns['event_type'][i]
+        event_data = {'user_id': columns['user_id'][i]}
+        if event_type == 'registration':
+            for field in ['country', 'name', 'device_os', 'marketing_campaign']:
+                event_data[field] = columns[field][i]
+        elif event_type == 'transaction':
+            event_data['transaction_amount'] = columns['transaction_amount'][i]
+            event_data['transaction_currency'] = columns['transaction_currency'][i]
+        yield dumps({
+            'event_id': columns['event_id'][i],
+            'event_timestamp': columns['event_timestamp'][i],
+            'event_type': event_type,
+            'event_data': event_data,
+        }) + b'\n'
+
+
+if __name__ == '__main__':
+    n_events = int(sys.argv[1])
+    path = sys.argv[2] if len(sys.argv) > 2 else './events.jsonl'
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    start = datetime.datetime.now()
+    written = generate_events(path, n_events, seed)
+    print(f"Generated {written:,} events in {path} in {(datetime.datetime.now() - start).total_seconds():.1f}s.",
+          flush=True)
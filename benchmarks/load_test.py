@@ -0,0 +1,100 @@
+"""
+Load test comparing the sync (threadpool) and async (asyncpg) DB modes of the API.
+Starts the API once per mode against the (already populated) DB at DATABASE_URL, hits the read endpoints
+with a fixed number of concurrent clients for a while, and reports requests per second and latency percentiles.
+
+Run from the project's root folder:
+    python -m benchmarks.load_test [seconds_per_mode] [concurrency]
+"""
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy.sql import text
+
+from src.db import SessionLocal
+
+PORT = 8002
+BASE_URL = f"http://127.0.0.1:{PORT}"
+DATES = [f"2010-05-{day:02d}" for day in range(8, 23)]
+
+
+def get_user_ids(n: int = 1000):
+    db = SessionLocal()
+    try:
+        return [r[0] for r in db.execute(text('SELECT id FROM "user" LIMIT :n'), {'n': n})]
+    finally:
+        db.close()
+
+
+def random_request(user_ids: list):
+    date = random.choice(DATES + [''])
+    if random.random() < 0.5:
+        endpoint = random.choice(['logins', 'days-since-login', 'sessions', 'time-in-game', 'country', 'name'])
+        return f"/user/{endpoint}", {'user_id': random.choice(user_ids), 'input_date': date}
+    endpoint = random.choice(['daily-active-users', 'logins', 'revenue', 'paid-users',
+                              'average-number-of-sessions', 'average-total-time-spent'])
+    return f"/game/{endpoint}", {'input_date': date, 'country': random.choice(['true', 'false'])}
+
+
+async def client(http: httpx.AsyncClient, user_ids: list, deadline: float, latencies: list, errors: list):
+    while time.time() < deadline:
+        path, params = random_request(user_ids)
+        start = time.perf_counter()
+        response = await http.get(path, params=params)
+        latencies.append(time.perf_counter() - start)
+        # 404s are expected for user endpoints on users without a country or name
+        if response.status_code >= 500:
+            errors.append(response.status_code)
+
+
+async def run_load(user_ids: list, seconds: float, concurrency: int):
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=BASE_URL, limits=limits, timeout=60) as http:
+        deadline = time.time() + seconds
+        await asyncio.gather(*[client(http, user_ids, deadline, latencies, errors) for _ in range(concurrency)])
+    return latencies, errors
+
+
+def wait_until_up(timeout: float = 600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(BASE_URL + "/health/ready").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError("API didn't start.")
+
+
+def benchmark_mode(async_db: bool, user_ids: list, seconds: float, concurrency: int):
+    # with the response cache disabled, every request hits the DB
+    env = dict(os.environ, ASYNC_DB="1" if async_db else "0", CACHE_BACKEND="none")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(PORT), "--log-level", "warning"], env=env
+    )
+    try:
+        wait_until_up()
+        latencies, errors = asyncio.run(run_load(user_ids, seconds, concurrency))
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print(f"{'async' if async_db else 'sync'}: {len(latencies) / seconds:,.0f} requests/s, "
+          f"p50 {percentile(0.5):.1f}ms, p99 {percentile(0.99):.1f}ms, {len(errors)} errors", flush=True)
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 30
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    user_ids = get_user_ids()
+    for async_db in [False, True]:
+        benchmark_mode(async_db, user_ids, seconds, concurrency)
@@ -0,0 +1,69 @@
+"""
+Parity check and benchmark of the parallel cleaning mode (CLEANING_WORKERS): cleans generated events in a single
+process and partitioned by user across worker processes, checks that both return the same events (and leave the same
+cleaning state behind), in one go and in chunks, then times the cleaning (without reading the file) both ways
+on larger files.
+
+Run from the project's root folder:
+    python -m benchmarks.parallel_cleaning [number_of_events ...] [--workers 4]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from src.ingest import read_events_in_chunks
+from src.initialize import CleaningState, clean_events
+from benchmarks.cleaning_plan import assert_states_equal
+from benchmarks.generate_events import generate_events
+
+DEFAULT_SIZES = [1_000_000, 10_000_000]
+PARITY_EVENTS = 200_000
+PARITY_CHUNK_SIZES = [0, 30_000]
+
+
+def clean_file(path: str, chunk_size: int, workers: int):
+    state = CleaningState()
+    batches = [clean_events(events, state, workers=workers) for events, _ in read_events_in_chunks(path, chunk_size)]
+    return batches, state
+
+
+def check_parity(path: str, workers: int):
+    for chunk_size in PARITY_CHUNK_SIZES:
+        expected_batches, expected_state = clean_file(path, chunk_size, 1)
+        actual_batches, actual_state = clean_file(path, chunk_size, workers)
+        for expected_batch, actual_batch in zip(expected_batches, actual_batches, strict=True):
+            for expected, actual in zip(expected_batch, actual_batch):
+                # only the index differs (it isn't loaded)
+                pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True))
+        assert_states_equal(expected_state, actual_state)
+        print(f"Parity check passed with {workers} workers (chunk size {chunk_size or 'unlimited'}).", flush=True)
+
+
+def benchmark(path: str, n_events: int, workers: int):
+    events, _ = next(read_events_in_chunks(path))
+    timings = {}
+    for n_workers in [1, workers]:
+        start = time.time()
+        clean_events(events, CleaningState(), workers=n_workers)
+        timings[n_workers] = time.time() - start
+    print(f"{n_events:,} events: {timings[1]:.1f}s in a single process, {timings[workers]:.1f}s with {workers} workers "
+          f"({timings[1] / timings[workers]:.1f}x)", flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*', default=DEFAULT_SIZES, help='numbers of events to generate')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    workers = max(2, args.workers)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.jsonl')
+        generate_events(path, PARITY_EVENTS, seed=1)
+        check_parity(path, workers)
+        for n_events in args.sizes:
+            generate_events(path, n_events)
+            benchmark(path, n_events, workers)
@@ -0,0 +1,41 @@
+"""
+Throughput benchmark for the login & logout pairing in src/sessions.py (tests/test_sessions.py checks its results).
+
+Run from the project's root folder:
+    python -m benchmarks.session_pairing [number_of_events ...]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.sessions import pair_login_logout_events
+
+DEFAULT_SIZES = [1_000_000, 10_000_000, 50_000_000]
+
+
+def generate_login_logout_events(n: int, n_users: int = None, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    if n_users is None:
+        n_users = max(1, n // 20)
+    return pd.DataFrame({
+        'event_id': np.arange(n),
+        'user_id': rng.integers(0, n_users, n).astype(str),
+        'event_timestamp': rng.integers(1273276800, 1274572800, n),
+        # slightly more logins than logouts, so there are unmatched and repeated events of both kinds
+        'event_type': np.where(rng.random(n) < 0.55, 'login', 'logout'),
+    })
+
+
+def benchmark(sizes):
+    for n in sizes:
+        events = generate_login_logout_events(n)
+        start = time.time()
+        pair_login_logout_events(events)
+        elapsed = time.time() - start
+        print(f"{n} events: {elapsed:.2f}s, {n / elapsed:,.0f} events/s", flush=True)
+
+
+if __name__ == '__main__':
+    benchmark([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,48 @@
+"""
+Throughput benchmark for the transactions-within-sessions interval join in src/sessions.py
+(tests/test_sessions.py checks its results).
+
+Run from the project's root folder:
+    python -m benchmarks.transactions_in_sessions [number_of_transactions ...]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.sessions import pair_login_logout_events, get_sessions, mark_events_in_sessions
+from benchmarks.session_pairing import generate_login_logout_events
+
+DEFAULT_SIZES = [1_000_000, 10_000_000]
+
+
+def generate_transaction_events(n: int, n_users: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'event_id': np.arange(n),
+        'user_id': rng.integers(0, n_users, n).astype(str),
+        'event_timestamp': rng.integers(1273276800, 1274572800, n),
+        'event_type': 'transaction',
+    })
+
+
+def get_valid_login_logout_events(n: int, n_users: int, seed: int = 0):
+    login_logout_events = pair_login_logout_events(generate_login_logout_events(n, n_users=n_users, seed=seed))
+    return login_logout_events.loc[login_logout_events['valid'] == True]
+
+
+def benchmark(sizes):
+    for n in sizes:
+        n_users = max(1, n // 20)
+        sessions = get_sessions(get_valid_login_logout_events(n, n_users))
+        transaction_events = generate_transaction_events(n, n_users)
+        start = time.time()
+        mark_events_in_sessions(transaction_events, sessions)
+        elapsed = time.time() - start
+        print(f"{n} transactions against {len(sessions)} sessions: {elapsed:.2f}s, "
+              f"{n / elapsed:,.0f} transactions/s", flush=True)
+
+
+if __name__ == '__main__':
+    benchmark([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
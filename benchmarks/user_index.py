@@ -0,0 +1,98 @@
+"""
+Parity check and benchmark of the in-memory user index (USER_INDEX): loads generated events into the DB at
+DATABASE_URL as benchmarks.end_to_end does (it is dropped and re-created, so point it at a local scratch PostgreSQL),
+builds the index, checks that it answers every user level query as the DB does (for a sample of users, with no date
+and on every day of the game's window), then reports its memory per user and the latency of its lookups and of the
+DB's queries.
+
+Run from the project's root folder:
+    DATABASE_URL=postgresql://... python -m benchmarks.user_index [number_of_events ...] [--users 500]
+"""
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy.sql import text
+
+from src import crud
+from src.db import SessionLocal
+from src.user_index import build_user_index, get_memory_usage
+from benchmarks.end_to_end import load_events
+from benchmarks.generate_events import generate_events
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+QUERIES = [crud.get_country_of_user, crud.get_name_of_user]
+DATED_QUERIES = [crud.get_number_of_logins, crud.get_days_since_last_login, crud.get_number_of_sessions,
+                 crud.get_time_spent_in_game]
+# the game's window, and a day before it
+DATES = [None] + [datetime.date(2010, 5, 4) + datetime.timedelta(days=i) for i in range(20)]
+
+
+def get_calls(user_ids: list):
+    for user_id in user_ids:
+        for query in QUERIES:
+            yield query, (user_id,)
+        for query in DATED_QUERIES:
+            for input_date in DATES:
+                yield query, (user_id, input_date)
+
+
+def check_parity(db, index, user_ids: list):
+    n_calls = 0
+    for query, args in get_calls(user_ids + ['unknown user']):
+        expected, actual = query(db, *args), getattr(index, query.__name__)(*args)
+        # (the DB's sums of durations are Decimals)
+        if query == crud.get_time_spent_in_game:
+            expected = float(expected)
+        assert expected == actual, (query.__name__, args, expected, actual)
+        n_calls += 1
+    print(f"Parity check passed ({n_calls:,} lookups of {len(user_ids):,} users).", flush=True)
+
+
+def time_calls(call, calls: list):
+    timings = []
+    for query, args in calls:
+        start = time.perf_counter()
+        call(query, *args)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, statistics.quantiles(timings, n=100)[98] * 1000
+
+
+def benchmark(path: str, n_events: int, n_users: int):
+    generate_events(path, n_events)
+    load_events(path, 0)
+    db = SessionLocal()
+    try:
+        start = time.time()
+        index = build_user_index(db)
+        build_seconds = time.time() - start
+        n_index_users, n_logins = len(index.user_positions), len(index.login_starts)
+        memory = get_memory_usage(index)
+        print(f"{n_events:,} events: index of {n_index_users:,} users and {n_logins:,} logins built in "
+              f"{build_seconds:.2f}s, {memory / 1024 ** 2:.1f}MB ({memory / max(1, n_index_users):.0f} bytes per user, "
+              f"{n_logins / max(1, n_index_users):.1f} logins per user)", flush=True)
+
+        user_ids = [r[0] for r in db.execute(text('SELECT id FROM "user" ORDER BY random() LIMIT :n'), {'n': n_users})]
+        check_parity(db, index, user_ids)
+        calls = list(get_calls(user_ids))
+        index_median, index_p99 = time_calls(lambda query, *args: getattr(index, query.__name__)(*args), calls)
+        db_median, db_p99 = time_calls(lambda query, *args: query(db, *args), calls)
+        print(f"Lookups: {index_median:.3f}ms median and {index_p99:.3f}ms p99 from the index, "
+              f"{db_median:.3f}ms and {db_p99:.3f}ms from the DB", flush=True)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*', default=DEFAULT_SIZES, help='numbers of events to generate')
+    parser.add_argument('--users', type=int, default=500, help='number of users checked and timed')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.jsonl')
+        for n_events in args.sizes:
+            benchmark(path, n_events, args.users)
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# "memory" (a cache per worker process), "redis" (shared by all workers) or "none"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+# seconds a cached response is served for at most (ingestion invalidates all of them right away anyway)
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+# most responses kept by the memory backend (the least recently used ones are evicted first)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# seconds between checks of the memory backend for data loaded by other workers (see main.check_cache_version)
+CACHE_VERSION_CHECK_SECONDS = float(os.getenv("CACHE_VERSION_CHECK_SECONDS", "5"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = "stats-cache"
+
+
+class MemoryCache:
+    """
+    LRU cache of responses in this worker process.
+    Entries are cached for a generation of the data, which is bumped whenever new data is ingested,
+    by this worker or, once it notices the shared data version changed, by another one.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        # the last data version seen in the DB
+        self.data_version = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    async def get(self, key: str):
+        # returns the current generation, whether the key was found and its value
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.generation, True, entry[1]
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            return self.generation, False, None
+
+    async def set(self, key: str, value, generation: int):
+        with self.lock:
+            # a value computed before the data changed is not cached
+            if generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def bump_generation(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def set_data_version(self, data_version):
+        # bumps the generation if the data changed since it was last checked (or wasn't checked yet)
+        if data_version != self.data_version:
+            self.bump_generation()
+        self.data_version = data_version
+
+
+class RedisCache:
+    """
+    Cache of responses in Redis (or any server speaking its protocol), shared by all workers.
+    Keys contain the generation of the data, so bumping it makes all older entries unreachable at once,
+    and they expire after the TTL. The maximum size and eviction policy are set on the server (e.g. maxmemory-policy allkeys-lru).
+    """
+
+    def __init__(self, url: str = REDIS_URL, ttl: float = CACHE_TTL):
+        import redis
+        import redis.asyncio
+
+        self.ttl = ttl
+        self.client = redis.asyncio.Redis.from_url(url)
+        # ingestion runs outside of the event loop
+        self.sync_client = redis.Redis.from_url(url)
+        self.generation_key = f"{REDIS_KEY_PREFIX}:generation"
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        generation = int(await self.client.get(self.generation_key) or 0)
+        value = await self.client.get(f"{REDIS_KEY_PREFIX}:{generation}:{key}")
+        if value is None:
+            self.misses += 1
+            return generation, False, None
+        self.hits += 1
+        return generation, True, json.loads(value)
+
+    async def set(self, key: str, value, generation: int):
+        await self.client.set(f"{REDIS_KEY_PREFIX}:{generation}:{key}", json.dumps(value), px=int(self.ttl * 1000))
+
+    def bump_generation(self):
+        self.sync_client.incr(self.generation_key)
+
+
+def create_cache(backend: str = CACHE_BACKEND):
+    if backend == "none":
+        return None
+    if backend == "redis":
+        return RedisCache()
+    return MemoryCache()
+
+
+def get_cache_key(name: str, *args):
+    # e.g. get_number_of_logins:["some_user", "2010-05-08"]
+    return f"{name}:{json.dumps(args, default=str)}"
+
+
+response_cache = create_cache()
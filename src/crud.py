@@ -1,13 +1,49 @@
+from sqlalchemy import DateTime
 from sqlalchemy.orm import Session
-from sqlalchemy.sql import text
+from sqlalchemy.sql import bindparam, text
 import datetime
 
 import numpy as np
-import pandas as pd
 
 from . import models
 
 END_DATE = datetime.datetime(2010, 5, 22).date()
+GRANULARITIES = ['day', 'week']
+
+# daily active users can be estimated with HyperLogLog: the users active per day and country are hashed into
+# 2^HLL_PRECISION registers, each holding the highest rank (position of the first 1 bit in the rest of the hash) of the
+# users hashed to it. Registers of several days or countries are merged with MAX, and the estimate's relative standard
+# error is 1.04 / sqrt(2^HLL_PRECISION), about 1.6%
+HLL_PRECISION = 12
+HLL_REGISTERS = 2 ** HLL_PRECISION
+# the estimate out of a group of (register, rank) rows, the registers without rows being empty, with the small range
+# correction (linear counting) when many of them are
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+HLL_RAW_ESTIMATE = f'{HLL_ALPHA * HLL_REGISTERS ** 2} / (SUM(POWER(2, -rank)) + {HLL_REGISTERS} - COUNT(*))'
+HLL_ESTIMATE = f'''COALESCE(CAST(ROUND(
+    CASE WHEN {HLL_RAW_ESTIMATE} <= {2.5 * HLL_REGISTERS} AND COUNT(*) < {HLL_REGISTERS}
+    THEN {HLL_REGISTERS} * LN({HLL_REGISTERS}.0 / ({HLL_REGISTERS} - COUNT(*)))
+    ELSE {HLL_RAW_ESTIMATE} END
+) AS BIGINT), 0)'''
+
+# each day's revenue is converted with the currency's latest rate valid on that day (or its undated rate);
+# revenue with no such rate has a NULL rate, which sums leave out (see get_currencies_without_exchange_rate)
+REVENUE_IN_USD_FROM = '''daily_revenue
+    LEFT JOIN LATERAL (
+        SELECT rate_to_usd FROM exchange_rate
+        WHERE exchange_rate.currency = daily_revenue.transaction_currency
+        AND (exchange_rate.valid_from IS NULL OR exchange_rate.valid_from <= daily_revenue.date)
+        ORDER BY exchange_rate.valid_from DESC NULLS LAST
+        LIMIT 1
+    ) AS rate ON true'''
+
+
+def get_date_range(input_date: datetime.date):
+    # filtering on a half-open [date, date + 1 day) range instead of event_datetime::date lets the indexes on event_datetime be used
+    if not input_date:
+        return {}
+    return {'start': input_date, 'end': input_date + datetime.timedelta(days=1)}
+
 
 def get_country_of_user(db: Session, user_id: str):
     result = db.query(models.User.country).filter(models.User.id == user_id).first()
@@ -24,10 +60,10 @@ def get_name_of_user(db: Session, user_id: str):
 
 
 def get_number_of_logins(db: Session, user_id: str, input_date: datetime):
-    optional_part = ' AND event_datetime::date = :input_date' if input_date else ''
+    optional_part = ' AND event_datetime >= :start AND event_datetime < :end' if input_date else ''
     result = db.execute(
         text('SELECT COUNT(*) FROM login_logout WHERE user_id = :user_id AND is_login = true' + optional_part),
-        {'user_id': user_id, 'input_date': input_date}
+        {'user_id': user_id, **get_date_range(input_date)}
     )
     for arr in result:
         for r in arr:
@@ -40,8 +76,8 @@ def get_days_since_last_login(db: Session, user_id: str, input_date: datetime.da
     result = db.execute(
         text(
             'SELECT MAX(event_datetime) FROM login_logout \
-            WHERE user_id = :user_id AND is_login = true AND event_datetime::date <= :input_date'),
-        {'user_id': user_id, 'input_date': input_date}
+            WHERE user_id = :user_id AND is_login = true AND event_datetime < :end'),
+        {'user_id': user_id, **get_date_range(input_date)}
     )
     last_login_date, found = None, False
     for arr in result:
@@ -59,7 +95,7 @@ def get_days_since_last_login(db: Session, user_id: str, input_date: datetime.da
 
 
 def get_number_of_sessions(db: Session, user_id: str, input_date: datetime.date):
-    optional_part = 'l1.event_datetime::date = :input_date AND' if input_date else ''
+    optional_part = 'l1.event_datetime >= :start AND l1.event_datetime < :end AND' if input_date else ''
     result = db.execute(
         text(
             f'SELECT COUNT(*) from login_logout AS l1 \
@@ -69,7 +105,7 @@ def get_number_of_sessions(db: Session, user_id: str, input_date: datetime.date)
             {optional_part} \
             l1.is_login = true AND \
             (l2.event_datetime - l1.event_datetime) >= interval \'1 second\''),
-        {'user_id': user_id, 'input_date': input_date}
+        {'user_id': user_id, **get_date_range(input_date)}
     )
     for arr in result:
         for r in arr:
@@ -77,71 +113,84 @@ def get_number_of_sessions(db: Session, user_id: str, input_date: datetime.date)
         
 
 def get_time_spent_in_game(db: Session, user_id: str, input_date: datetime.date):
-    optional_part = 'AND login.event_datetime::date = :input_date' if input_date else ''
-    optional_part_select = '''
-        SUM(
-            EXTRACT(
-                EPOCH FROM (
-                    CASE
-                        WHEN logout.event_datetime::date > login.event_datetime::date
-                        THEN DATE_TRUNC('day', login.event_datetime) + INTERVAL '1 day'
-                        ELSE logout.event_datetime
-                    END
-                    - login.event_datetime
-                )
-            )
-        )
-    ''' if input_date else 'SUM(EXTRACT(EPOCH FROM (logout.event_datetime - login.event_datetime)))'
+    # on a date, the parts of the user's sessions on that day (open ones until midnight), otherwise the full closed sessions
+    optional_part = 'AND date = :input_date' if input_date else 'AND logout_id IS NOT NULL'
     result = db.execute(
-        # calculating durations of all sessions, cutting off at midnight when there is a date parameter
-        text(f'''
-            SELECT {optional_part_select}
+        text(f'SELECT COALESCE(SUM(duration), 0) FROM session WHERE user_id = :user_id {optional_part}'),
+        {'user_id': user_id, 'input_date': input_date}
+    )
+    for arr in result:
+        for r in arr:
+            return r
+
+
+def get_user_stats(db: Session, user_ids: list[str], start_date: datetime.date, end_date: datetime.date):
+    """
+    Batched version of the user level stats: logins, sessions and time spent in game per day in [start_date, end_date]
+    (as the single user queries with a date compute them), and days since the last login as of end_date,
+    for all the given users at once.
+
+    Returns {user_id: {'days_since_login': str, 'days': {date: {'logins', 'sessions', 'time_in_game'}}}},
+    with only the days on which the user logged in or was in game.
+    """
+    params = {'user_ids': list(user_ids), 'start': start_date, 'end': end_date + datetime.timedelta(days=1)}
+    stats = {user_id: {'days_since_login': 'No login at or prior to this date.', 'days': {}} for user_id in params['user_ids']}
+
+    def get_day(user_id, date):
+        return stats[user_id]['days'].setdefault(str(date), {'logins': 0, 'sessions': 0, 'time_in_game': 0})
+
+    result = db.execute(
+        text('''
+            SELECT
+                login.user_id,
+                login.event_datetime::date,
+                COUNT(*),
+                COUNT(logout.id) FILTER (WHERE (logout.event_datetime - login.event_datetime) >= interval '1 second')
             FROM login_logout AS login
-            JOIN login_logout AS logout
+            LEFT JOIN login_logout AS logout
             ON login.matching_login_or_logout_id = logout.id
-            AND login.user_id = :user_id
+            WHERE login.user_id = ANY(:user_ids)
             AND login.is_login = true
-            {optional_part}
+            AND login.event_datetime >= :start AND login.event_datetime < :end
+            GROUP BY 1, 2
         '''),
-        {'user_id': user_id, 'input_date': input_date}
+        params
     )
-    # when a date param is set, we should consider logins with no logouts for the time spent that day
-    if input_date:
-        sum = 0
-        for arr in result:
-            for r in arr:
-                if r:
-                    sum = r
-        result = db.execute(
-            text(f'''
-                SELECT SUM(EXTRACT(EPOCH FROM ((DATE_TRUNC('day', event_datetime) + INTERVAL '1 day') - event_datetime)))
-                FROM login_logout
-                WHERE user_id = :user_id AND is_login = true 
-                AND event_datetime::date = :input_date
-                AND matching_login_or_logout_id IS NULL
-            '''),
-            {'user_id': user_id, 'input_date': input_date}
-        )
-        for arr in result:
-            for r in arr:
-                if r:
-                    sum += r
-        return sum
-    else:
-        for arr in result:
-            for r in arr:
-                return r if r else 0
-            
+    for user_id, date, logins, sessions in result:
+        get_day(user_id, date).update(logins=logins, sessions=sessions)
+
+    result = db.execute(
+        text('''
+            SELECT user_id, date, SUM(duration) FROM session
+            WHERE user_id = ANY(:user_ids) AND date >= :start AND date < :end
+            GROUP BY 1, 2
+        '''),
+        params
+    )
+    for user_id, date, time_in_game in result:
+        get_day(user_id, date)['time_in_game'] = int(time_in_game)
+
+    result = db.execute(
+        text('''
+            SELECT user_id, MAX(event_datetime) FROM login_logout
+            WHERE user_id = ANY(:user_ids) AND is_login = true AND event_datetime < :end
+            GROUP BY user_id
+        '''),
+        params
+    )
+    for user_id, last_login_datetime in result:
+        stats[user_id]['days_since_login'] = str((end_date - last_login_datetime.date()).days)
+    return stats
+
 
 def get_number_of_daily_active_users(db: Session, input_date: datetime.date, country: bool):
-    optional_part_1 = ', u.country' if country else ''
-    optional_part_2 = 'GROUP BY u.country' if country else ''
-    optional_part_date = 'AND event_datetime::date = :input_date' if input_date else ''
+    optional_part_1 = ', country' if country else ''
+    optional_part_2 = 'GROUP BY country' if country else ''
+    # users appear once per day in the rollup, but can appear on multiple days
+    optional_part_count = 'COUNT(*)' if input_date else 'COUNT(DISTINCT user_id)'
+    optional_part_date = 'WHERE date = :input_date' if input_date else ''
     result = db.execute(
-        text(f'''SELECT COUNT(DISTINCT(login_logout.user_id)){optional_part_1} FROM login_logout
-                INNER JOIN "user" as u
-                ON u.id = login_logout.user_id
-                AND is_login = true
+        text(f'''SELECT {optional_part_count}{optional_part_1} FROM daily_user_stats
                 {optional_part_date} {optional_part_2}'''),
         {'input_date': input_date}
     )
@@ -153,15 +202,32 @@ def get_number_of_daily_active_users(db: Session, input_date: datetime.date, cou
     return return_dict
 
 
+def get_approximate_number_of_daily_active_users(db: Session, input_date: datetime.date, country: bool):
+    # as get_number_of_daily_active_users, estimated out of the merged sketches of the date (or of all dates)
+    optional_part_1 = ', country' if country else ''
+    optional_part_2 = 'GROUP BY country' if country else ''
+    optional_part_date = 'WHERE date = :input_date' if input_date else ''
+    result = db.execute(
+        text(f'''SELECT {HLL_ESTIMATE}{optional_part_1} FROM (
+                    SELECT register, MAX(rank) AS rank{optional_part_1} FROM daily_active_users_sketch
+                    {optional_part_date} GROUP BY register{optional_part_1}
+                ) AS registers {optional_part_2}'''),
+        {'input_date': input_date}
+    )
+    return_dict = {}
+    idx = 0
+    for arr in result:
+        return_dict[idx] = (arr[0], arr[1]) if country else (arr[0])
+        idx += 1
+    return return_dict
+
+
 def get_number_of_logins_for_game(db: Session, input_date: datetime.date, country: bool):
-    optional_part_1 = ', u.country' if country else ''
-    optional_part_2 = 'GROUP BY u.country' if country else ''
-    optional_part_date = 'AND event_datetime::date = :input_date' if input_date else ''
+    optional_part_1 = ', country' if country else ''
+    optional_part_2 = 'GROUP BY country HAVING SUM(logins) > 0' if country else ''
+    optional_part_date = 'WHERE date = :input_date' if input_date else ''
     result = db.execute(
-        text(f'''SELECT COUNT(*){optional_part_1} FROM login_logout
-                INNER JOIN "user" as u
-                ON u.id = login_logout.user_id
-                AND is_login = true
+        text(f'''SELECT COALESCE(SUM(logins), 0){optional_part_1} FROM daily_game_stats
                 {optional_part_date} {optional_part_2}'''),
         {'input_date': input_date}
     )
@@ -174,21 +240,13 @@ def get_number_of_logins_for_game(db: Session, input_date: datetime.date, countr
             
 
 def get_total_revenue_in_usd(db: Session, input_date: datetime.date, country: bool):
-    exchange_rates = pd.read_json(path_or_buf="./src/exchange_rates.jsonl", lines=True)
-    eur_to_usd = exchange_rates[exchange_rates['currency'] == 'EUR']['rate_to_usd'].iloc[0]
-
-    optional_part_1 = ', u.country' if country else ''
-    optional_part_2 = 'GROUP BY u.country' if country else ''
-    optional_part_date = 'AND event_datetime::date = :input_date' if input_date else ''
+    optional_part_1 = ', country' if country else ''
+    optional_part_2 = 'GROUP BY country' if country else ''
+    optional_part_date = 'WHERE date = :input_date' if input_date else ''
     result = db.execute(
-        text(f'''SELECT SUM(CASE WHEN transaction_currency = 'EUR'
-                            THEN transaction_amount * :eur_to_usd
-                            ELSE transaction_amount
-                            END){optional_part_1} FROM transaction
-                INNER JOIN "user" as u
-                ON u.id = transaction.user_id
+        text(f'''SELECT COALESCE(SUM(revenue * rate.rate_to_usd), 0){optional_part_1} FROM {REVENUE_IN_USD_FROM}
                 {optional_part_date} {optional_part_2}'''),
-        {'input_date': input_date, 'eur_to_usd': eur_to_usd}
+        {'input_date': input_date}
     )
     return_dict = {}
     idx = 0
@@ -199,14 +257,11 @@ def get_total_revenue_in_usd(db: Session, input_date: datetime.date, country: bo
 
 
 def get_number_of_paid_users(db: Session, input_date: datetime.date, country: bool):
-    optional_part_1 = ', u.country' if country else ''
-    optional_part_2 = 'GROUP BY u.country' if country else ''
-    optional_part_date = 'AND event_datetime::date = :input_date' if input_date else ''
+    optional_part_1 = ', country' if country else ''
+    optional_part_2 = 'GROUP BY country HAVING SUM(paid_registrations) > 0' if country else ''
+    optional_part_date = 'WHERE date = :input_date' if input_date else ''
     result = db.execute(
-        text(f'''SELECT COUNT(*){optional_part_1} FROM registration
-                INNER JOIN "user" as u
-                ON u.id = registration.user_id
-                AND marketing_campaign IS NOT NULL AND marketing_campaign != ''
+        text(f'''SELECT COALESCE(SUM(paid_registrations), 0){optional_part_1} FROM daily_game_stats
                 {optional_part_date} {optional_part_2}'''),
         {'input_date': input_date}
     )
@@ -219,23 +274,15 @@ def get_number_of_paid_users(db: Session, input_date: datetime.date, country: bo
 
 
 def get_average_number_of_sessions_for_users_with_sessions(db: Session, input_date: datetime.date, country: bool):
-    optional_part_1 = ', u.country' if country else ''
     optional_part_2 = 'GROUP BY country' if country else ''
     optional_part_3 = ', country' if country else ''
-    optional_part_date = 'AND event_datetime::date = :input_date' if input_date else ''
+    # with no date, sessions are summed up over all days per user first
+    from_part = '''daily_user_stats WHERE date = :input_date AND sessions > 0''' if input_date else '''
+        (SELECT SUM(sessions) AS sessions, country FROM daily_user_stats
+        GROUP BY user_id, country HAVING SUM(sessions) > 0) AS user_stats
+    '''
     result = db.execute(
-        text(f'''SELECT AVG(session_count){optional_part_3} from 
-                    (SELECT COUNT(*) AS session_count{optional_part_1} FROM login_logout AS login
-                    INNER JOIN "user" as u
-                    ON u.id = login.user_id
-                    AND is_login = true
-                    {optional_part_date}
-                    INNER JOIN login_logout AS logout
-                    ON login.matching_login_or_logout_id = logout.id AND
-                    (logout.event_datetime - login.event_datetime) >= interval \'1 second\'
-                    GROUP BY login.user_id{optional_part_3})
-                    {optional_part_2}
-            '''),
+        text(f'''SELECT AVG(sessions){optional_part_3} FROM {from_part} {optional_part_2}'''),
         {'input_date': input_date}
     )
     return_dict = {}
@@ -247,37 +294,21 @@ def get_average_number_of_sessions_for_users_with_sessions(db: Session, input_da
 
 
 def get_average_total_time_spent_in_game(db: Session, input_date: datetime.date, country: bool):
-    optional_part_1 = ', u.country' if country else ''
     optional_part_2 = 'GROUP BY country' if country else ''
     optional_part_3 = ', country' if country else ''
-    optional_part_date = 'AND event_datetime::date = :input_date' if input_date else ''
-    optional_part_select = '''
-        SUM(
-            EXTRACT(
-                EPOCH FROM (
-                    CASE
-                        WHEN logout.event_datetime::date > login.event_datetime::date
-                        THEN DATE_TRUNC('day', login.event_datetime) + INTERVAL '1 day'
-                        ELSE logout.event_datetime
-                    END
-                    - login.event_datetime
-                )
-            )
-        )
-    ''' if input_date else 'SUM(EXTRACT(EPOCH FROM (logout.event_datetime - login.event_datetime)))'
+    # on a specific date, the parts of the users' sessions on that day (open ones until midnight) are summed up
+    from_part = '''
+        (SELECT SUM(duration) AS total_time, country FROM session
+        INNER JOIN "user" as u
+        ON u.id = session.user_id
+        AND date = :input_date
+        GROUP BY user_id, country HAVING SUM(duration) > 0) AS user_stats
+    ''' if input_date else '''
+        (SELECT SUM(total_session_time) AS total_time, country FROM daily_user_stats
+        GROUP BY user_id, country HAVING SUM(sessions) > 0) AS user_stats
+    '''
     result = db.execute(
-        text(f'''SELECT AVG(total_time){optional_part_3} from 
-                    (SELECT {optional_part_select} AS total_time{optional_part_1} FROM login_logout AS login
-                    INNER JOIN "user" as u
-                    ON u.id = login.user_id
-                    AND is_login = true
-                    {optional_part_date}
-                    INNER JOIN login_logout AS logout
-                    ON login.matching_login_or_logout_id = logout.id AND
-                    (logout.event_datetime - login.event_datetime) >= interval \'1 second\'
-                    GROUP BY login.user_id{optional_part_3})
-                    {optional_part_2}
-            '''),
+        text(f'''SELECT AVG(total_time){optional_part_3} FROM {from_part} {optional_part_2}'''),
         {'input_date': input_date}
     )
     return_dict = {}
@@ -288,6 +319,258 @@ def get_average_total_time_spent_in_game(db: Session, input_date: datetime.date,
     return return_dict
 
 
+def get_time_series(db: Session, stats_query: str, start_date: datetime.date, end_date: datetime.date, granularity: str,
+                    country: bool):
+    """
+    Runs a query of (period, [country,] value) rows for the days in [start_date, end_date] and fills in the periods
+    (days or weeks, starting on Mondays) with no rows with 0, for every country if grouped by country.
+    In the query, the periods are DATE_TRUNC(granularity, date)::date and the range of dates is [:start, :end).
+
+    Returns a dict like the single date queries, with the period's first day added to each value.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'Unknown granularity: {granularity}')
+    optional_part_1 = ', countries.country' if country else ''
+    optional_part_2 = 'CROSS JOIN (SELECT DISTINCT country FROM "user" WHERE country IS NOT NULL) AS countries' if country else ''
+    optional_part_3 = 'AND stats.country = countries.country' if country else ''
+    result = db.execute(
+        text(f'''
+            WITH stats AS ({stats_query})
+            SELECT COALESCE(stats.value, 0){optional_part_1}, periods.period
+            FROM (
+                SELECT period::date AS period FROM generate_series(
+                    DATE_TRUNC('{granularity}', CAST(:start AS date)), CAST(:last AS date), INTERVAL '1 {granularity}'
+                ) AS series(period)
+            ) AS periods
+            {optional_part_2}
+            LEFT JOIN stats ON stats.period = periods.period {optional_part_3}
+            ORDER BY periods.period{optional_part_1}
+        '''),
+        {'start': start_date, 'end': end_date + datetime.timedelta(days=1), 'last': end_date}
+    )
+    return_dict = {}
+    idx = 0
+    for arr in result:
+        return_dict[idx] = (arr[0], arr[1], str(arr[2])) if country else (arr[0], str(arr[1]))
+        idx += 1
+    return return_dict
+
+
+def get_number_of_daily_active_users_series(db: Session, start_date: datetime.date, end_date: datetime.date,
+                                            granularity: str, country: bool):
+    # users active on any day of a week count once for that week
+    optional_part_1 = ', country' if country else ''
+    return get_time_series(db, f'''
+        SELECT DATE_TRUNC('{granularity}', date)::date AS period{optional_part_1}, COUNT(DISTINCT user_id) AS value
+        FROM daily_user_stats WHERE date >= :start AND date < :end
+        GROUP BY period{optional_part_1}
+    ''', start_date, end_date, granularity, country)
+
+
+def get_approximate_number_of_daily_active_users_series(db: Session, start_date: datetime.date,
+                                                        end_date: datetime.date, granularity: str, country: bool):
+    # the sketches of the days of a week are merged into the week's
+    optional_part_1 = ', country' if country else ''
+    return get_time_series(db, f'''
+        SELECT period{optional_part_1}, {HLL_ESTIMATE} AS value FROM (
+            SELECT DATE_TRUNC('{granularity}', date)::date AS period{optional_part_1}, register, MAX(rank) AS rank
+            FROM daily_active_users_sketch WHERE date >= :start AND date < :end
+            GROUP BY period{optional_part_1}, register
+        ) AS registers
+        GROUP BY period{optional_part_1}
+    ''', start_date, end_date, granularity, country)
+
+
+def get_number_of_logins_for_game_series(db: Session, start_date: datetime.date, end_date: datetime.date,
+                                         granularity: str, country: bool):
+    optional_part_1 = ', country' if country else ''
+    return get_time_series(db, f'''
+        SELECT DATE_TRUNC('{granularity}', date)::date AS period{optional_part_1}, SUM(logins) AS value
+        FROM daily_game_stats WHERE date >= :start AND date < :end
+        GROUP BY period{optional_part_1}
+    ''', start_date, end_date, granularity, country)
+
+
+def get_total_revenue_in_usd_series(db: Session, start_date: datetime.date, end_date: datetime.date,
+                                    granularity: str, country: bool):
+    optional_part_1 = ', country' if country else ''
+    return get_time_series(db, f'''
+        SELECT DATE_TRUNC('{granularity}', date)::date AS period{optional_part_1}, SUM(revenue * rate.rate_to_usd) AS value
+        FROM {REVENUE_IN_USD_FROM}
+        WHERE date >= :start AND date < :end
+        GROUP BY period{optional_part_1}
+    ''', start_date, end_date, granularity, country)
+
+
+def get_number_of_paid_users_series(db: Session, start_date: datetime.date, end_date: datetime.date,
+                                    granularity: str, country: bool):
+    optional_part_1 = ', country' if country else ''
+    return get_time_series(db, f'''
+        SELECT DATE_TRUNC('{granularity}', date)::date AS period{optional_part_1}, SUM(paid_registrations) AS value
+        FROM daily_game_stats WHERE date >= :start AND date < :end
+        GROUP BY period{optional_part_1}
+    ''', start_date, end_date, granularity, country)
+
+
+def get_average_number_of_sessions_for_users_with_sessions_series(db: Session, start_date: datetime.date,
+                                                                  end_date: datetime.date, granularity: str,
+                                                                  country: bool):
+    # sessions are summed up per user over each period first
+    optional_part_1 = ', country' if country else ''
+    return get_time_series(db, f'''
+        SELECT period{optional_part_1}, AVG(sessions) AS value FROM (
+            SELECT DATE_TRUNC('{granularity}', date)::date AS period, user_id, country, SUM(sessions) AS sessions
+            FROM daily_user_stats WHERE date >= :start AND date < :end
+            GROUP BY period, user_id, country HAVING SUM(sessions) > 0
+        ) AS user_stats
+        GROUP BY period{optional_part_1}
+    ''', start_date, end_date, granularity, country)
+
+
+def get_average_total_time_spent_in_game_series(db: Session, start_date: datetime.date, end_date: datetime.date,
+                                                granularity: str, country: bool):
+    # the parts of the users' sessions in each period are summed up per user first
+    optional_part_1 = ', country' if country else ''
+    return get_time_series(db, f'''
+        SELECT period{optional_part_1}, AVG(total_time) AS value FROM (
+            SELECT DATE_TRUNC('{granularity}', date)::date AS period, user_id, country, SUM(duration) AS total_time
+            FROM session
+            INNER JOIN "user" as u
+            ON u.id = session.user_id
+            AND date >= :start AND date < :end
+            GROUP BY period, user_id, country HAVING SUM(duration) > 0
+        ) AS user_stats
+        GROUP BY period{optional_part_1}
+    ''', start_date, end_date, granularity, country)
+
+
+def refresh_daily_stats(db: Session, start_date: datetime.date, end_date: datetime.date):
+    """
+    Rebuilds the sessions that started and the daily rollups for the dates in [start_date, end_date] out of the stored events.
+    """
+    params = {'start': start_date, 'end': end_date + datetime.timedelta(days=1)}
+    for table in ['daily_game_stats', 'daily_user_stats', 'daily_active_users_sketch', 'daily_revenue']:
+        db.execute(text(f'DELETE FROM {table} WHERE date >= :start AND date < :end'), params)
+
+    db.execute(
+        text('''
+            DELETE FROM session USING login_logout AS login
+            WHERE session.login_id = login.id
+            AND login.event_datetime >= :start AND login.event_datetime < :end
+        '''),
+        params
+    )
+    db.execute(
+        # sessions are split at midnight into one part per day (a session is kept on the day it started even if empty)
+        text('''
+            INSERT INTO session (login_id, date, logout_id, user_id, start_datetime, end_datetime, duration)
+            SELECT login_id, day::date, logout_id, user_id, start_datetime, end_datetime,
+                EXTRACT(EPOCH FROM (end_datetime - start_datetime))
+            FROM (
+                SELECT
+                    login.id AS login_id,
+                    logout.id AS logout_id,
+                    login.user_id,
+                    DATE_TRUNC('day', login.event_datetime) AS login_day,
+                    day,
+                    GREATEST(login.event_datetime, day) AS start_datetime,
+                    LEAST(
+                        COALESCE(logout.event_datetime, DATE_TRUNC('day', login.event_datetime) + INTERVAL '1 day'),
+                        day + INTERVAL '1 day'
+                    ) AS end_datetime
+                FROM login_logout AS login
+                LEFT JOIN login_logout AS logout
+                ON login.matching_login_or_logout_id = logout.id
+                CROSS JOIN LATERAL generate_series(
+                    DATE_TRUNC('day', login.event_datetime),
+                    DATE_TRUNC('day', COALESCE(logout.event_datetime, login.event_datetime)),
+                    INTERVAL '1 day'
+                ) AS day
+                WHERE login.is_login = true
+                AND login.event_datetime >= :start AND login.event_datetime < :end
+            ) AS parts
+            WHERE end_datetime > start_datetime OR day = login_day
+        '''),
+        params
+    )
+
+    db.execute(
+        text('''
+            INSERT INTO daily_game_stats (date, country, logins, paid_registrations)
+            SELECT date, country, SUM(logins), SUM(paid_registrations) FROM (
+                SELECT login.event_datetime::date AS date, u.country, COUNT(*) AS logins, 0 AS paid_registrations
+                FROM login_logout AS login
+                INNER JOIN "user" as u
+                ON u.id = login.user_id
+                AND is_login = true
+                AND event_datetime >= :start AND event_datetime < :end
+                GROUP BY 1, 2
+                UNION ALL
+                SELECT registration.event_datetime::date, u.country, 0, COUNT(*)
+                FROM registration
+                INNER JOIN "user" as u
+                ON u.id = registration.user_id
+                AND marketing_campaign IS NOT NULL AND marketing_campaign != ''
+                AND event_datetime >= :start AND event_datetime < :end
+                GROUP BY 1, 2
+            ) AS stats
+            GROUP BY date, country
+        '''),
+        params
+    )
+    db.execute(
+        # sessions of at least 1 second count towards the day their login happened on
+        text('''
+            INSERT INTO daily_user_stats (date, user_id, country, logins, sessions, total_session_time)
+            SELECT
+                login.event_datetime::date,
+                login.user_id,
+                u.country,
+                COUNT(*),
+                COUNT(logout.id),
+                COALESCE(SUM(EXTRACT(EPOCH FROM (logout.event_datetime - login.event_datetime))), 0)
+            FROM login_logout AS login
+            INNER JOIN "user" as u
+            ON u.id = login.user_id
+            AND login.is_login = true
+            AND login.event_datetime >= :start AND login.event_datetime < :end
+            LEFT JOIN login_logout AS logout
+            ON login.matching_login_or_logout_id = logout.id AND
+            (logout.event_datetime - login.event_datetime) >= interval \'1 second\'
+            GROUP BY 1, 2, 3
+        '''),
+        params
+    )
+    db.execute(
+        # (a rank of 64 - HLL_PRECISION + 1 if the rest of the hash is all zeros)
+        text(f'''
+            INSERT INTO daily_active_users_sketch (date, country, register, rank)
+            SELECT date, country, hash & {HLL_REGISTERS - 1},
+                MAX(COALESCE(NULLIF(POSITION('1' IN (hash >> {HLL_PRECISION})::bit({64 - HLL_PRECISION})::text), 0),
+                             {64 - HLL_PRECISION + 1}))
+            FROM (
+                SELECT date, country, hashtextextended(user_id, 0) AS hash FROM daily_user_stats
+                WHERE date >= :start AND date < :end
+            ) AS users
+            GROUP BY 1, 2, 3
+        '''),
+        params
+    )
+    db.execute(
+        text('''
+            INSERT INTO daily_revenue (date, country, transaction_currency, revenue)
+            SELECT transaction.event_datetime::date, u.country, transaction_currency, SUM(transaction_amount)
+            FROM transaction
+            INNER JOIN "user" as u
+            ON u.id = transaction.user_id
+            AND event_datetime >= :start AND event_datetime < :end
+            GROUP BY 1, 2, 3
+        '''),
+        params
+    )
+    db.commit()
+
+
 def insert_event(db: Session, event):
     match event.event_type:
         case 'registration':
@@ -302,6 +585,12 @@ def insert_event(db: Session, event):
             print("Insert error.")
 
 
+def to_utc_datetime(event_timestamp):
+    # event timestamps (seconds since the epoch) are stored as UTC datetimes, without a time zone
+    # (as the bulk load does for whole columns, see load.to_datetime)
+    return datetime.datetime.fromtimestamp(float(event_timestamp), datetime.timezone.utc).replace(tzinfo=None)
+
+
 def insert_registration_event(db: Session, registration_event):
     db_event = models.Event(id=registration_event.event_id)
     db_user = models.User(id=registration_event.user_id,
@@ -310,7 +599,7 @@ def insert_registration_event(db: Session, registration_event):
                           device_os=registration_event.device_os,
                           marketing_campaign=registration_event.marketing_campaign)
     
-    event_datetime = datetime.datetime.fromtimestamp(registration_event.event_timestamp)
+    event_datetime = to_utc_datetime(registration_event.event_timestamp)
     db_registration_event = models.Registration(id=registration_event.event_id,
                                                 event_datetime=event_datetime,
                                                 user_id=registration_event.user_id)
@@ -326,7 +615,7 @@ def insert_registration_event(db: Session, registration_event):
 
 def insert_transaction_event(db: Session, transaction_event):
     db_event = models.Event(id=transaction_event.event_id)
-    event_datetime = datetime.datetime.fromtimestamp(transaction_event.event_timestamp)
+    event_datetime = to_utc_datetime(transaction_event.event_timestamp)
     db_transaction_event = models.Transaction(id=transaction_event.event_id,
                                               event_datetime=event_datetime,
                                               user_id=transaction_event.user_id,
@@ -344,7 +633,7 @@ def insert_transaction_event(db: Session, transaction_event):
 
 def insert_login_logout_event(db: Session, login_logout_event, is_login: bool):
     db_event = models.Event(id=login_logout_event.event_id)
-    event_datetime = datetime.datetime.fromtimestamp(login_logout_event.event_timestamp)
+    event_datetime = to_utc_datetime(login_logout_event.event_timestamp)
     if is_login:
         db_login_logout_event = models.LoginLogout(id=login_logout_event.event_id,
                                               event_datetime=event_datetime,
@@ -364,9 +653,104 @@ def insert_login_logout_event(db: Session, login_logout_event, is_login: bool):
         db.commit()
 
 
-def add_matching_logout_ids(db: Session, login_event):
-    if not np.isnan(login_event.matching_login_or_logout_id):
+def add_matching_logout_ids(db: Session, login_events):
+    # sets the logouts of already inserted logins at once (event_datetime, which their partitions are by, is known)
+    login_events = login_events[login_events['matching_login_or_logout_id'].notna().to_numpy()]
+    if not len(login_events):
+        return
+    logins = {
+        'ids': login_events['event_id'].astype('int64').tolist(),
+        'event_datetimes': [to_utc_datetime(t) for t in login_events['event_timestamp']],
+        'logout_ids': login_events['matching_login_or_logout_id'].astype('int64').tolist(),
+    }
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(
+            text('''
+                UPDATE login_logout SET matching_login_or_logout_id = logins.logout_id
+                FROM unnest(CAST(:ids AS bigint[]), CAST(:event_datetimes AS timestamp[]), CAST(:logout_ids AS bigint[]))
+                AS logins(id, event_datetime, logout_id)
+                WHERE login_logout.id = logins.id AND login_logout.event_datetime = logins.event_datetime
+            '''),
+            logins
+        )
+    else:
         db.execute(
-            text("UPDATE login_logout SET matching_login_or_logout_id = :logout_id WHERE id = :id"),
-            {'id': login_event.event_id, 'logout_id': login_event.matching_login_or_logout_id}
+            # (bound as a DateTime, for the dialect to format it as it stores datetimes)
+            text('''UPDATE login_logout SET matching_login_or_logout_id = :logout_id
+                    WHERE id = :id AND event_datetime = :event_datetime''').bindparams(
+                bindparam('event_datetime', type_=DateTime)
+            ),
+            [{'id': id, 'event_datetime': event_datetime, 'logout_id': logout_id}
+             for id, event_datetime, logout_id in zip(*logins.values())]
         )
+
+
+def get_ingestion_watermark(db: Session, path: str):
+    return db.get(models.IngestionWatermark, path)
+
+
+def has_ingested_events(db: Session):
+    return db.query(models.IngestionWatermark).first() is not None
+
+
+def set_ingestion_watermark(db: Session, path: str, file_offset: int, max_event_timestamp: float):
+    watermark = db.get(models.IngestionWatermark, path)
+    if not watermark:
+        watermark = models.IngestionWatermark(path=path)
+        db.add(watermark)
+    watermark.file_offset = file_offset
+    if max_event_timestamp and not np.isnan(max_event_timestamp):
+        max_event_datetime = to_utc_datetime(max_event_timestamp)
+        if not watermark.max_event_datetime or max_event_datetime > watermark.max_event_datetime:
+            watermark.max_event_datetime = max_event_datetime
+    watermark.ingested_at = datetime.datetime.utcnow()
+    db.commit()
+
+
+def get_existing_event_ids(db: Session, event_ids: list):
+    result = db.execute(
+        text('SELECT id FROM event WHERE id = ANY(:event_ids)'),
+        {'event_ids': event_ids}
+    )
+    return {r[0] for r in result}
+
+
+def get_registration_timestamps(db: Session, user_ids: list):
+    result = db.execute(
+        text('SELECT user_id, EXTRACT(EPOCH FROM event_datetime) FROM registration WHERE user_id = ANY(:user_ids)'),
+        {'user_ids': user_ids}
+    )
+    return {r[0]: float(r[1]) for r in result}
+
+
+def get_open_sessions(db: Session, user_ids: list):
+    # a login with no matching logout is always the user's last valid login or logout event
+    result = db.execute(
+        text('''
+            SELECT user_id, id, EXTRACT(EPOCH FROM event_datetime) FROM login_logout
+            WHERE user_id = ANY(:user_ids) AND is_login = true AND matching_login_or_logout_id IS NULL
+        '''),
+        {'user_ids': user_ids}
+    )
+    return {r[0]: (r[1], float(r[2])) for r in result}
+
+
+def get_currencies_without_exchange_rate(db: Session):
+    # currencies with revenue on days none of their exchange rates applies to
+    result = db.execute(text(f'''
+        SELECT DISTINCT transaction_currency FROM {REVENUE_IN_USD_FROM}
+        WHERE rate.rate_to_usd IS NULL ORDER BY transaction_currency
+    '''))
+    return [r[0] for r in result]
+
+
+def get_exchange_rates_version(db: Session):
+    # changes whenever the exchange rates are replaced (their ids are never reused)
+    return db.execute(text('SELECT MAX(id) FROM exchange_rate')).scalar()
+
+
+def replace_exchange_rates(db: Session, exchange_rates: list):
+    db.query(models.ExchangeRate).delete()
+    db.add_all([models.ExchangeRate(**exchange_rate) for exchange_rate in exchange_rates])
+    db.commit()
+
@@ -1,19 +1,157 @@
 import os
+from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from dotenv import load_dotenv
 # from databases import Database
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import text
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://db:5433/events?user=postgres&password=root")
+# the connection and pool settings below, schema versions and the ingestion lock are PostgreSQL specific,
+# other databases get the driver's defaults (e.g. for loading events with the ORM, see load.populate_db)
+IS_POSTGRES = make_url(DATABASE_URL).get_backend_name() == "postgresql"
+
+# if set, endpoints run their queries through asyncpg instead of holding a threadpool worker each
+ASYNC_DB = os.getenv("ASYNC_DB", "").lower() in ("1", "true", "yes")
+
+# "postgres" or "duckdb", to run the game level queries on the Parquet copy of the events with DuckDB instead
+QUERY_BACKEND = os.getenv("QUERY_BACKEND", "postgres").lower()
+
+# --- connection pool settings (per worker process) ---
+# number of worker processes serving the API, each of which has its own pool
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# if set, the total number of connections all workers may open, split evenly between them
+# (unless the pool size and overflow are set explicitly), so that scaling workers doesn't exceed Postgres' max_connections
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "0"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(max(1, DB_MAX_CONNECTIONS // WEB_CONCURRENCY) if DB_MAX_CONNECTIONS else 5)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "0" if DB_MAX_CONNECTIONS else "10"))
+# seconds to wait for a connection from the pool before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# seconds after which connections are replaced, -1 to never replace them
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# milliseconds after which the API's queries are cancelled, 0 for no limit (ingestion is never limited)
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "events-api")
+
+POOL_SETTINGS = {
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_timeout': DB_POOL_TIMEOUT,
+    'pool_recycle': DB_POOL_RECYCLE,
+    'pool_pre_ping': DB_POOL_PRE_PING,
+}
 
 # SQLAlchemy
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={
+        'application_name': DB_APPLICATION_NAME,
+        'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}',
+    },
+    **POOL_SETTINGS
+) if IS_POSTGRES else create_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# ingestion is a long running batch job, so it gets its own connections (outside the API's pool and statement timeout)
+ingestion_engine = create_engine(
+    DATABASE_URL,
+    poolclass=NullPool,
+    connect_args={'application_name': f'{DB_APPLICATION_NAME}-ingestion'}
+) if IS_POSTGRES else engine
+
+IngestionSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=ingestion_engine)
+
+# the API reads the tables through views in this schema, which point at the active version's schema (see schema_versions)
+LIVE_SCHEMA = "public"
+SCHEMA_VERSION_TABLE = "schema_version"
+
+
+def get_version_schema(version: int):
+    return f"events_v{version}"
+
+
+def get_version_engine(version: int):
+    # for loading a version's tables, which unqualified names resolve to
+    return create_engine(
+        DATABASE_URL,
+        poolclass=NullPool,
+        connect_args={
+            'application_name': f'{DB_APPLICATION_NAME}-ingestion',
+            'options': f'-c search_path={get_version_schema(version)}',
+        }
+    )
+
+
+def use_active_schema_version(dbapi_connection, connection_record):
+    # ingestion writes into the tables of the active version (the live schema's views can't be copied into),
+    # or into the live schema's tables if the DB was populated before schema versions were used
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"SELECT to_regclass('{LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE}') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute(f"SELECT version FROM {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE} WHERE is_active")
+            row = cursor.fetchone()
+            if row:
+                cursor.execute(f"SET search_path TO {get_version_schema(row[0])}")
+    finally:
+        cursor.close()
+    dbapi_connection.commit()
+
+
+if IS_POSTGRES:
+    event.listen(ingestion_engine, "connect", use_active_schema_version)
+
+
+# key of the Postgres advisory lock taken while events are ingested (by any process of any of the API's instances)
+INGESTION_LOCK_KEY = 72616001
+
+
+@contextmanager
+def ingestion_lock(wait: bool = True):
+    """
+    Holds the ingestion advisory lock (on a connection of its own, as the ingestion's sessions release theirs on every
+    commit) so events are only ingested by one process at a time.
+    Yields whether the lock was acquired, which it always is when waiting for it (or without PostgreSQL).
+    """
+    if not IS_POSTGRES:
+        yield True
+        return
+    with ingestion_engine.connect() as connection:
+        if wait:
+            connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': INGESTION_LOCK_KEY})
+            acquired = True
+        else:
+            acquired = connection.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': INGESTION_LOCK_KEY}).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': INGESTION_LOCK_KEY})
+
+async_engine = None
+AsyncSessionLocal = None
+if ASYNC_DB:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(
+        DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1),
+        connect_args={
+            'server_settings': {
+                'application_name': DB_APPLICATION_NAME,
+                'statement_timeout': str(DB_STATEMENT_TIMEOUT),
+            }
+        },
+        **POOL_SETTINGS
+    )
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # # Databases query builder
@@ -0,0 +1,178 @@
+import glob
+import os
+import re
+import threading
+
+import duckdb
+import pandas as pd
+
+from .crud import HLL_PRECISION, HLL_REGISTERS
+from .exchange_rates import EXCHANGE_RATES_PATH, read_exchange_rates
+from .parquet import PARQUET_PATH, PARTITIONED_TABLES, get_parquet_glob
+
+# bind parameters of SQLAlchemy's text() (":name", but not "::type" casts), which DuckDB writes as "$name"
+BIND_PARAMETER = re.compile(r'(?<![:\w]):(\w+)(?!:)')
+
+# columns of the tables read from Parquet, for an empty table to be queried before any of its files are written
+TABLE_COLUMNS = {
+    'user': 'id VARCHAR, country VARCHAR, name VARCHAR, device_os VARCHAR, marketing_campaign VARCHAR',
+    'registration': 'id BIGINT, event_datetime TIMESTAMP, user_id VARCHAR, date DATE',
+    'login_logout': 'id BIGINT, event_datetime TIMESTAMP, user_id VARCHAR, is_login BOOLEAN, '
+                    'matching_login_or_logout_id BIGINT, date DATE',
+    'transaction': 'id BIGINT, event_datetime TIMESTAMP, user_id VARCHAR, transaction_amount DOUBLE, '
+                   'transaction_currency VARCHAR, date DATE',
+}
+
+# the rollups and sessions crud's game level queries read, as crud.refresh_daily_stats builds them in Postgres,
+# but computed on the fly out of the events (a session's logout references its login even if the login was written
+# before the logout came, so sessions are found through their logouts)
+VIEWS = {
+    'logged_session': '''
+        SELECT login.id AS login_id, logout.id AS logout_id, login.user_id, login.date,
+               login.event_datetime AS start_datetime, logout.event_datetime AS end_datetime
+        FROM login_logout AS login
+        LEFT JOIN login_logout AS logout
+        ON logout.matching_login_or_logout_id = login.id AND logout.is_login = false
+        WHERE login.is_login = true
+    ''',
+    'daily_game_stats': '''
+        SELECT date, country, SUM(logins) AS logins, SUM(paid_registrations) AS paid_registrations FROM (
+            SELECT login.date, u.country, COUNT(*) AS logins, 0 AS paid_registrations
+            FROM login_logout AS login
+            INNER JOIN "user" AS u
+            ON u.id = login.user_id
+            WHERE is_login = true
+            GROUP BY 1, 2
+            UNION ALL
+            SELECT registration.date, u.country, 0, COUNT(*)
+            FROM registration
+            INNER JOIN "user" AS u
+            ON u.id = registration.user_id
+            WHERE marketing_campaign IS NOT NULL AND marketing_campaign != ''
+            GROUP BY 1, 2
+        ) AS stats
+        GROUP BY date, country
+    ''',
+    'daily_user_stats': '''
+        SELECT
+            s.date,
+            s.user_id,
+            u.country,
+            COUNT(*) AS logins,
+            COUNT(*) FILTER (WHERE s.end_datetime - s.start_datetime >= INTERVAL '1 second') AS sessions,
+            COALESCE(SUM(EPOCH(s.end_datetime - s.start_datetime))
+                     FILTER (WHERE s.end_datetime - s.start_datetime >= INTERVAL '1 second'), 0) AS total_session_time
+        FROM logged_session AS s
+        INNER JOIN "user" AS u
+        ON u.id = s.user_id
+        GROUP BY 1, 2, 3
+    ''',
+    # (with DuckDB's hash function, rather than Postgres')
+    'daily_active_users_sketch': f'''
+        SELECT date, country, CAST(hash & {HLL_REGISTERS - 1} AS SMALLINT) AS register,
+               MAX(COALESCE(NULLIF(POSITION('1' IN CAST(CAST(hash >> {HLL_PRECISION} AS BIGINT) AS BIT)::VARCHAR), 0)
+                            - {HLL_PRECISION}, {64 - HLL_PRECISION + 1})) AS rank
+        FROM (SELECT date, country, hash(user_id) AS hash FROM daily_user_stats) AS users
+        GROUP BY 1, 2, 3
+    ''',
+    'daily_revenue': '''
+        SELECT transaction.date, u.country, transaction_currency, SUM(transaction_amount) AS revenue
+        FROM transaction
+        INNER JOIN "user" AS u
+        ON u.id = transaction.user_id
+        GROUP BY 1, 2, 3
+    ''',
+    # one row per session per day it spans (open sessions end at the end of the day they started on)
+    'session': '''
+        SELECT login_id, CAST(day AS DATE) AS date, logout_id, user_id,
+               GREATEST(start_datetime, day) AS start_datetime,
+               LEAST(end_datetime, day + INTERVAL '1 day') AS end_datetime,
+               EPOCH(LEAST(end_datetime, day + INTERVAL '1 day') - GREATEST(start_datetime, day)) AS duration
+        FROM (
+            SELECT login_id, logout_id, user_id, start_datetime,
+                   COALESCE(end_datetime, DATE_TRUNC('day', start_datetime) + INTERVAL '1 day') AS end_datetime,
+                   UNNEST(generate_series(
+                       DATE_TRUNC('day', start_datetime),
+                       DATE_TRUNC('day', COALESCE(end_datetime, start_datetime)),
+                       INTERVAL '1 day'
+                   )) AS day
+            FROM logged_session
+        ) AS parts
+        WHERE LEAST(end_datetime, day + INTERVAL '1 day') > GREATEST(start_datetime, day)
+        OR day = DATE_TRUNC('day', start_datetime)
+    ''',
+}
+
+
+class DuckDBSession:
+    """
+    Runs crud's queries (written for SQLAlchemy sessions, with text() and :name parameters) on a DuckDB cursor.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, statement, params: dict = None):
+        sql = BIND_PARAMETER.sub(r'$\1', str(statement))
+        # DuckDB rejects parameters the query doesn't use
+        names = set(BIND_PARAMETER.findall(str(statement)))
+        return self.cursor.execute(sql, {k: v for k, v in (params or {}).items() if k in names}).fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+connection = duckdb.connect()
+# whether the views were created (by the first session, whether or not there are Parquet files yet)
+views_created = False
+# tables with no Parquet files yet (all of them until the views are created), whose views are re-created once they have some
+empty_tables = set(TABLE_COLUMNS)
+# modification time of the exchange rates file when it was last loaded
+loaded_mtime = None
+lock = threading.Lock()
+
+
+def create_views(path: str = PARQUET_PATH):
+    global views_created
+    with lock:
+        empty_tables.clear()
+        for table, columns in TABLE_COLUMNS.items():
+            columns = [column.split() for column in columns.split(', ')]
+            parquet_glob = get_parquet_glob(table, path)
+            if glob.glob(parquet_glob):
+                # partition values are read as strings
+                select = ', '.join(f'CAST({name} AS {type}) AS {name}' if name == 'date' else name for name, type in columns)
+                hive_partitioning = 'true' if table in PARTITIONED_TABLES else 'false'
+                source = f"read_parquet('{parquet_glob}', hive_partitioning = {hive_partitioning})"
+            else:
+                empty_tables.add(table)
+                select = ', '.join(f'CAST(NULL AS {type}) AS {name}' for name, type in columns)
+                source = '(SELECT 1) WHERE false'
+            connection.execute(f'CREATE OR REPLACE VIEW "{table}" AS SELECT {select} FROM {source}')
+        for view, sql in VIEWS.items():
+            connection.execute(f'CREATE OR REPLACE VIEW {view} AS {sql}')
+        views_created = True
+
+
+def load_exchange_rates(path: str = EXCHANGE_RATES_PATH):
+    global loaded_mtime
+    mtime = os.path.getmtime(path)
+    exchange_rates = pd.DataFrame(read_exchange_rates(path), columns=['currency', 'rate_to_usd', 'valid_from'])
+    with lock:
+        connection.register('exchange_rates_df', exchange_rates)
+        connection.execute('CREATE OR REPLACE TABLE exchange_rate AS '
+                           'SELECT currency, CAST(valid_from AS DATE) AS valid_from, rate_to_usd FROM exchange_rates_df')
+        connection.unregister('exchange_rates_df')
+        loaded_mtime = mtime
+
+
+def get_duckdb_session():
+    # the views are created by the first session (empty ones for the tables with no files yet, so queries find no rows
+    # rather than no tables), pick up new files of the tables that have some on their own, the others' views are
+    # re-created once they do, and exchange rates are reloaded whenever their file changes
+    # (whichever worker ingested the events or rates)
+    if not views_created or (empty_tables and any(glob.glob(get_parquet_glob(table)) for table in empty_tables)):
+        create_views()
+    if os.path.getmtime(EXCHANGE_RATES_PATH) != loaded_mtime:
+        load_exchange_rates()
+    return DuckDBSession(connection.cursor())
@@ -0,0 +1,51 @@
+import datetime
+import json
+import os
+
+from sqlalchemy.orm import Session
+
+from .crud import get_currencies_without_exchange_rate, replace_exchange_rates
+
+EXCHANGE_RATES_PATH = os.getenv("EXCHANGE_RATES_PATH", "./src/exchange_rates.jsonl")
+
+# modification time of the exchange rates file when it was last loaded into the DB (by this process)
+loaded_mtime = None
+
+
+def read_exchange_rates(path: str):
+    """
+    Reads exchange rates from a JSONL file with one rate per line, e.g. {"currency": "EUR", "rate_to_usd": "1.3"},
+    optionally with the date (YYYY-MM-DD) the rate applies from, e.g. {"currency": "EUR", "rate_to_usd": "1.3", "date": "2010-05-15"}.
+    """
+    exchange_rates = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            exchange_rate = json.loads(line)
+            exchange_rates.append({
+                'currency': exchange_rate['currency'],
+                'rate_to_usd': float(exchange_rate['rate_to_usd']),
+                'valid_from': datetime.date.fromisoformat(exchange_rate['date']) if exchange_rate.get('date') else None,
+            })
+    return exchange_rates
+
+
+def load_exchange_rates(db: Session, path: str = EXCHANGE_RATES_PATH, force: bool = False):
+    """
+    Loads the exchange rates file into the DB, unless it hasn't changed since it was last loaded.
+    Either way, logs the currencies of revenue that has no rate to be converted to USD with.
+    Returns whether the rates were (re)loaded.
+    """
+    global loaded_mtime
+    mtime = os.path.getmtime(path)
+    reloaded = force or mtime != loaded_mtime
+    if reloaded:
+        replace_exchange_rates(db, read_exchange_rates(path))
+        loaded_mtime = mtime
+        print(f"Loaded exchange rates from {path}.", flush=True)
+    currencies = get_currencies_without_exchange_rate(db)
+    if currencies:
+        print(f"No exchange rate for revenue in {', '.join(currencies)}, which is left out of the revenue in USD.",
+              flush=True)
+    return reloaded
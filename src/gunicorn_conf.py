@@ -0,0 +1,16 @@
+# Multi-worker launch mode: gunicorn -c src/gunicorn_conf.py src.main:app
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8001')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+# the app is loaded once, in the master process, before the workers are forked
+# (each worker then initializes the DB in the background, one at a time, so only the first one does the work)
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+
+
+def post_fork(server, worker):
+    # connections opened by the master process must not be shared with the forked workers
+    from src.db import engine
+    engine.dispose(close=False)
@@ -0,0 +1,117 @@
+import io
+import itertools
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.json
+
+from .instrumentation import PipelineReport
+
+try:
+    import orjson as json
+except ImportError:
+    import json
+
+EVENT_COLUMNS = ['event_id', 'event_timestamp', 'event_type', 'event_data']
+EVENT_DATA_COLUMNS = ['user_id', 'country', 'name', 'device_os', 'marketing_campaign',
+                      'transaction_amount', 'transaction_currency']
+# columns with a handful of distinct values, kept as categoricals (a small code per row instead of a string object)
+CATEGORICAL_COLUMNS = ['event_type', 'country', 'device_os', 'transaction_currency']
+
+# the events as they are expected to be, for pyarrow to parse them (lines that don't fit are parsed one by one instead)
+EVENT_SCHEMA = pa.schema([
+    ('event_id', pa.int64()),
+    ('event_timestamp', pa.int64()),
+    ('event_type', pa.string()),
+    ('event_data', pa.struct([
+        ('user_id', pa.string()),
+        ('country', pa.string()),
+        ('name', pa.string()),
+        ('device_os', pa.string()),
+        ('marketing_campaign', pa.string()),
+        ('transaction_amount', pa.float64()),
+        ('transaction_currency', pa.string()),
+    ])),
+])
+
+
+def flatten_events(records: list):
+    """
+    Flattens parsed events into a DataFrame with event_data's fields as columns, column by column
+    (instead of creating a Series per row). Every column the cleaning steps rely on is always present.
+    """
+    events = pd.DataFrame.from_records(records, columns=EVENT_COLUMNS)
+    event_data = pd.DataFrame.from_records(
+        [data if isinstance(data, dict) else {} for data in events.pop('event_data')],
+        index=events.index
+    )
+    event_data = event_data.reindex(columns=event_data.columns.union(EVENT_DATA_COLUMNS, sort=False))
+    events = pd.concat([events, event_data], axis=1)
+    return events.astype({column: 'category' for column in CATEGORICAL_COLUMNS})
+
+
+def parse_events_table(data: bytes):
+    """
+    Parses JSON lines of events with pyarrow (in native code, without creating a Python object per field),
+    or returns None if some of them don't fit EVENT_SCHEMA (e.g. a field of another type, or no events at all).
+    """
+    try:
+        return pyarrow.json.read_json(io.BytesIO(data), parse_options=pyarrow.json.ParseOptions(
+            explicit_schema=EVENT_SCHEMA, unexpected_field_behavior='ignore'
+        ))
+    except pa.ArrowInvalid:
+        return None
+
+
+def flatten_events_table(table: pa.Table):
+    # as flatten_events does, out of the table parse_events_table returns
+    table = table.flatten()
+    table = table.rename_columns([name.removeprefix('event_data.') for name in table.column_names])
+    return table.to_pandas(categories=CATEGORICAL_COLUMNS)
+
+
+def is_complete(line: bytes):
+    try:
+        json.loads(line)
+        return True
+    except ValueError:
+        return False
+
+
+def read_events_in_chunks(path: str, chunk_size: int = 0, offset: int = 0, report: PipelineReport = None):
+    """
+    Yields flattened events chunk_size lines at a time (or all of them at once if chunk_size is 0),
+    starting at the given byte offset, together with the byte offset right after the chunk.
+    Only one chunk of the file is held in memory, and a last line that isn't complete yet
+    (because the file is still being appended to) is left for the next read.
+    With a report, reading, parsing and flattening are timed in it.
+    """
+    if report is None:
+        report = PipelineReport('read_events')
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            with report.stage('read_lines') as stage:
+                # a single buffer for the whole chunk (which is all pyarrow needs), rather than an object per line
+                data = b''.join(itertools.islice(f, chunk_size)) if chunk_size else f.read()
+                last_line = data[data.rfind(b'\n') + 1:]
+                if last_line and not is_complete(last_line):
+                    data = data[:-len(last_line)]
+                stage.rows_in = stage.rows_out = data.count(b'\n') + (bool(data) and not data.endswith(b'\n'))
+            if not data:
+                break
+            offset += len(data)
+            with report.stage('parse_json', stage.rows_out) as stage:
+                table = parse_events_table(data)
+                if table is None:
+                    records = [json.loads(line) for line in data.split(b'\n') if line.strip()]
+                    if not all(isinstance(record, dict) for record in records):
+                        raise ValueError("Events should be JSON objects, one per line.")
+                del data
+                stage.rows_out = len(records) if table is None else table.num_rows
+            with report.stage('flatten_events', stage.rows_out):
+                events = flatten_events(records) if table is None else flatten_events_table(table)
+                del table
+            yield events, offset
+            if not chunk_size:
+                break
@@ -1,180 +1,455 @@
 import numpy as np
 import pandas as pd
 import datetime
-import pycountry
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from sqlalchemy.orm import Session
 
-from .crud import insert_event, add_matching_logout_ids
+from .crud import (get_ingestion_watermark, set_ingestion_watermark, get_existing_event_ids,
+                   get_registration_timestamps, get_open_sessions, refresh_daily_stats, to_utc_datetime)
+from .exchange_rates import load_exchange_rates
+from .ingest import read_events_in_chunks
+from .instrumentation import PipelineReport, StageStats
+from .load import populate_db, load_rejected_events
+from .parquet import PARQUET_PATH, clear_parquet, write_parquet
+from .sessions import pair_login_logout_events, get_sessions, mark_events_in_sessions
+from .validation import VALIDATION_RULES, validate_events, get_rejected_events
 
 import time
 
+EVENTS_PATH = os.getenv("EVENTS_PATH", "./src/events.jsonl")
+# the directory other files of events can be ingested from with POST /ingest (the events file's, by default)
+INGEST_DIR = os.getenv("INGEST_DIR", os.path.dirname(os.path.abspath(EVENTS_PATH)))
+# when running locally
+# EVENTS_PATH = "events.jsonl"
+
+# if set, events are read, cleaned and loaded this many lines at a time instead of all at once
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "0"))
+# if more than 1, the cleaning steps applied per user run in this many processes (on a partition of the users each)
+CLEANING_WORKERS = int(os.getenv("CLEANING_WORKERS", "1"))
+# if set, the events dropped by a validation rule are stored in the rejected_event table (with the rule they failed)
+QUARANTINE_REJECTED_EVENTS = os.getenv("QUARANTINE_REJECTED_EVENTS", "").lower() in ("1", "true", "yes")
+
 # omitting timezones for clarity
-START_DATE = datetime.datetime(2010, 5, 8, 0, 0).timestamp()
-END_DATE = datetime.datetime(2010, 5, 23, 0, 0).timestamp()
+START_DATE = datetime.datetime(2010, 5, 8, 0, 0, tzinfo=datetime.timezone.utc).timestamp()
+END_DATE = datetime.datetime(2010, 5, 23, 0, 0, tzinfo=datetime.timezone.utc).timestamp()
+
+EVENT_TYPES = ['registration', 'login', 'logout', 'transaction']
+
 
-VALID_DEVICE_OS = ['iOS', 'Android', 'Web']
-VALID_TRANSACTION_AMOUNT = [0.99, 1.99, 2.99, 4.99, 9.99]
-VALID_TRANSACTION_CURRENCY = ['EUR', 'USD']
+@dataclass
+class CleaningState:
+    """
+    What the cleaning steps need to know about previously cleaned events, when events are cleaned in batches.
+    Batches are expected to come in (roughly) chronological order, as they do in the events file.
+    """
+    # sorted, without duplicates (8 bytes per event, rather than a set's ~60)
+    seen_event_ids: np.ndarray = field(default_factory=lambda: np.empty(0, dtype='int64'))
+    # user_id -> timestamp of the user's (first) registration
+    registration_timestamps: dict = field(default_factory=dict)
+    # user_id -> (event_id, event_timestamp) of the login of a session with no logout yet
+    open_sessions: dict = field(default_factory=dict)
 
-def initialize(db: Session):
+
+def initialize(db: Session, chunk_size: int = INGEST_CHUNK_SIZE, parquet_path: str = PARQUET_PATH):
     print("Cleaning data & populating DB...", flush=True)
     start = time.time()
-    all_events = pd.read_json(path_or_buf="./src/events.jsonl", lines=True)
-    # when running locally
-    # all_events = pd.read_json(path_or_buf="events.jsonl", lines=True)
 
-    # flatten
-    all_events = pd.concat([all_events.drop(['event_data'], axis=1), all_events['event_data'].apply(pd.Series)], axis=1)
+    report = PipelineReport('initialize')
+    populate(db, report, EVENTS_PATH, chunk_size, parquet_path)
+
+    end = time.time()
+    print("Data cleaning and database population took: " + str(end - start) + "s.", flush=True)
+    report.finish()
+
+
+def populate(db: Session, report: PipelineReport, path: str = EVENTS_PATH, chunk_size: int = INGEST_CHUNK_SIZE,
+             parquet_path: str = PARQUET_PATH):
+    """
+    Cleans and loads the whole events file into a DB without events (and the Parquet datasets, if enabled, which are
+    cleared first), rebuilds the rollups and loads the exchange rates, timing every stage in the report.
+    Returns the number of inserted events per type.
+    """
+    if parquet_path:
+        clear_parquet(parquet_path)
+    state = CleaningState()
+    counts = {'registration': 0, 'login_logout': 0, 'transaction': 0}
+    ingested_timestamps = []
+    for events, offset in read_events_in_chunks(path, chunk_size, report=report):
+        cleaned_events = clean_events(events, state, report)
+        load_events(db, cleaned_events, report, parquet_path)
+        ingested_timestamps += get_event_timestamp_range(*cleaned_events[:4])
+        set_ingestion_watermark(db, path, offset, max(ingested_timestamps, default=None))
+        for event_type, cleaned in zip(counts, cleaned_events):
+            counts[event_type] += len(cleaned)
+    with report.stage('refresh_stats'):
+        refresh_stats(db, ingested_timestamps)
+    with report.stage('load_exchange_rates'):
+        load_exchange_rates(db, force=True)
+    return counts
+
+
+def ingest_new_events(db: Session, path: str = EVENTS_PATH, chunk_size: int = INGEST_CHUNK_SIZE):
+    """
+    Cleans and loads only the events added to the file since its last ingestion (according to its watermark),
+    checking them against what is already in the DB instead of re-processing the whole history.
+    Returns the number of newly inserted events per type.
+    """
+    print(f"Ingesting new events from {path}...", flush=True)
+    start = time.time()
+
+    watermark = get_ingestion_watermark(db, path)
+    offset = watermark.file_offset if watermark else 0
+    if offset > os.path.getsize(path):
+        # the file was truncated or replaced (e.g. rotated) since: it is read from the start again,
+        # and the events already in the DB are dropped as duplicates
+        print(f"{path} is shorter than its watermark ({offset} bytes), reading it from the start.", flush=True)
+        offset = 0
+    report = PipelineReport('ingest_new_events')
+    counts = {'registration': 0, 'login_logout': 0, 'transaction': 0}
+    ingested_timestamps = []
+    for events, offset in read_events_in_chunks(path, chunk_size, offset, report):
+        with report.stage('get_cleaning_state', len(events)):
+            state = get_cleaning_state(db, events)
+        cleaned_events = clean_events(events, state, report)
+        load_events(db, cleaned_events, report)
+        # (logins from earlier batches whose sessions were closed by this one count as well, as their day's stats change)
+        ingested_timestamps += get_event_timestamp_range(*cleaned_events[:4])
+        set_ingestion_watermark(db, path, offset, max(ingested_timestamps, default=None))
+        for event_type, cleaned in zip(counts, cleaned_events):
+            counts[event_type] += len(cleaned)
+    with report.stage('refresh_stats'):
+        refresh_stats(db, ingested_timestamps)
+
+    end = time.time()
+    print(f"Ingesting {sum(counts.values())} new events took: {end - start}s.", flush=True)
+    report.finish()
+    return counts
+
+
+def load_events(db: Session, cleaned_events: tuple, report: PipelineReport, parquet_path: str = PARQUET_PATH):
+    # inserts a batch of cleaned events into the DB (and appends them to the Parquet datasets, if enabled)
+    n_events = sum(len(events) for events in cleaned_events[:3])
+    with report.stage('load', n_events):
+        populate_db(db, *cleaned_events[:4])
+    if parquet_path:
+        with report.stage('write_parquet', n_events):
+            write_parquet(*cleaned_events[:3], path=parquet_path)
+    if QUARANTINE_REJECTED_EVENTS:
+        with report.stage('quarantine_rejected_events', len(cleaned_events[4])):
+            load_rejected_events(db, cleaned_events[4])
+
+
+def get_cleaning_state(db: Session, events: pd.DataFrame):
+    """
+    Builds the cleaning state for a batch of new events out of what is already in the DB, for the batch's events and users only.
+    Note that new events are only deduplicated against events stored in the DB, not against previously discarded ones.
+    """
+    event_ids = pd.to_numeric(events['event_id'], errors='coerce').dropna().astype('int64').unique().tolist()
+    user_ids = events['user_id'].dropna().unique().tolist()
+    return CleaningState(
+        seen_event_ids=np.sort(np.fromiter(get_existing_event_ids(db, event_ids), dtype='int64')),
+        registration_timestamps=get_registration_timestamps(db, user_ids),
+        open_sessions=get_open_sessions(db, user_ids),
+    )
+
+
+def get_event_timestamp_range(*events: pd.DataFrame):
+    timestamps = [e['event_timestamp'] for e in events if len(e)]
+    if not timestamps:
+        return []
+    return [min(t.min() for t in timestamps), max(t.max() for t in timestamps)]
+
+
+def refresh_stats(db: Session, ingested_timestamps: list):
+    # rebuilds the daily rollups for the days the ingested events happened on
+    if ingested_timestamps:
+        refresh_daily_stats(db,
+                            to_utc_datetime(min(ingested_timestamps)).date(),
+                            to_utc_datetime(max(ingested_timestamps)).date())
+
+
+def clean_events(all_events: pd.DataFrame, state: CleaningState = None, report: PipelineReport = None,
+                 workers: int = CLEANING_WORKERS):
+    """
+    Applies the data cleaning steps to a batch of flattened events.
+    With a state, events are also checked against (and the state updated with) previously cleaned batches.
+    With a report, every step is timed and its kept and dropped rows are counted in it.
+    With more than one worker, the steps applied per user run in that many processes, on a partition of the users each.
+
+    Returns the registration, login & logout and transaction events to be inserted, plus the previously
+    inserted logins (their event_id and new matching_login_or_logout_id) whose logout came in this batch,
+    and the events dropped by a validation rule (with the rule's name and the value that failed it).
+    """
+    if state is None:
+        state = CleaningState()
+    if report is None:
+        report = PipelineReport('clean_events')
 
     # --- data cleaning ---
+    # every step narrows down the positions of the events it keeps, and the events are only copied once the steps
+    # that need all of them are done (and then once more per event type)
 
     # drop rows with no event_id, timestamp or user_id
-    all_events = all_events[all_events['event_id'].notna()]
-    all_events = all_events[all_events['event_timestamp'].astype(bool)]
-    all_events = all_events[all_events['user_id'].astype(bool)]
+    with report.stage('drop_incomplete_events', len(all_events)) as stage:
+        complete = (
+            all_events['event_id'].notna() &
+            all_events['event_timestamp'].notna() & all_events['event_timestamp'].astype(bool) &
+            all_events['user_id'].notna() & all_events['user_id'].astype(bool)
+        )
+        positions = np.flatnonzero(complete.to_numpy())
+        stage.rows_out = len(positions)
 
     # remove duplicates by id, keeping the chronologically first event
-    all_events = all_events.sort_values(by='event_timestamp')
-    all_events = all_events.drop_duplicates(subset='event_id', keep='first')
+    # (the only sort of the events, which all of the steps after it keep them in; it is stable, so events
+    # with the same timestamp stay in the order they came in)
+    with report.stage('drop_duplicate_events', len(positions)) as stage:
+        timestamps = all_events['event_timestamp'].to_numpy()[positions]
+        positions = positions[np.argsort(timestamps, kind='stable')]
+        event_ids = all_events['event_id'].iloc[positions]
+        positions = positions[~event_ids.duplicated(keep='first').to_numpy() & ~is_seen(event_ids, state.seen_event_ids)]
+        state.seen_event_ids = add_seen(state.seen_event_ids, all_events['event_id'].iloc[positions])
+        stage.rows_out = len(positions)
 
     # dates (filter events that happened before May 8, 2010 or after May 22, 2010)
-    all_events = all_events.query('event_timestamp >= @START_DATE and event_timestamp < @END_DATE')
+    with report.stage('filter_dates', len(positions)) as stage:
+        timestamps = all_events['event_timestamp'].iloc[positions]
+        positions = positions[((timestamps >= START_DATE) & (timestamps < END_DATE)).to_numpy()]
+        stage.rows_out = len(positions)
 
     # drop invalid event types
-    all_events = all_events.loc[all_events['event_type'].isin(['registration', 'login', 'logout', 'transaction'])]
+    with report.stage('drop_invalid_event_types', len(positions)) as stage:
+        positions = positions[all_events['event_type'].iloc[positions].isin(EVENT_TYPES).to_numpy()]
+        stage.rows_out = len(positions)
+
+    all_events = all_events.take(positions)
+    if workers > 1:
+        return clean_user_events_in_parallel(all_events, state, report, workers)
+    return clean_user_events(all_events, state, report)
+
+
+def clean_user_events(all_events: pd.DataFrame, state: CleaningState, report: PipelineReport):
+    """
+    Applies the data cleaning steps that only depend on each user's own events (and on the state of that user)
+    to deduplicated, chronologically sorted events, so they can be applied to any partition of the users separately.
+    The steps build a single mask of the events to keep, out of which the events of each type are taken at the end.
+    Returns what clean_events returns.
+    """
+    is_registration = (all_events['event_type'] == 'registration').to_numpy()
+    is_transaction = (all_events['event_type'] == 'transaction').to_numpy()
+    user_ids = all_events['user_id']
 
     # drop multiple registration events, keep only the first one
-    all_events = (
-        all_events
-        .loc[~((all_events['event_type'] == 'registration') & all_events.duplicated(subset=['event_type', 'user_id'], keep=False))]
-        .sort_values(by='event_timestamp')
-    )
+    with report.stage('drop_repeated_registrations', len(all_events)) as stage:
+        registration_user_ids = user_ids[is_registration]
+        keep = np.ones(len(all_events), dtype=bool)
+        keep[np.flatnonzero(is_registration)[
+            registration_user_ids.duplicated(keep=False).to_numpy() |
+            is_in(registration_user_ids, state.registration_timestamps)
+        ]] = False
+        stage.rows_out = int(keep.sum())
+
+    # drop rows failing a validation rule (e.g. registrations with an invalid country or device_os,
+    # transactions with an invalid amount or currency), all of the rules being run at once
+    # (before the events of unregistered users are filtered, so the events of users whose registration is dropped
+    # go with it, and before the events are split by type, so invalid transactions are never loaded)
+    with report.stage('validate_events', int(keep.sum())) as stage:
+        failed_rules = validate_events(all_events)
+        rejected = keep & (failed_rules >= 0)
+        rejected_events = get_rejected_events(all_events, failed_rules, rejected)
+        # every rule's rejections are counted as a stage of their own
+        rows_in = int(keep.sum())
+        for i, rule in enumerate(VALIDATION_RULES):
+            rows_out = rows_in - int((failed_rules[rejected] == i).sum())
+            report.add(StageStats(rule.name, calls=1, rows_in=rows_in, rows_out=rows_out))
+            rows_in = rows_out
+        keep &= ~rejected
+        stage.rows_out = int(keep.sum())
 
     # filter non-registration events done by nonexistent users
-    registered_user_ids = all_events.loc[all_events['event_type'] == 'registration', 'user_id']
-    all_events = all_events.loc[~(
-        (all_events['event_type'] != 'registration') & 
-        ~(all_events['user_id'].isin(registered_user_ids))
-    )]
+    with report.stage('filter_unregistered_users', int(keep.sum())) as stage:
+        registered_user_ids = user_ids[keep & is_registration]
+        keep &= (is_registration | user_ids.isin(registered_user_ids).to_numpy() |
+                 is_in(user_ids, state.registration_timestamps))
+        stage.rows_out = int(keep.sum())
 
     # filter non-registration events done before user registered 
-    registration_timestamps_df = (
-        all_events[all_events['event_type'] == 'registration']
-            .set_index('user_id')
-            .rename(columns={'event_timestamp': 'registration_timestamp'})
-    )
-    all_events_with_registration_timestamp = ( 
-        all_events
-            .merge(registration_timestamps_df, left_on='user_id', right_index=True, how='left')
-    )
-    all_events = all_events.loc[~(
-        (all_events['event_type'] != 'registration') & 
-        (all_events['event_timestamp'] < 
-         all_events_with_registration_timestamp['registration_timestamp'])
-    )]
+    with report.stage('filter_events_before_registration', int(keep.sum())) as stage:
+        registration_events = all_events[keep & is_registration]
+        state.registration_timestamps.update(zip(registration_events['user_id'], registration_events['event_timestamp']))
+        registration_timestamps = look_up(user_ids, state.registration_timestamps)
+        keep &= is_registration | ~(all_events['event_timestamp'].to_numpy() < registration_timestamps)
+        stage.rows_out = int(keep.sum())
 
     # filter invalid login & logout events and add matching logout or login events
-    login_logout_events = all_events[all_events['event_type'].isin(['login', 'logout'])].copy()
-    login_logout_events.sort_values(by=['user_id', 'event_timestamp'], inplace=True)
-    login_logout_events['matching_login_or_logout_id'] = np.nan
-    login_logout_events['valid'] = False
-    login_logout_events = login_logout_events.reset_index(drop=True)
-    pd.set_option('display.max_columns', None)
-
-    for idx, row in enumerate(login_logout_events.itertuples()):
-        if row.event_type == 'login':
-            if idx == 0:
-                login_logout_events.loc[idx, 'valid'] = True
-            else:
-                for prev_idx in range(idx-1, -1, -1):
-                    prev_row = login_logout_events.iloc[prev_idx]
-                    if (prev_row['event_type'] == 'logout' and
-                        prev_row['user_id'] == row.user_id and
-                        prev_row['valid'] == True):
-                        login_logout_events.loc[idx, 'valid'] = True
-                        break
-                    elif prev_row['user_id'] != row.user_id:
-                        login_logout_events.loc[idx, 'valid'] = True
-                        break
-                    elif (prev_row['event_type'] == 'login' and
-                          prev_row['user_id'] == row.user_id and
-                          prev_row['valid'] == True):
-                        break
-
-        # logout
-        else:
-            if idx != 0:
-                for prev_idx in range(idx-1, -1, -1):
-                    prev_row = login_logout_events.iloc[prev_idx]
-                    if (prev_row['event_type'] == 'login' and
-                        prev_row['user_id'] == row.user_id and
-                        prev_row['valid'] == True):
-                        login_logout_events.loc[idx, 'valid'] = True
-                        login_logout_events.loc[idx, 'matching_login_or_logout_id'] = prev_row['event_id']
-                        login_logout_events.loc[prev_idx, 'matching_login_or_logout_id'] = row.event_id
-                        break
-                    elif prev_row['user_id'] != row.user_id:
-                        break
-                    elif (prev_row['event_type'] == 'logout' and
-                          prev_row['user_id'] == row.user_id and
-                          prev_row['valid'] == True):
-                        break
-
-    login_logout_events = login_logout_events.loc[login_logout_events['valid'] == True]
-    login_logout_events.sort_values(by=['user_id', 'event_timestamp'], inplace=True) # --
+    # (sessions left open by previous batches are carried over as their logins, so they can be closed in this one)
+    login_logout_events = all_events[keep & ~is_registration & ~is_transaction].assign(carried=False)
+    with report.stage('pair_login_logout_events', len(login_logout_events)) as stage:
+        carried_user_ids = [user_id for user_id in user_ids[keep].unique() if user_id in state.open_sessions]
+        if carried_user_ids:
+            carried_login_events = pd.DataFrame({
+                'event_id': [state.open_sessions[user_id][0] for user_id in carried_user_ids],
+                'event_timestamp': [state.open_sessions[user_id][1] for user_id in carried_user_ids],
+                'event_type': 'login',
+                'user_id': carried_user_ids,
+                'carried': True,
+            }).astype({'event_type': login_logout_events['event_type'].dtype})
+            login_logout_events = pd.concat([carried_login_events, login_logout_events], ignore_index=True)
+        # (sorted by user_id and event_timestamp)
+        login_logout_events = pair_login_logout_events(login_logout_events)
+        login_logout_events = login_logout_events[login_logout_events['valid'].to_numpy()]
+        stage.rows_out = int((~login_logout_events['carried']).sum())
 
     # filter transactions that are done outside the user's session
-    transaction_events = all_events[all_events['event_type'] == 'transaction'].copy()
-    transaction_events['valid'] = False
-    transaction_events = transaction_events.reset_index(drop=True)
-
-    for idx, row in enumerate(transaction_events.itertuples()):
-        matching_login_logout_for_user = login_logout_events.loc[login_logout_events['user_id'] == row.user_id]
-        for matching_idx, matching_login_logout_row in enumerate(matching_login_logout_for_user.itertuples()):
-            if matching_login_logout_row.event_type == 'login':
-                if row.event_timestamp > matching_login_logout_row.event_timestamp:
-                    shifted_timestamp = matching_login_logout_for_user['event_timestamp'].shift(-1).iloc[matching_idx]
-                    # means login has no matching logout event
-                    if np.isnan(shifted_timestamp):
-                        transaction_events.loc[idx, 'valid'] = True
-                    # otherwise shifted timestamp is the matching logout event's timestamp
-                    elif row.event_timestamp < shifted_timestamp:
-                        transaction_events.loc[idx, 'valid'] = True
-
-    transaction_events = transaction_events.loc[transaction_events['valid'] == True]
-
-    # drop rows with invalid country (registration events)
-    all_countries = list(pycountry.countries)
-    alpha_2_codes = [country.alpha_2 for country in all_countries]
-    all_events = all_events.loc[~((all_events['event_type'] == 'registration') & 
-                                ~(all_events['country'].isin(alpha_2_codes)))]
-
-    # drop rows with invalid device_os (registration events)
-    all_events = all_events.loc[~((all_events['event_type'] == 'registration') & 
-                                ~(all_events['device_os'].isin(VALID_DEVICE_OS)))]
-
-    # drop rows with invalid transaction amount (transaction events)
-    all_events = all_events.loc[~((all_events['event_type'] == 'transaction') & 
-                                ~(all_events['transaction_amount'].isin(VALID_TRANSACTION_AMOUNT)))]
-
-    # drop rows with invalid transaction currency (transaction events)
-    all_events = all_events.loc[~((all_events['event_type'] == 'transaction') & 
-                                ~(all_events['transaction_currency'].isin(VALID_TRANSACTION_CURRENCY)))]
-
-
-    # --- populate database ---
-    registration_events = all_events[all_events['event_type'] == 'registration']
-    registration_events.apply(lambda x: insert_event(db, x), axis=1)
-    db.commit()
-
-    login_logout_events[login_logout_events['event_type'] == 'login'].apply(lambda x: insert_event(db, x), axis=1)
-    db.commit()
-    login_logout_events[login_logout_events['event_type'] == 'logout'].apply(lambda x: insert_event(db, x), axis=1)
-    db.commit()
-    login_logout_events[login_logout_events['event_type'] == 'login'].apply(lambda x: add_matching_logout_ids(db, x), axis=1)
-
-    transaction_events.apply(lambda x: insert_event(db, x), axis=1)
-    db.commit()
+    transaction_events = all_events[keep & is_transaction]
+    with report.stage('filter_transactions_outside_sessions', len(transaction_events)) as stage:
+        transaction_events = transaction_events[
+            mark_events_in_sessions(transaction_events, get_sessions(login_logout_events))
+        ]
+        stage.rows_out = len(transaction_events)
 
-    end = time.time()
-    print("Data cleaning and database population took: " + str(end - start) + "s.", flush=True)
+    # remember sessions left open for the next batches
+    with report.stage('track_open_sessions', len(login_logout_events)):
+        last_login_logout_events = login_logout_events.drop_duplicates(subset='user_id', keep='last')
+        is_login = (last_login_logout_events['event_type'] == 'login').to_numpy()
+        open_sessions = last_login_logout_events[is_login]
+        state.open_sessions.update(zip(
+            open_sessions['user_id'], zip(open_sessions['event_id'], open_sessions['event_timestamp'])
+        ))
+        for user_id in last_login_logout_events.loc[~is_login, 'user_id']:
+            state.open_sessions.pop(user_id, None)
+
+    is_carried = login_logout_events['carried'].to_numpy()
+    carried_login_events = login_logout_events[is_carried]
+    login_logout_events = login_logout_events[~is_carried].drop(columns='carried')
+    carried_login_events = carried_login_events[carried_login_events['matching_login_or_logout_id'].notna().to_numpy()]
+
+    return registration_events, login_logout_events, transaction_events, carried_login_events, rejected_events
+
+
+# what the worker processes of clean_user_events_in_parallel clean (inherited from the parent process when forked)
+partitioned_events = None
+
+
+def clean_user_events_in_parallel(all_events: pd.DataFrame, state: CleaningState, report: PipelineReport, workers: int):
+    """
+    Hash-partitions the events by user_id and applies clean_user_events to every partition in a process pool.
+    Workers are forked if this process runs no other threads, so they read the events and the state from the parent's
+    memory instead of getting them pickled. Otherwise (e.g. in the API, whose threads may hold locks a forked child
+    would inherit held), they are started by a fork server, and get their partition's events and users' state pickled.
+    Either way they return the positions of the events they kept (plus the new matching identifiers and their users'
+    state), out of which the result is rebuilt in the same order as clean_user_events would return it.
+    """
+    global partitioned_events
+    partitions = pd.util.hash_array(all_events['user_id'].to_numpy()) % workers
+    with report.stage('clean_partitions', len(all_events)) as stage:
+        if threading.active_count() == 1:
+            partitioned_events = (all_events, partitions, state)
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+                    results = list(executor.map(clean_partition, range(workers)))
+            finally:
+                partitioned_events = None
+        else:
+            context = multiprocessing.get_context('forkserver')
+            # (the fork server imports this module once, rather than every worker)
+            context.set_forkserver_preload([__name__])
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                results = list(executor.map(clean_partition_events, *zip(*(
+                    get_partition(all_events, partitions, state, partition) for partition in range(workers)
+                ))))
+
+        registration_positions, login_logout_positions, matching_ids, transaction_positions = (
+            np.concatenate(arrays) for arrays in list(zip(*results))[:4]
+        )
+        registration_events = all_events.take(np.sort(registration_positions))
+        # every user's events are in a single partition, already in order
+        login_logout_events = (
+            all_events
+            .take(login_logout_positions)
+            .assign(matching_login_or_logout_id=matching_ids, valid=True)
+            .sort_values(by='user_id', kind='stable')
+        )
+        transaction_events = all_events.take(np.sort(transaction_positions)).reset_index(drop=True)
+        carried_login_events = pd.concat([result[4] for result in results]).sort_values(by='user_id', kind='stable')
+        rejected_events = pd.concat([result[5] for result in results])
+        rejected_events = rejected_events.iloc[np.argsort(np.concatenate([result[6] for result in results]), kind='stable')]
+        stage.rows_out = len(registration_events) + len(login_logout_events) + len(transaction_events)
+
+    for result in results:
+        user_ids, registration_timestamps, open_sessions, stages = result[7:]
+        state.registration_timestamps.update(registration_timestamps)
+        for user_id in user_ids:
+            state.open_sessions.pop(user_id, None)
+        state.open_sessions.update(open_sessions)
+        # the steps' times are summed over the workers (which ran at the same time)
+        for stats in stages:
+            report.add(stats)
+    return registration_events, login_logout_events, transaction_events, carried_login_events, rejected_events
+
+
+def get_partition(all_events: pd.DataFrame, partitions: np.ndarray, state: CleaningState, partition: int):
+    # the partition's events, with their positions, and the state of their users only
+    positions = np.flatnonzero(partitions == partition)
+    events = all_events.take(positions).assign(position=positions)
+    user_ids = events['user_id'].unique()
+    return events, CleaningState(
+        registration_timestamps={user_id: state.registration_timestamps[user_id]
+                                 for user_id in user_ids if user_id in state.registration_timestamps},
+        open_sessions={user_id: state.open_sessions[user_id] for user_id in user_ids if user_id in state.open_sessions},
+    )
+
+
+def clean_partition(partition: int):
+    all_events, partitions, state = partitioned_events
+    positions = np.flatnonzero(partitions == partition)
+    return clean_partition_events(all_events.take(positions).assign(position=positions), state)
+
+
+def clean_partition_events(events: pd.DataFrame, state: CleaningState):
+    report = PipelineReport('clean_partition', profile_stage='')
+    registration_events, login_logout_events, transaction_events, carried_login_events, rejected_events = (
+        clean_user_events(events, state, report)
+    )
+    user_ids = events['user_id'].unique()
+    return (
+        registration_events['position'].to_numpy(),
+        login_logout_events['position'].to_numpy(dtype='int64'),
+        login_logout_events['matching_login_or_logout_id'].to_numpy(),
+        transaction_events['position'].to_numpy(),
+        carried_login_events.drop(columns='position'),
+        rejected_events,
+        events.loc[rejected_events.index, 'position'].to_numpy(),
+        user_ids,
+        {user_id: state.registration_timestamps[user_id] for user_id in registration_events['user_id']},
+        {user_id: state.open_sessions[user_id] for user_id in user_ids if user_id in state.open_sessions},
+        list(report.stages.values()),
+    )
+
+
+def is_in(values: pd.Series, keys):
+    # unlike Series.isin, doesn't copy the (possibly large) set or dict of keys on every call,
+    # and looks every distinct value up only once
+    if not keys:
+        return np.zeros(len(values), dtype=bool)
+    return values.isin([value for value in values.unique() if value in keys]).to_numpy()
+
+
+def is_seen(event_ids: pd.Series, seen_event_ids: np.ndarray):
+    # binary searches in the sorted seen_event_ids
+    event_ids = event_ids.to_numpy(dtype='int64')
+    found = np.searchsorted(seen_event_ids, event_ids).clip(max=max(len(seen_event_ids) - 1, 0))
+    return seen_event_ids[found] == event_ids if len(seen_event_ids) else np.zeros(len(event_ids), dtype=bool)
+
+
+def add_seen(seen_event_ids: np.ndarray, event_ids: pd.Series):
+    # merges (unseen, distinct) event_ids into the sorted seen_event_ids
+    return np.sort(np.concatenate([seen_event_ids, event_ids.to_numpy(dtype='int64')]), kind='stable')
+
+
+def look_up(values: pd.Series, mapping: dict):
+    # the value mapping maps each of values to (NaN if none), looking every distinct value up only once
+    return values.map({value: mapping[value] for value in values.unique() if value in mapping}).to_numpy(dtype=float)
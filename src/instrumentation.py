@@ -0,0 +1,137 @@
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where only traced memory is reported
+    resource = None
+
+# if set, the stages of every initialization or ingestion are also written to this file, as JSON
+PIPELINE_REPORT_PATH = os.getenv("PIPELINE_REPORT_PATH", "")
+# if set, Python's allocations are traced to report every stage's own peak memory (which slows the pipeline down),
+# otherwise how much each stage raised the process's peak resident memory is reported
+PIPELINE_TRACE_MEMORY = os.getenv("PIPELINE_TRACE_MEMORY", "").lower() in ("1", "true", "yes")
+# if set to a stage's name (e.g. pair_login_logout_events), that stage is run under cProfile,
+# and its profile is written to PROFILE_PATH (to be read with pstats or snakeviz)
+PROFILE_STAGE = os.getenv("PROFILE_STAGE", "")
+PROFILE_PATH = os.getenv("PROFILE_PATH", "./pipeline.prof")
+
+
+@dataclass
+class StageStats:
+    """
+    What a stage of the pipeline did, summed over the batches it ran on.
+    """
+    name: str
+    calls: int = 0
+    rows_in: int = 0
+    rows_out: int = 0
+    seconds: float = 0
+    # the largest over the batches
+    peak_memory_delta_bytes: int = 0
+
+    @property
+    def rows_dropped(self):
+        return self.rows_in - self.rows_out
+
+
+class StageRun:
+    # handed to a stage's body, which sets the number of rows it kept
+    def __init__(self, rows_in: int):
+        self.rows_in = rows_in
+        self.rows_out = rows_in
+
+
+class PipelineReport:
+    """
+    Times the stages of a cleaning and loading run and counts the rows they keep and drop,
+    then logs them (a JSON line per stage) and optionally writes them to a JSON report.
+    """
+
+    def __init__(self, name: str, profile_stage: str = PROFILE_STAGE, trace_memory: bool = PIPELINE_TRACE_MEMORY):
+        self.name = name
+        self.stages = {}
+        self.started_at = time.time()
+        self.profile_stage = profile_stage
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int = 0):
+        run = StageRun(rows_in)
+        memory_before = self.get_memory()
+        profiled = name == self.profile_stage
+        if profiled:
+            self.profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield run
+        finally:
+            seconds = time.perf_counter() - start
+            if profiled:
+                self.profiler.disable()
+            stats = self.stages.setdefault(name, StageStats(name))
+            stats.calls += 1
+            stats.rows_in += run.rows_in
+            stats.rows_out += run.rows_out
+            stats.seconds += seconds
+            stats.peak_memory_delta_bytes = max(stats.peak_memory_delta_bytes,
+                                                self.get_peak_memory() - memory_before)
+
+    def add(self, stats: StageStats):
+        # adds up what a stage did elsewhere (e.g. in a worker process)
+        total = self.stages.setdefault(stats.name, StageStats(stats.name))
+        total.calls += stats.calls
+        total.rows_in += stats.rows_in
+        total.rows_out += stats.rows_out
+        total.seconds += stats.seconds
+        total.peak_memory_delta_bytes = max(total.peak_memory_delta_bytes, stats.peak_memory_delta_bytes)
+
+    def get_memory(self):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+        return get_peak_rss()
+
+    def get_peak_memory(self):
+        if self.trace_memory:
+            return tracemalloc.get_traced_memory()[1]
+        return get_peak_rss()
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started_at': self.started_at,
+            'seconds': time.time() - self.started_at,
+            'memory': 'traced' if self.trace_memory else 'peak_rss',
+            'stages': [dict(asdict(stats), rows_dropped=stats.rows_dropped) for stats in self.stages.values()],
+        }
+
+    def finish(self, path: str = PIPELINE_REPORT_PATH):
+        report = self.to_dict()
+        for stage in report['stages']:
+            print(json.dumps({'pipeline': self.name, **stage}), flush=True)
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+        if self.profiler and self.profile_stage in self.stages:
+            self.profiler.dump_stats(PROFILE_PATH)
+            print(f"Profile of {self.profile_stage} written to {PROFILE_PATH}.", flush=True)
+        return report
+
+
+def get_peak_rss():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
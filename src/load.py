@@ -0,0 +1,177 @@
+import io
+import time
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from . import models
+from .crud import insert_event, add_matching_logout_ids
+from .partitions import create_partitions
+
+# number of rows rendered to CSV at a time while streaming a table into COPY
+COPY_CHUNK_SIZE = 100_000
+
+
+class CsvStream(io.RawIOBase):
+    """
+    Read-only file-like object rendering a DataFrame to CSV lazily, chunk by chunk, as COPY reads from it,
+    so a table is streamed in a single COPY statement without materializing the whole CSV in memory.
+    """
+
+    def __init__(self, df: pd.DataFrame, chunk_size: int = COPY_CHUNK_SIZE):
+        self.df = df
+        self.chunk_size = chunk_size
+        self.position = 0
+        # the CSV of the current chunk, and how much of it was read (so each byte is only copied once, into a read)
+        self.buffer = b''
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self.offset == len(self.buffer):
+                if self.position >= len(self.df):
+                    break
+                chunk = self.df.iloc[self.position:self.position + self.chunk_size]
+                self.buffer, self.offset = chunk.to_csv(header=False, index=False).encode(), 0
+                self.position += self.chunk_size
+            end = len(self.buffer) if size < 0 else min(len(self.buffer), self.offset + size)
+            parts.append(self.buffer[self.offset:end])
+            if size > 0:
+                size -= end - self.offset
+            self.offset = end
+        return b''.join(parts)
+
+
+def copy_dataframe(cursor, table: str, df: pd.DataFrame):
+    columns = ', '.join(df.columns)
+    cursor.copy_expert(f'COPY "{table}" ({columns}) FROM STDIN WITH (FORMAT csv)', CsvStream(df))
+
+
+def to_datetime(event_timestamps: pd.Series):
+    # (as crud.to_utc_datetime, for whole columns)
+    return pd.to_datetime(event_timestamps, unit='s').to_numpy()
+
+
+def build_tables(registration_events: pd.DataFrame, login_logout_events: pd.DataFrame, transaction_events: pd.DataFrame):
+    """
+    Shapes the cleaned events into one DataFrame per table, with columns named and ordered as in the models.
+    Tables are returned in the order they have to be loaded in, because of foreign keys.
+    """
+    event = pd.DataFrame({
+        'id': pd.concat([
+            registration_events['event_id'],
+            login_logout_events['event_id'],
+            transaction_events['event_id']
+        ]).astype('int64').to_numpy()
+    })
+    user = pd.DataFrame({
+        'id': registration_events['user_id'].to_numpy(),
+        'country': registration_events['country'].to_numpy(),
+        'name': registration_events['name'].to_numpy(),
+        'device_os': registration_events['device_os'].to_numpy(),
+        'marketing_campaign': registration_events['marketing_campaign'].to_numpy(),
+    })
+    registration = pd.DataFrame({
+        'id': registration_events['event_id'].astype('int64').to_numpy(),
+        'event_datetime': to_datetime(registration_events['event_timestamp']),
+        'user_id': registration_events['user_id'].to_numpy(),
+    })
+    login_logout = pd.DataFrame({
+        'id': login_logout_events['event_id'].astype('int64').to_numpy(),
+        'event_datetime': to_datetime(login_logout_events['event_timestamp']),
+        'user_id': login_logout_events['user_id'].to_numpy(),
+        'is_login': (login_logout_events['event_type'] == 'login').to_numpy(),
+        'matching_login_or_logout_id': login_logout_events['matching_login_or_logout_id'].astype('Int64').to_numpy(),
+    })
+    transaction = pd.DataFrame({
+        'id': transaction_events['event_id'].astype('int64').to_numpy(),
+        'event_datetime': to_datetime(transaction_events['event_timestamp']),
+        'user_id': transaction_events['user_id'].to_numpy(),
+        'transaction_amount': transaction_events['transaction_amount'].to_numpy(),
+        'transaction_currency': transaction_events['transaction_currency'].to_numpy(),
+    })
+    return {
+        'event': event,
+        'user': user,
+        'registration': registration,
+        'login_logout': login_logout,
+        'transaction': transaction,
+    }
+
+
+def bulk_load(db: Session, registration_events: pd.DataFrame, login_logout_events: pd.DataFrame, transaction_events: pd.DataFrame):
+    cursor = db.connection().connection.cursor()
+    try:
+        for table, df in build_tables(registration_events, login_logout_events, transaction_events).items():
+            start = time.time()
+            copy_dataframe(cursor, table, df)
+            print(f"Loading {len(df)} rows into {table} took: {time.time() - start}s.", flush=True)
+    finally:
+        cursor.close()
+    db.commit()
+
+
+def orm_load(db: Session, registration_events: pd.DataFrame, login_logout_events: pd.DataFrame, transaction_events: pd.DataFrame):
+    start = time.time()
+    registration_events.apply(lambda x: insert_event(db, x), axis=1)
+    db.commit()
+    print(f"Loading {len(registration_events)} registrations took: {time.time() - start}s.", flush=True)
+
+    start = time.time()
+    login_logout_events[login_logout_events['event_type'] == 'login'].apply(lambda x: insert_event(db, x), axis=1)
+    db.commit()
+    login_logout_events[login_logout_events['event_type'] == 'logout'].apply(lambda x: insert_event(db, x), axis=1)
+    db.commit()
+    add_matching_logout_ids(db, login_logout_events[login_logout_events['event_type'] == 'login'])
+    print(f"Loading {len(login_logout_events)} logins & logouts took: {time.time() - start}s.", flush=True)
+
+    start = time.time()
+    transaction_events.apply(lambda x: insert_event(db, x), axis=1)
+    db.commit()
+    print(f"Loading {len(transaction_events)} transactions took: {time.time() - start}s.", flush=True)
+
+
+def populate_db(db: Session, registration_events: pd.DataFrame, login_logout_events: pd.DataFrame, transaction_events: pd.DataFrame,
+                carried_login_events: pd.DataFrame = None):
+    # COPY is PostgreSQL specific, other databases fall back to row by row ORM inserts
+    if db.get_bind().dialect.name == 'postgresql':
+        # (partitions of the weeks the events happened on are created first)
+        event_timestamps = pd.concat([login_logout_events['event_timestamp'], transaction_events['event_timestamp']])
+        if len(event_timestamps):
+            create_partitions(db, *pd.to_datetime([event_timestamps.min(), event_timestamps.max()], unit='s').date)
+        bulk_load(db, registration_events, login_logout_events, transaction_events)
+    else:
+        orm_load(db, registration_events, login_logout_events, transaction_events)
+
+    # logins inserted with a previous batch, whose logouts were just inserted
+    if carried_login_events is not None and len(carried_login_events):
+        add_matching_logout_ids(db, carried_login_events)
+        db.commit()
+
+
+def load_rejected_events(db: Session, rejected_events: pd.DataFrame):
+    # inserts the events dropped by a validation rule into the rejected_event table
+    if not len(rejected_events):
+        return
+    rejected_event = pd.DataFrame({
+        'event_id': rejected_events['event_id'].astype('int64').to_numpy(),
+        'event_datetime': to_datetime(rejected_events['event_timestamp']),
+        'event_type': rejected_events['event_type'].to_numpy(),
+        'user_id': rejected_events['user_id'].to_numpy(),
+        'rule': rejected_events['rule'].to_numpy(),
+        'value': rejected_events['value'].to_numpy(),
+    })
+    if db.get_bind().dialect.name == 'postgresql':
+        cursor = db.connection().connection.cursor()
+        try:
+            copy_dataframe(cursor, 'rejected_event', rejected_event)
+        finally:
+            cursor.close()
+    else:
+        db.execute(models.RejectedEvent.__table__.insert(), rejected_event.to_dict('records'))
+    db.commit()
+    print(f"Quarantined {len(rejected_event)} rejected events.", flush=True)
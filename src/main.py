@@ -1,30 +1,96 @@
 from fastapi import Depends, FastAPI, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-
-from . import crud, models
-from .db import SessionLocal, engine
-from .initialize import initialize
-
+from sqlalchemy import inspect
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+from pydantic import BaseModel
+
+from . import crud, models, schema_versions
+from .cache import CACHE_VERSION_CHECK_SECONDS, MemoryCache, response_cache, get_cache_key
+from .db import (SessionLocal, AsyncSessionLocal, IngestionSessionLocal, engine, async_engine, ingestion_engine,
+                 get_version_engine, ingestion_lock, ASYNC_DB, QUERY_BACKEND)
+if QUERY_BACKEND == "duckdb":
+    from . import duckdb_db
+from .exchange_rates import load_exchange_rates
+from .initialize import initialize, ingest_new_events, EVENTS_PATH, INGEST_DIR
+from .metrics import pool_metrics, render_pool_metrics, render_cache_metrics
+from .parquet import PARQUET_PATH, STAGING_PARQUET_PATH, swap_in_parquet
+from .user_index import USER_INDEX, USER_INDEX_REFRESH_SECONDS, UserIndex, build_user_index, get_data_version
+
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from enum import Enum
 import datetime
-
-models.Base.metadata.drop_all(bind=engine)
-models.Base.metadata.create_all(bind=engine)
+import os
+import threading
+import time
+import traceback
+
+# if set, the DB is fully re-populated on startup
+RESET_DB = os.getenv("RESET_DB", "").lower() in ("1", "true", "yes")
+# (when this process was started, or the app was loaded before its workers were forked)
+STARTED_AT = datetime.datetime.utcnow()
+# the most users the batched user stats endpoint accepts in one request
+MAX_BATCH_USERS = int(os.getenv("MAX_BATCH_USERS", "10000"))
 
 tags_metadata = [
     {
         "name": "user",
-        "description": "User level stats endpoints.\n Return value is a string or numeric value."
+        "description": "User level stats endpoints.\n Return value is a string or numeric value \
+                        (or, for /users/stats, a dict of all the stats per user and day)."
     },
     {
         "name": "game",
         "description": "Game level stats endpoints.\n Return value is a dict with indexes starting from 0. \
                         If the output is a single numeric value, the value will be stored in dict['0']. \
-                        If the output is grouped by country, the values are stored in multiple key-value pairs (as many as there are grouped countries)"
+                        If the output is grouped by country, the values are stored in multiple key-value pairs (as many as there are grouped countries). \
+                        With start_date and end_date, the values of every day (or week) in that range are returned, \
+                        each with the date the day (or week) starts on, as a time series."
+    },
+    {
+        "name": "ingestion",
+        "description": "Ingestion of new events (and exchange rates) into the DB."
+    },
+    {
+        "name": "monitoring",
+        "description": "Metrics of this worker process (DB pool and response cache), in the Prometheus text format, \
+                        and its liveness and readiness (whether it has data to serve) for health checks."
     }
 ]
 
-app = FastAPI(openapi_tags=tags_metadata)
+
+@dataclass
+class InitializationStatus:
+    # whether there is data to serve: the data of a previous run (while it is updated or re-populated), or the new one
+    ready: bool = False
+    running: bool = False
+    error: str | None = None
+    started_at: float | None = None
+    finished_at: float | None = None
+
+
+initialization = InitializationStatus()
+# this worker's index of the users, their logins and sessions (if USER_INDEX is set), once built
+user_index: UserIndex | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the API serves requests right away, while the DB is initialized in the background
+    # (a daemon thread, so a shutdown doesn't wait for it: an interrupted re-population leaves the live tables untouched)
+    threading.Thread(target=run_init_db, name='init_db', daemon=True).start()
+    if USER_INDEX:
+        threading.Thread(target=run_refresh_user_index, name='refresh_user_index', daemon=True).start()
+    if isinstance(response_cache, MemoryCache):
+        threading.Thread(target=run_check_cache_version, name='check_cache_version', daemon=True).start()
+    yield
+
+
+app = FastAPI(openapi_tags=tags_metadata, lifespan=lifespan)
 
 origins = [
     "http://localhost",
@@ -41,21 +107,241 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def get_db():
-    db = SessionLocal()
+def check_ready():
+    if not initialization.ready:
+        raise HTTPException(status_code=503, detail="The data is still being loaded, try again later.",
+                            headers={'Retry-After': '10'})
+
+
+def get_ingestion_db():
+    check_ready()
+    db = IngestionSessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+async def get_query_db():
+    # the connection is only checked out by the first query, so responses served from the cache don't need one
+    check_ready()
+    if ASYNC_DB:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+
+
+def get_duckdb():
+    check_ready()
+    db = duckdb_db.get_duckdb_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# game level stats can be computed by DuckDB out of the Parquet copy of the events instead
+get_game_db = get_duckdb if QUERY_BACKEND == "duckdb" else get_query_db
+
+
+def get_query_pool():
+    return async_engine.pool if ASYNC_DB else engine.pool
+
+
+async def check_out_connection(db: Session | AsyncSession):
+    # the request's connection is checked out before its first query, to measure how long it had to wait for it
+    if db.info.get("checked_out"):
+        return
+    start = time.perf_counter()
+    try:
+        if isinstance(db, AsyncSession):
+            await db.connection()
+        else:
+            await run_in_threadpool(db.connection)
+    except PoolTimeoutError:
+        pool_metrics.record_timeout()
+        raise HTTPException(status_code=503, detail="No DB connection available, try again later.")
+    pool_metrics.record_checkout(time.perf_counter() - start, get_query_pool().overflow())
+    db.info["checked_out"] = True
+
+
+async def run_query(query, db: Session | AsyncSession, *args):
+    # crud's queries are shared by both modes: with an async session they run on its asyncpg connection
+    # (without blocking the event loop while waiting on the DB), otherwise in the threadpool, as sync endpoints do
+    if isinstance(db, (Session, AsyncSession)):
+        await check_out_connection(db)
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(query, *args)
+    return await run_in_threadpool(query, db, *args)
+
+async def cached_query(query, db: Session | AsyncSession, *args):
+    # responses are cached per query and arguments, until the TTL passes or new data is ingested
+    if not response_cache:
+        return await run_query(query, db, *args)
+    key = get_cache_key(query.__name__, *args)
+    generation, found, result = await response_cache.get(key)
+    if found:
+        return result
+    result = jsonable_encoder(await run_query(query, db, *args))
+    await response_cache.set(key, result, generation)
+    return result
+
+
+async def user_query(query, db: Session | AsyncSession, *args):
+    # answered by the user index's method of the same name, if built, without the DB (or the cache)
+    if user_index is not None:
+        return getattr(user_index, query.__name__)(*args)
+    return await cached_query(query, db, *args)
+
+
+def invalidate_cache():
+    if response_cache:
+        response_cache.bump_generation()
+
+
+def check_cache_version():
+    # the memory cache of every worker is invalidated once events, exchange rates or a schema version are loaded
+    # by another worker (or instance), as seen in the DB
+    if not initialization.ready:
+        return
+    db = IngestionSessionLocal()
+    try:
+        response_cache.set_data_version((get_data_version(db), crud.get_exchange_rates_version(db)))
+    finally:
+        db.close()
+
+
+def run_check_cache_version():
+    while True:
+        try:
+            check_cache_version()
+        except Exception:
+            traceback.print_exc()
+        time.sleep(CACHE_VERSION_CHECK_SECONDS)
+
+
+def refresh_user_index(force: bool = False):
+    # (re)builds this worker's user index if events were ingested since it was built (by any process)
+    global user_index
+    if not USER_INDEX or not initialization.ready:
+        return
+    db = IngestionSessionLocal()
+    try:
+        if force or user_index is None or user_index.data_version != get_data_version(db):
+            start = time.time()
+            user_index = build_user_index(db)
+            print(f"Built the user index of {len(user_index.user_positions)} users and "
+                  f"{len(user_index.login_starts)} logins in {time.time() - start:.2f}s.", flush=True)
+    finally:
+        db.close()
+
+
+def run_refresh_user_index():
+    # other workers (and instances) ingest events too, so the index is checked for changes periodically
+    while True:
+        try:
+            refresh_user_index()
+        except Exception:
+            traceback.print_exc()
+        time.sleep(USER_INDEX_REFRESH_SECONDS)
+
+
+def has_all_tables():
+    # a DB without some of the tables was populated by an older version (or not at all)
+    return not set(models.Base.metadata.tables) - set(inspect(ingestion_engine).get_table_names())
+
+
 def init_db():
-    db = SessionLocal()
+    """
+    Fully re-populates a DB without data (or every DB, once per startup, if RESET_DB is set),
+    otherwise only ingests the events added to the file since the last run.
+    Workers initialize the DB one at a time, so the ones after the first find it up to date.
+    """
+    with ingestion_lock():
+        db = IngestionSessionLocal()
+        try:
+            # (a DB without a watermark for the events file was populated out of another one, or not at all)
+            watermark = crud.get_ingestion_watermark(db, EVENTS_PATH) if has_all_tables() else None
+            if not watermark or (RESET_DB and watermark.ingested_at < STARTED_AT):
+                db.close()
+                reload_db()
+            else:
+                ingest_new_events(db)
+                load_exchange_rates(db, force=True)
+        finally:
+            db.close()
+    invalidate_cache()
+
+
+def reload_db():
+    """
+    Loads the events into a new version of the tables (in a schema of its own), builds their indexes and analyzes them,
+    then points the live schema's views, which the API reads, at them. The previous version keeps being served meanwhile,
+    and is kept afterwards, to roll back to.
+    """
+    db = IngestionSessionLocal()
     try:
-        initialize(db)
+        version = schema_versions.create_schema_version(db)
+        version_engine = get_version_engine(version)
+        schema_versions.create_tables(version_engine)
+        version_db = sessionmaker(autocommit=False, autoflush=False, bind=version_engine)()
+        try:
+            initialize(version_db, parquet_path=STAGING_PARQUET_PATH)
+        finally:
+            version_db.close()
+        schema_versions.complete_schema_version(db, version_engine, version)
+        version_engine.dispose()
+        schema_versions.activate_schema_version(db, version)
+        if PARQUET_PATH:
+            swap_in_parquet(STAGING_PARQUET_PATH)
+        schema_versions.drop_old_schema_versions(db)
     finally:
         db.close()
 
-init_db()
+
+def run_init_db():
+    initialization.running = True
+    initialization.started_at = time.time()
+    try:
+        db = IngestionSessionLocal()
+        try:
+            # the data of a previous run is served while the DB is brought up to date
+            initialization.ready = has_all_tables() and crud.has_ingested_events(db)
+        finally:
+            db.close()
+        init_db()
+        initialization.ready = True
+        initialization.error = None
+        refresh_user_index(force=True)
+    except Exception as e:
+        # the data of a previous run (if any) keeps being served
+        initialization.error = repr(e)
+        traceback.print_exc()
+    finally:
+        initialization.running = False
+        initialization.finished_at = time.time()
+
+
+@app.get("/health/live", response_model=dict, tags=["monitoring"])
+async def get_liveness():
+    # the process is up and serving requests (even while the DB is being initialized)
+    return {'live': True}
+
+
+@app.get("/health/ready", response_model=dict, tags=["monitoring"])
+async def get_readiness():
+    # ready once there is data to serve, with 503 until then (e.g. on the first startup, or if initializing failed)
+    status = {
+        'ready': initialization.ready,
+        'initializing': initialization.running,
+        'error': initialization.error,
+    }
+    return status if initialization.ready else JSONResponse(status, status_code=503)
+
 
 # @app.get("/")
 # def read_root():
@@ -63,36 +349,36 @@ init_db()
 
 
 @app.get("/user/country", response_model=str, tags=["user"])
-def get_country_of_user(user_id: str, db: Session = Depends(get_db)):
-    country = crud.get_country_of_user(db, user_id)
+async def get_country_of_user(user_id: str, db: Session | AsyncSession = Depends(get_query_db)):
+    country = await user_query(crud.get_country_of_user, db, user_id)
     if not country:
         raise HTTPException(status_code=404, detail="User not found or country is invalid.")
     return country
 
 
 @app.get("/user/name", response_model=str, tags=["user"])
-def get_name_of_user(user_id: str, db: Session = Depends(get_db)):
-    name = crud.get_name_of_user(db, user_id)
+async def get_name_of_user(user_id: str, db: Session | AsyncSession = Depends(get_query_db)):
+    name = await user_query(crud.get_name_of_user, db, user_id)
     if not name:
         raise HTTPException(status_code=404, detail="User not found.")
     return name
 
 
 @app.get("/user/logins", response_model=int, tags=["user"])
-def get_number_of_logins(user_id: str, input_date: str = '', db: Session = Depends(get_db)):
+async def get_number_of_logins(user_id: str, input_date: str = '', db: Session | AsyncSession = Depends(get_query_db)):
     if input_date:
         try:
-            datetime.date.fromisoformat(input_date)
+            input_date = datetime.date.fromisoformat(input_date)
         except ValueError:
             raise HTTPException(status_code=400, detail="Incorrect date format, should be YYYY-MM-DD.")
     
     if not input_date:
         input_date = None
-    return crud.get_number_of_logins(db, user_id, input_date)
+    return await user_query(crud.get_number_of_logins, db, user_id, input_date)
 
 
 @app.get("/user/days-since-login", response_model=str, tags=["user"])
-def get_days_since_last_login(user_id: str, input_date: str = '', db: Session = Depends(get_db)):
+async def get_days_since_last_login(user_id: str, input_date: str = '', db: Session | AsyncSession = Depends(get_query_db)):
     if input_date:
         try:
             input_date = datetime.date.fromisoformat(input_date)
@@ -101,11 +387,11 @@ def get_days_since_last_login(user_id: str, input_date: str = '', db: Session =
     
     if not input_date:
         input_date = None
-    return crud.get_days_since_last_login(db, user_id, input_date)
+    return await user_query(crud.get_days_since_last_login, db, user_id, input_date)
 
 
 @app.get("/user/sessions", response_model=int, tags=["user"])
-def get_number_of_sessions(user_id: str, input_date: str = '', db: Session = Depends(get_db)):
+async def get_number_of_sessions(user_id: str, input_date: str = '', db: Session | AsyncSession = Depends(get_query_db)):
     if input_date:
         try:
             input_date = datetime.date.fromisoformat(input_date)
@@ -114,11 +400,11 @@ def get_number_of_sessions(user_id: str, input_date: str = '', db: Session = Dep
     
     if not input_date:
         input_date = None
-    return crud.get_number_of_sessions(db, user_id, input_date)
+    return await user_query(crud.get_number_of_sessions, db, user_id, input_date)
 
 
 @app.get("/user/time-in-game", response_model=int, tags=["user"])
-def get_time_spent_in_game(user_id: str, input_date: str = '', db: Session = Depends(get_db)):
+async def get_time_spent_in_game(user_id: str, input_date: str = '', db: Session | AsyncSession = Depends(get_query_db)):
     if input_date:
         try:
             input_date = datetime.date.fromisoformat(input_date)
@@ -127,82 +413,186 @@ def get_time_spent_in_game(user_id: str, input_date: str = '', db: Session = Dep
     
     if not input_date:
         input_date = None
-    return crud.get_time_spent_in_game(db, user_id, input_date)
+    return await user_query(crud.get_time_spent_in_game, db, user_id, input_date)
 
 
-@app.get("/game/daily-active-users", response_model=dict, tags=["game"])
-def get_number_of_daily_active_users(input_date: str = '', country: bool = False, db: Session = Depends(get_db)):
-    if input_date:
-        try:
-            input_date = datetime.date.fromisoformat(input_date)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Incorrect date format, should be YYYY-MM-DD.")
-    
+class UserStatsRequest(BaseModel):
+    user_ids: list[str]
+    start_date: datetime.date
+    end_date: datetime.date
+
+
+@app.post("/users/stats", response_model=dict, tags=["user"])
+async def get_user_stats(request: UserStatsRequest, db: Session | AsyncSession = Depends(get_query_db)):
+    if request.start_date > request.end_date:
+        raise HTTPException(status_code=400, detail="start_date should not be after end_date.")
+    if len(request.user_ids) > MAX_BATCH_USERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_USERS} users can be requested at once.")
+    return await run_query(crud.get_user_stats, db, request.user_ids, request.start_date, request.end_date)
+
+
+class Granularity(str, Enum):
+    day = "day"
+    week = "week"
+
+
+def get_input_date(input_date: str = ''):
+    # the date game level stats are for, or None for all dates
     if not input_date:
-        input_date = None
-    return crud.get_number_of_daily_active_users(db, input_date, country)
+        return None
+    try:
+        return datetime.date.fromisoformat(input_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Incorrect date format, should be YYYY-MM-DD.")
+
+
+def get_time_series_range(start_date: str = '', end_date: str = '', granularity: Granularity = Granularity.day,
+                          input_date: datetime.date | None = Depends(get_input_date)):
+    # game level stats are returned as a time series when both start_date and end_date are set
+    if not start_date and not end_date:
+        return None
+    if not start_date or not end_date:
+        raise HTTPException(status_code=400, detail="Both start_date and end_date should be set.")
+    if input_date:
+        raise HTTPException(status_code=400, detail="input_date can't be combined with start_date and end_date.")
+    try:
+        start_date, end_date = datetime.date.fromisoformat(start_date), datetime.date.fromisoformat(end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Incorrect date format, should be YYYY-MM-DD.")
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date should not be after end_date.")
+    return start_date, end_date, granularity.value
+
+
+@app.get("/game/daily-active-users", response_model=dict, tags=["game"])
+async def get_number_of_daily_active_users(input_date: datetime.date | None = Depends(get_input_date),
+                                           country: bool = False, approximate: bool = False,
+                                           time_series_range: tuple | None = Depends(get_time_series_range),
+                                           db: Session | AsyncSession = Depends(get_game_db)):
+    # approximate counts are estimated out of HyperLogLog sketches computed on ingestion (see crud.HLL_PRECISION)
+    if time_series_range:
+        query = (crud.get_approximate_number_of_daily_active_users_series if approximate
+                 else crud.get_number_of_daily_active_users_series)
+        return await cached_query(query, db, *time_series_range, country)
+
+    query = crud.get_approximate_number_of_daily_active_users if approximate else crud.get_number_of_daily_active_users
+    return await cached_query(query, db, input_date, country)
 
 
 @app.get("/game/logins", response_model=dict, tags=["game"])
-def get_number_of_logins_for_game(input_date: str = '', country: bool = False, db: Session = Depends(get_db)):
-    if input_date:
-        try:
-            input_date = datetime.date.fromisoformat(input_date)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Incorrect date format, should be YYYY-MM-DD.")
-    
-    if not input_date:
-        input_date = None
-    return crud.get_number_of_logins_for_game(db, input_date, country)
+async def get_number_of_logins_for_game(input_date: datetime.date | None = Depends(get_input_date),
+                                        country: bool = False,
+                                        time_series_range: tuple | None = Depends(get_time_series_range),
+                                        db: Session | AsyncSession = Depends(get_game_db)):
+    if time_series_range:
+        return await cached_query(crud.get_number_of_logins_for_game_series, db, *time_series_range, country)
+
+    return await cached_query(crud.get_number_of_logins_for_game, db, input_date, country)
 
 
 @app.get("/game/revenue", response_model=dict, tags=["game"])
-def get_total_revenue_in_usd(input_date: str = '', country: bool = False, db: Session = Depends(get_db)):
-    if input_date:
-        try:
-            input_date = datetime.date.fromisoformat(input_date)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Incorrect date format, should be YYYY-MM-DD.")
-    
-    if not input_date:
-        input_date = None
-    return crud.get_total_revenue_in_usd(db, input_date, country)
+async def get_total_revenue_in_usd(input_date: datetime.date | None = Depends(get_input_date),
+                                   country: bool = False,
+                                   time_series_range: tuple | None = Depends(get_time_series_range),
+                                   db: Session | AsyncSession = Depends(get_game_db)):
+    if time_series_range:
+        return await cached_query(crud.get_total_revenue_in_usd_series, db, *time_series_range, country)
+
+    return await cached_query(crud.get_total_revenue_in_usd, db, input_date, country)
 
 
 @app.get("/game/paid-users", response_model=dict, tags=["game"])
-def get_number_of_paid_users(input_date: str = '', country: bool = False, db: Session = Depends(get_db)):
-    if input_date:
-        try:
-            input_date = datetime.date.fromisoformat(input_date)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Incorrect date format, should be YYYY-MM-DD.")
-    
-    if not input_date:
-        input_date = None
-    return crud.get_number_of_paid_users(db, input_date, country)
+async def get_number_of_paid_users(input_date: datetime.date | None = Depends(get_input_date),
+                                   country: bool = False,
+                                   time_series_range: tuple | None = Depends(get_time_series_range),
+                                   db: Session | AsyncSession = Depends(get_game_db)):
+    if time_series_range:
+        return await cached_query(crud.get_number_of_paid_users_series, db, *time_series_range, country)
+
+    return await cached_query(crud.get_number_of_paid_users, db, input_date, country)
 
 
 @app.get("/game/average-number-of-sessions", response_model=dict, tags=["game"])
-def get_average_number_of_sessions_for_users_with_sessions(input_date: str = '', country: bool = False, db: Session = Depends(get_db)):
-    if input_date:
-        try:
-            input_date = datetime.date.fromisoformat(input_date)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Incorrect date format, should be YYYY-MM-DD.")
-    
-    if not input_date:
-        input_date = None
-    return crud.get_average_number_of_sessions_for_users_with_sessions(db, input_date, country)
+async def get_average_number_of_sessions_for_users_with_sessions(input_date: datetime.date | None = Depends(get_input_date),
+                                                                 country: bool = False,
+                                                                 time_series_range: tuple | None = Depends(get_time_series_range),
+                                                                 db: Session | AsyncSession = Depends(get_game_db)):
+    if time_series_range:
+        return await cached_query(crud.get_average_number_of_sessions_for_users_with_sessions_series, db, *time_series_range, country)
+
+    return await cached_query(crud.get_average_number_of_sessions_for_users_with_sessions, db, input_date, country)
 
 
 @app.get("/game/average-total-time-spent", response_model=dict, tags=["game"])
-def get_average_total_time_spent_in_game(input_date: str = '', country: bool = False, db: Session = Depends(get_db)):
-    if input_date:
+async def get_average_total_time_spent_in_game(input_date: datetime.date | None = Depends(get_input_date),
+                                               country: bool = False,
+                                               time_series_range: tuple | None = Depends(get_time_series_range),
+                                               db: Session | AsyncSession = Depends(get_game_db)):
+    if time_series_range:
+        return await cached_query(crud.get_average_total_time_spent_in_game_series, db, *time_series_range, country)
+
+    return await cached_query(crud.get_average_total_time_spent_in_game, db, input_date, country)
+
+
+def get_ingest_path(path: str = ''):
+    # the events file, or a file given by its path relative to INGEST_DIR (nothing outside of it, and only regular files)
+    if not path:
+        return EVENTS_PATH
+    ingest_dir = os.path.realpath(INGEST_DIR)
+    path = os.path.realpath(os.path.join(ingest_dir, path))
+    if not path.startswith(ingest_dir + os.sep):
+        raise HTTPException(status_code=400, detail="Only files inside the ingest directory can be ingested.")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Events file not found.")
+    # (the events file keeps a single watermark, however it is named)
+    return EVENTS_PATH if path == os.path.realpath(EVENTS_PATH) else path
+
+
+@app.post("/ingest", response_model=dict, tags=["ingestion"])
+def ingest_events(path: str = Depends(get_ingest_path), db: Session = Depends(get_ingestion_db)):
+    with ingestion_lock(wait=False) as acquired:
+        if not acquired:
+            raise HTTPException(status_code=409, detail="Events are already being ingested, try again later.")
         try:
-            input_date = datetime.date.fromisoformat(input_date)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Incorrect date format, should be YYYY-MM-DD.")
-    
-    if not input_date:
-        input_date = None
-    return crud.get_average_total_time_spent_in_game(db, input_date, country)
+            counts = ingest_new_events(db, path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Events file not found.")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Events file could not be parsed: {e}")
+    load_exchange_rates(db)
+    invalidate_cache()
+    refresh_user_index(force=True)
+    return counts
+
+
+@app.get("/schema-versions", response_model=list, tags=["ingestion"])
+def get_schema_versions(db: Session = Depends(get_ingestion_db)):
+    # the versions of the tables built by full re-populations, of which the active one is served
+    return schema_versions.get_schema_versions(db)
+
+
+@app.post("/schema-versions/{version}/activate", response_model=bool, tags=["ingestion"])
+def activate_schema_version(version: int, db: Session = Depends(get_ingestion_db)):
+    # e.g. rolls back to the previous version (events ingested into the active one since then aren't in it)
+    with ingestion_lock(wait=False) as acquired:
+        if not acquired:
+            raise HTTPException(status_code=409, detail="Events are being ingested, try again later.")
+        if not schema_versions.activate_schema_version(db, version):
+            raise HTTPException(status_code=404, detail="Schema version not found or not completed.")
+    invalidate_cache()
+    refresh_user_index(force=True)
+    return True
+
+
+@app.post("/exchange-rates/reload", response_model=bool, tags=["ingestion"])
+def reload_exchange_rates(force: bool = False, db: Session = Depends(get_ingestion_db)):
+    # reloads the exchange rates file into the DB if it changed since it was last loaded (or always, if forced)
+    reloaded = load_exchange_rates(db, force=force)
+    if reloaded:
+        invalidate_cache()
+    return reloaded
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["monitoring"])
+def get_metrics():
+    return render_pool_metrics(get_query_pool()) + render_cache_metrics(response_cache)
@@ -0,0 +1,89 @@
+import os
+import threading
+from dataclasses import dataclass, field
+
+# upper bounds (in seconds) of the pool checkout wait time histogram's buckets
+CHECKOUT_WAIT_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+@dataclass
+class PoolMetrics:
+    """
+    Connection pool metrics of this worker process: how long requests waited to get a connection,
+    how often they got one only thanks to overflow and how often they timed out.
+    """
+    checkouts: int = 0
+    overflow_checkouts: int = 0
+    timeouts: int = 0
+    wait_seconds_sum: float = 0
+    wait_seconds_buckets: list = field(default_factory=lambda: [0] * len(CHECKOUT_WAIT_BUCKETS))
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record_checkout(self, wait_seconds: float, overflow: int):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds_sum += wait_seconds
+            if overflow > 0:
+                self.overflow_checkouts += 1
+            for idx, bound in enumerate(CHECKOUT_WAIT_BUCKETS):
+                if wait_seconds <= bound:
+                    self.wait_seconds_buckets[idx] += 1
+
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+
+pool_metrics = PoolMetrics()
+
+
+def render_pool_metrics(pool):
+    """
+    Renders the pool's metrics in the Prometheus text format (labeled with the worker's pid,
+    as every worker has its own pool and only the one serving the request reports).
+    """
+    labels = f'pid="{os.getpid()}"'
+    lines = [
+        '# HELP db_pool_size Configured number of connections kept in the pool.',
+        '# TYPE db_pool_size gauge',
+        f'db_pool_size{{{labels}}} {pool.size()}',
+        '# HELP db_pool_checked_out Connections currently checked out of the pool.',
+        '# TYPE db_pool_checked_out gauge',
+        f'db_pool_checked_out{{{labels}}} {pool.checkedout()}',
+        '# HELP db_pool_overflow Connections currently open beyond the pool size.',
+        '# TYPE db_pool_overflow gauge',
+        f'db_pool_overflow{{{labels}}} {max(0, pool.overflow())}',
+        '# HELP db_pool_overflow_checkouts_total Checkouts served by an overflow connection.',
+        '# TYPE db_pool_overflow_checkouts_total counter',
+        f'db_pool_overflow_checkouts_total{{{labels}}} {pool_metrics.overflow_checkouts}',
+        '# HELP db_pool_checkout_timeouts_total Checkouts that timed out waiting for a connection.',
+        '# TYPE db_pool_checkout_timeouts_total counter',
+        f'db_pool_checkout_timeouts_total{{{labels}}} {pool_metrics.timeouts}',
+        '# HELP db_pool_checkout_wait_seconds Time spent waiting for a connection from the pool.',
+        '# TYPE db_pool_checkout_wait_seconds histogram',
+    ]
+    for bound, count in zip(CHECKOUT_WAIT_BUCKETS, pool_metrics.wait_seconds_buckets):
+        lines.append(f'db_pool_checkout_wait_seconds_bucket{{{labels},le="{bound}"}} {count}')
+    lines += [
+        f'db_pool_checkout_wait_seconds_bucket{{{labels},le="+Inf"}} {pool_metrics.checkouts}',
+        f'db_pool_checkout_wait_seconds_sum{{{labels}}} {pool_metrics.wait_seconds_sum}',
+        f'db_pool_checkout_wait_seconds_count{{{labels}}} {pool_metrics.checkouts}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def render_cache_metrics(cache):
+    """
+    Renders the response cache's hit and miss counters of this worker in the Prometheus text format (nothing if it is disabled).
+    """
+    if not cache:
+        return ''
+    labels = f'pid="{os.getpid()}",backend="{type(cache).__name__}"'
+    return '\n'.join([
+        '# HELP response_cache_hits_total Responses served from the cache.',
+        '# TYPE response_cache_hits_total counter',
+        f'response_cache_hits_total{{{labels}}} {cache.hits}',
+        '# HELP response_cache_misses_total Responses not found in the cache.',
+        '# TYPE response_cache_misses_total counter',
+        f'response_cache_misses_total{{{labels}}} {cache.misses}',
+    ]) + '\n'
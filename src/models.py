@@ -1,7 +1,9 @@
-from sqlalchemy import DateTime, Boolean, Float, ForeignKey, Integer, String, CheckConstraint
+from sqlalchemy import (BigInteger, Date, DateTime, Boolean, Float, ForeignKey, Integer, SmallInteger, String,
+                        CheckConstraint, Index, UniqueConstraint)
 from sqlalchemy.orm import relationship, mapped_column
 
 from .db import Base
+from .validation import VALID_DEVICE_OS, VALID_TRANSACTION_AMOUNT, VALID_TRANSACTION_CURRENCY
 
 class Event(Base):
     __tablename__ = "event"
@@ -18,6 +20,10 @@ class Registration(Base):
 
     user = relationship("User", back_populates="registrations")
 
+    __table_args__ = (
+        Index('ix_registration_event_datetime', event_datetime),
+    )
+
 class User(Base):
     __tablename__ = "user"
 
@@ -30,23 +36,30 @@ class User(Base):
     registrations = relationship("Registration", back_populates="user")
 
     __table_args__ = (
-        CheckConstraint(device_os.in_(['iOS', 'Android', 'Web']), name='valid_device_os'),
+        CheckConstraint(device_os.in_(VALID_DEVICE_OS), name='valid_device_os'),
     )
 
 
+# login_logout and transaction are partitioned by week of event_datetime (see partitions.py), so date-filtered queries
+# only read the partitions of their dates. Their primary keys have to include event_datetime, and other tables can't
+# reference them with foreign keys (their ids are still unique, being events' ids)
+
 class Transaction(Base):
     __tablename__ = "transaction"
 
     id = mapped_column(ForeignKey("event.id"), primary_key=True)
-    event_datetime = mapped_column(DateTime, nullable=False)
+    event_datetime = mapped_column(DateTime, primary_key=True)
     user_id = mapped_column(ForeignKey("user.id"), nullable=False)
 
     transaction_amount = mapped_column(Float, nullable=False)
     transaction_currency = mapped_column(String, nullable=False)
 
     __table_args__ = (
-        CheckConstraint(transaction_amount.in_([0.99, 1.99, 2.99, 4.99, 9.99]), name='valid_transaction_amount'),
-        CheckConstraint(transaction_currency.in_(['EUR', 'USD']), name='valid_transaction_currency')
+        CheckConstraint(transaction_amount.in_(VALID_TRANSACTION_AMOUNT), name='valid_transaction_amount'),
+        CheckConstraint(transaction_currency.in_(VALID_TRANSACTION_CURRENCY), name='valid_transaction_currency'),
+        Index('ix_transaction_user_id_event_datetime', user_id, event_datetime),
+        Index('ix_transaction_event_datetime', event_datetime),
+        {'postgresql_partition_by': 'RANGE (event_datetime)'},
     )
 
 
@@ -54,10 +67,131 @@ class LoginLogout(Base):
     __tablename__ = "login_logout"
 
     id = mapped_column(ForeignKey("event.id"), primary_key=True)
-    event_datetime = mapped_column(DateTime, nullable=False)
+    event_datetime = mapped_column(DateTime, primary_key=True)
     user_id = mapped_column(ForeignKey("user.id"), nullable=False)
 
     # if False, then Logout
     is_login = mapped_column(Boolean, nullable=False)
 
-    matching_login_or_logout_id = mapped_column(ForeignKey("login_logout.id"), nullable=True, unique=True)
+    # the id of the login or logout event this one is paired with
+    matching_login_or_logout_id = mapped_column(Integer, nullable=True)
+
+    __table_args__ = (
+        # user level stats (logins, last login, sessions of a user on a date)
+        Index('ix_login_logout_user_id_is_login_event_datetime', user_id, is_login, event_datetime),
+        # logins on a date, for the daily rollups
+        Index('ix_login_logout_login_event_datetime', event_datetime, postgresql_where=is_login),
+        {'postgresql_partition_by': 'RANGE (event_datetime)'},
+    )
+
+
+
+class RejectedEvent(Base):
+    __tablename__ = "rejected_event"
+
+    # events dropped by a validation rule, stored only if QUARANTINE_REJECTED_EVENTS is set
+    # (an event may be rejected again by a later ingestion, as only loaded events are deduplicated against)
+    id = mapped_column(Integer, primary_key=True)
+    event_id = mapped_column(BigInteger, nullable=False)
+    event_datetime = mapped_column(DateTime, nullable=False)
+    event_type = mapped_column(String, nullable=False)
+    user_id = mapped_column(String, nullable=False)
+    # the (first) rule the event failed, and the value it failed on
+    rule = mapped_column(String, nullable=False)
+    value = mapped_column(String, nullable=True)
+
+    __table_args__ = (
+        Index('ix_rejected_event_rule', rule),
+    )
+
+
+class ExchangeRate(Base):
+    __tablename__ = "exchange_rate"
+
+    id = mapped_column(Integer, primary_key=True)
+    currency = mapped_column(String, nullable=False)
+    # the rate applies from this date on (until the currency's next rate), or on any date if there is none
+    valid_from = mapped_column(Date, nullable=True)
+    rate_to_usd = mapped_column(Float, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(currency, valid_from, name='unique_currency_valid_from'),
+    )
+
+
+class GameSession(Base):
+    __tablename__ = "session"
+
+    # one row per session per day it spans, rebuilt (for the sessions that started on the affected dates) on every ingestion
+    # ids of login_logout events
+    login_id = mapped_column(Integer, primary_key=True)
+    date = mapped_column(Date, primary_key=True)
+    # NULL while the session is open, in which case it is considered to end at the end of the day it started on
+    logout_id = mapped_column(Integer, nullable=True)
+    user_id = mapped_column(ForeignKey("user.id"), nullable=False)
+    # the part of the session on this date
+    start_datetime = mapped_column(DateTime, nullable=False)
+    end_datetime = mapped_column(DateTime, nullable=False)
+    # in seconds
+    duration = mapped_column(Float, nullable=False)
+
+    __table_args__ = (
+        Index('ix_session_user_id_date', user_id, date),
+        Index('ix_session_date', date),
+    )
+
+
+# --- daily rollups, rebuilt for the affected dates on every ingestion ---
+
+class DailyGameStats(Base):
+    __tablename__ = "daily_game_stats"
+
+    date = mapped_column(Date, primary_key=True)
+    country = mapped_column(String, primary_key=True)
+    logins = mapped_column(Integer, nullable=False)
+    paid_registrations = mapped_column(Integer, nullable=False)
+
+
+class DailyUserStats(Base):
+    __tablename__ = "daily_user_stats"
+
+    # one row per user per day with at least one login (sessions are counted on the day they started)
+    date = mapped_column(Date, primary_key=True)
+    user_id = mapped_column(ForeignKey("user.id"), primary_key=True)
+    country = mapped_column(String, nullable=False)
+    logins = mapped_column(Integer, nullable=False)
+    # sessions of at least 1 second
+    sessions = mapped_column(Integer, nullable=False)
+    # full duration of those sessions (even if they end on a later day)
+    total_session_time = mapped_column(Float, nullable=False)
+
+
+class DailyActiveUsersSketch(Base):
+    __tablename__ = "daily_active_users_sketch"
+
+    # the HyperLogLog registers of the users active per day and country (see crud.HLL_PRECISION),
+    # of which only the non-empty ones are stored
+    date = mapped_column(Date, primary_key=True)
+    country = mapped_column(String, primary_key=True)
+    register = mapped_column(SmallInteger, primary_key=True)
+    rank = mapped_column(SmallInteger, nullable=False)
+
+
+class DailyRevenue(Base):
+    __tablename__ = "daily_revenue"
+
+    date = mapped_column(Date, primary_key=True)
+    country = mapped_column(String, primary_key=True)
+    transaction_currency = mapped_column(String, primary_key=True)
+    revenue = mapped_column(Float, nullable=False)
+
+
+class IngestionWatermark(Base):
+    __tablename__ = "ingestion_watermark"
+
+    # events file the watermark is for
+    path = mapped_column(String, primary_key=True)
+    # byte offset in the file up to which events have been ingested
+    file_offset = mapped_column(BigInteger, nullable=False)
+    max_event_datetime = mapped_column(DateTime, nullable=True)
+    ingested_at = mapped_column(DateTime, nullable=False)
@@ -0,0 +1,64 @@
+import os
+import shutil
+import uuid
+
+import pandas as pd
+
+from .db import QUERY_BACKEND
+from .load import build_tables
+
+# if set, cleaned events are also written there as Parquet files, which the DuckDB query backend reads
+PARQUET_PATH = os.getenv("PARQUET_PATH", "./parquet" if QUERY_BACKEND == "duckdb" else "")
+# where a full re-population is written, to replace the Parquet datasets once complete
+STAGING_PARQUET_PATH = f"{PARQUET_PATH.rstrip('/')}.staging" if PARQUET_PATH else ""
+
+# tables written as Parquet datasets, partitioned by the date of their events (except for users)
+PARQUET_TABLES = ['user', 'registration', 'login_logout', 'transaction']
+PARTITIONED_TABLES = ['registration', 'login_logout', 'transaction']
+
+
+def get_parquet_glob(table: str, path: str = PARQUET_PATH):
+    # e.g. ./parquet/login_logout/date=2010-05-08/<uuid>-0.parquet
+    if table in PARTITIONED_TABLES:
+        return os.path.join(path, table, '*', '*.parquet')
+    return os.path.join(path, table, '*.parquet')
+
+
+def clear_parquet(path: str = PARQUET_PATH):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def swap_in_parquet(staging_path: str = STAGING_PARQUET_PATH, path: str = PARQUET_PATH):
+    # replaces the Parquet datasets with the staging ones, by renaming the directories
+    # (a query running right in between the two renames finds no files, as before any events are loaded)
+    retired_path = f"{path.rstrip('/')}.retired"
+    shutil.rmtree(retired_path, ignore_errors=True)
+    os.makedirs(staging_path, exist_ok=True)
+    if os.path.exists(path):
+        os.rename(path, retired_path)
+    os.rename(staging_path, path)
+    shutil.rmtree(retired_path, ignore_errors=True)
+
+
+def write_parquet(registration_events: pd.DataFrame, login_logout_events: pd.DataFrame, transaction_events: pd.DataFrame,
+                  path: str = PARQUET_PATH):
+    """
+    Appends a batch of cleaned events to the Parquet datasets (one file per table and date, next to the earlier batches' files).
+    Logins whose logout comes in a later batch are not updated, as sessions can be told by their logouts alone.
+    """
+    tables = build_tables(registration_events, login_logout_events, transaction_events)
+    for table in PARQUET_TABLES:
+        write_parquet_table(table, tables[table], path)
+
+
+def write_parquet_table(table: str, df: pd.DataFrame, path: str = PARQUET_PATH):
+    # df's columns are those of the table's model
+    if not len(df):
+        return
+    if table in PARTITIONED_TABLES:
+        df = df.assign(date=df['event_datetime'].dt.strftime('%Y-%m-%d'))
+        df.to_parquet(os.path.join(path, table), partition_cols=['date'], index=False,
+                      coerce_timestamps='us', allow_truncated_timestamps=True)
+    else:
+        os.makedirs(os.path.join(path, table), exist_ok=True)
+        df.to_parquet(os.path.join(path, table, f'{uuid.uuid4().hex}.parquet'), index=False)
@@ -0,0 +1,60 @@
+import datetime
+import re
+
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from . import models
+
+# names of the weekly partitions, e.g. login_logout_w20100510 for the week starting on Monday, May 10, 2010
+PARTITION_NAME = re.compile(r'^(?P<table>\w+)_w(?P<week_start>\d{8})$')
+
+
+def get_partitioned_tables():
+    # the models' tables partitioned by range of event_datetime (their postgresql_partition_by table argument)
+    return [table.name for table in models.Base.metadata.sorted_tables
+            if table.dialect_options['postgresql'].get('partition_by')]
+
+
+def get_week_start(date: datetime.date):
+    return date - datetime.timedelta(days=date.weekday())
+
+
+def get_partition_name(table: str, week_start: datetime.date):
+    return f'{table}_w{week_start:%Y%m%d}'
+
+
+def get_partition_table(name: str):
+    # the table a partition belongs to (or the name itself, if it isn't a partition's)
+    match = PARTITION_NAME.match(name)
+    return match['table'] if match else name
+
+
+def get_weeks(start_date: datetime.date, end_date: datetime.date):
+    # the starts of the weeks overlapping [start_date, end_date]
+    week_start = get_week_start(start_date)
+    while week_start <= end_date:
+        yield week_start
+        week_start += datetime.timedelta(days=7)
+
+
+def is_partitioned(db: Session, table: str):
+    # (tables created before they were partitioned aren't)
+    return bool(db.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"),
+                           {'table': f'"{table}"'}).scalar())
+
+
+def create_partitions(db: Session, start_date: datetime.date, end_date: datetime.date):
+    """
+    Creates the partitioned tables' partitions of the weeks overlapping [start_date, end_date] that don't exist yet,
+    before events of those days are loaded (in the schema the tables resolve to, so in the version being loaded).
+    """
+    for table in get_partitioned_tables():
+        if not is_partitioned(db, table):
+            continue
+        for week_start in get_weeks(start_date, end_date):
+            db.execute(text(f'''
+                CREATE TABLE IF NOT EXISTS "{get_partition_name(table, week_start)}" PARTITION OF "{table}"
+                FOR VALUES FROM ('{week_start}') TO ('{week_start + datetime.timedelta(days=7)}')
+            '''))
+    db.commit()
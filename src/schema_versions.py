@@ -0,0 +1,139 @@
+import datetime
+import os
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.sql import text
+
+from . import models
+from .db import LIVE_SCHEMA, SCHEMA_VERSION_TABLE, get_version_schema
+
+# how many completed versions are kept (the active one, and the ones activated before it, for rollbacks)
+KEEP_SCHEMA_VERSIONS = int(os.getenv("KEEP_SCHEMA_VERSIONS", "2"))
+
+
+def create_schema_version_table(db: Session):
+    # every full re-population builds a new version of the tables in a schema of its own, of which only one is active
+    db.execute(text(f'''
+        CREATE TABLE IF NOT EXISTS {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE} (
+            version INTEGER PRIMARY KEY,
+            created_at TIMESTAMP NOT NULL,
+            completed_at TIMESTAMP,
+            activated_at TIMESTAMP,
+            is_active BOOLEAN NOT NULL DEFAULT false
+        )
+    '''))
+    db.execute(text(f'''
+        CREATE UNIQUE INDEX IF NOT EXISTS ix_{SCHEMA_VERSION_TABLE}_is_active
+        ON {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE} (is_active) WHERE is_active
+    '''))
+    db.commit()
+
+
+def get_schema_versions(db: Session):
+    create_schema_version_table(db)
+    result = db.execute(text(f'''
+        SELECT version, created_at, completed_at, activated_at, is_active FROM {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE}
+        ORDER BY version
+    '''))
+    return [dict(r._mapping) for r in result]
+
+
+def create_schema_version(db: Session):
+    # a new schema with the tables (but not the indexes, which are built once the tables are loaded), returns its version
+    create_schema_version_table(db)
+    version = db.execute(text(f'SELECT COALESCE(MAX(version), 0) + 1 FROM {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE}')).scalar()
+    db.execute(text(f'''
+        INSERT INTO {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE} (version, created_at) VALUES (:version, :now)
+    '''), {'version': version, 'now': datetime.datetime.utcnow()})
+    schema = get_version_schema(version)
+    db.execute(text(f'DROP SCHEMA IF EXISTS {schema} CASCADE'))
+    db.execute(text(f'CREATE SCHEMA {schema}'))
+    db.commit()
+    print(f"Created schema {schema}.", flush=True)
+    return version
+
+
+def create_tables(version_engine: Engine):
+    # (the engine's search_path is the version's schema, which unqualified names resolve to)
+    with version_engine.begin() as connection:
+        for table in models.Base.metadata.sorted_tables:
+            connection.execute(CreateTable(table))
+
+
+def complete_schema_version(db: Session, version_engine: Engine, version: int):
+    # indexes are built after the tables are loaded (faster than updating them row by row), then statistics gathered
+    with version_engine.begin() as connection:
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(CreateIndex(index))
+            connection.execute(text(f'ANALYZE "{table.name}"'))
+    db.execute(text(f'UPDATE {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE} SET completed_at = :now WHERE version = :version'),
+               {'version': version, 'now': datetime.datetime.utcnow()})
+    db.commit()
+
+
+def activate_schema_version(db: Session, version: int):
+    """
+    Points the views in the live schema (which the API's queries read) at a completed version's tables,
+    in a single transaction, so queries see either all of the old tables or all of the new ones
+    (waiting for it to commit, if they come in meanwhile). Returns whether there was such a version.
+    """
+    create_schema_version_table(db)
+    completed = db.execute(text(f'''
+        SELECT 1 FROM {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE} WHERE version = :version AND completed_at IS NOT NULL
+    '''), {'version': version}).scalar()
+    if not completed:
+        return False
+    schema = get_version_schema(version)
+    # (the live tables of a DB populated before schema versions were used are dropped as well)
+    drop_live_relations(db, tables=True)
+    for table in models.Base.metadata.sorted_tables:
+        db.execute(text(f'CREATE VIEW {LIVE_SCHEMA}."{table.name}" AS SELECT * FROM {schema}."{table.name}"'))
+    db.execute(text(f'UPDATE {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE} SET is_active = false WHERE is_active'))
+    db.execute(text(f'''
+        UPDATE {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE} SET is_active = true, activated_at = :now WHERE version = :version
+    '''), {'version': version, 'now': datetime.datetime.utcnow()})
+    db.commit()
+    print(f"Activated schema {schema}.", flush=True)
+    return True
+
+
+def drop_old_schema_versions(db: Session, keep: int = KEEP_SCHEMA_VERSIONS):
+    # drops the versions beyond the active one and the last ones activated before it (and unfinished ones)
+    kept = [version['version'] for version in sorted(
+        (version for version in get_schema_versions(db) if version['activated_at']),
+        key=lambda version: (version['is_active'], version['activated_at']), reverse=True
+    )][:max(1, keep)]
+    for version in get_schema_versions(db):
+        if version['version'] not in kept:
+            drop_schema_version(db, version['version'])
+
+
+def drop_schema_version(db: Session, version: int):
+    db.execute(text(f'DROP SCHEMA IF EXISTS {get_version_schema(version)} CASCADE'))
+    db.execute(text(f'DELETE FROM {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE} WHERE version = :version'), {'version': version})
+    db.commit()
+    print(f"Dropped schema {get_version_schema(version)}.", flush=True)
+
+
+def drop_schema_versions(db: Session):
+    # back to tables in the live schema, as before schema versions were used (e.g. to seed a scratch DB directly)
+    for version in get_schema_versions(db):
+        drop_schema_version(db, version['version'])
+    drop_live_relations(db, tables=False)
+    db.execute(text(f'DROP TABLE {LIVE_SCHEMA}.{SCHEMA_VERSION_TABLE}'))
+    db.commit()
+
+
+def drop_live_relations(db: Session, tables: bool):
+    # drops the views of the models' tables in the live schema (and the tables themselves, if asked to)
+    live_relations = dict(db.execute(text(
+        'SELECT table_name, table_type FROM information_schema.tables WHERE table_schema = :schema'
+    ), {'schema': LIVE_SCHEMA}).all())
+    for table in reversed(models.Base.metadata.sorted_tables):
+        if live_relations.get(table.name) == 'VIEW':
+            db.execute(text(f'DROP VIEW {LIVE_SCHEMA}."{table.name}"'))
+        elif live_relations.get(table.name) == 'BASE TABLE' and tables:
+            db.execute(text(f'DROP TABLE {LIVE_SCHEMA}."{table.name}" CASCADE'))
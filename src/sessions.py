@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+
+def pair_login_logout_events(login_logout_events: pd.DataFrame):
+    """
+    Marks valid login & logout events and adds the matching logout or login's identifier to each of them.
+
+    Within a user's chronologically ordered events, a login is valid only if the user's last valid event is not a login
+    (i.e. there is no open session), and a logout is valid only if the user's last valid event is a login.
+    That means valid events are exactly the first events of each run of equal event types for a user,
+    except for a leading run of logouts, so the whole thing is computed in linear time without any backwards scanning.
+
+    Returns a copy sorted by user_id and event_timestamp (with a fresh index), with added
+    'valid' and 'matching_login_or_logout_id' (NaN if there is no match) columns.
+    """
+    login_logout_events = login_logout_events.sort_values(by=['user_id', 'event_timestamp'])
+    login_logout_events = login_logout_events.reset_index(drop=True)
+
+    user_ids = login_logout_events['user_id'].to_numpy()
+    is_login = (login_logout_events['event_type'] == 'login').to_numpy()
+    event_ids = login_logout_events['event_id'].to_numpy(dtype=float)
+
+    n = len(login_logout_events)
+    user_start = np.ones(n, dtype=bool)
+    user_start[1:] = user_ids[1:] != user_ids[:-1]
+    run_start = user_start.copy()
+    run_start[1:] |= is_login[1:] != is_login[:-1]
+
+    # a user's events can't start with a logout
+    valid = run_start & ~(user_start & ~is_login)
+
+    # valid events alternate login, logout, login... per user,
+    # so every valid logout matches the valid event right before it (a login of the same user)
+    valid_idx = np.flatnonzero(valid)
+    valid_logout_positions = np.flatnonzero(~is_login[valid_idx])
+    logout_idx = valid_idx[valid_logout_positions]
+    login_idx = valid_idx[valid_logout_positions - 1]
+
+    matching_ids = np.full(n, np.nan)
+    matching_ids[logout_idx] = event_ids[login_idx]
+    matching_ids[login_idx] = event_ids[logout_idx]
+
+    login_logout_events['matching_login_or_logout_id'] = matching_ids
+    login_logout_events['valid'] = valid
+    return login_logout_events
+
+
+def get_sessions(login_logout_events: pd.DataFrame):
+    """
+    Builds one row per session (user_id, start, end) out of valid, paired login & logout events.
+    The end of a session is NaN if its login has no matching logout.
+    """
+    logins = login_logout_events[login_logout_events['event_type'] == 'login']
+    logout_timestamps = (
+        login_logout_events
+            .loc[login_logout_events['event_type'] == 'logout']
+            .set_index('event_id')['event_timestamp']
+    )
+    return pd.DataFrame({
+        'user_id': logins['user_id'].to_numpy(),
+        'start': logins['event_timestamp'].to_numpy(dtype=float),
+        'end': logins['matching_login_or_logout_id'].map(logout_timestamps).to_numpy(dtype=float),
+    })
+
+
+def mark_events_in_sessions(events: pd.DataFrame, sessions: pd.DataFrame, by: str = 'user_id', on: str = 'event_timestamp'):
+    """
+    Returns a boolean mask (aligned with events) of the events that happened strictly inside one of their user's sessions.
+
+    Sessions of a user never overlap, so the only candidate for an event is the user's last session
+    that started before it, which is found with an as-of join on the sorted start times;
+    the event is then inside that session if the session is still open or ends after the event.
+    """
+    left = pd.DataFrame({
+        by: events[by].to_numpy(),
+        on: events[on].to_numpy(dtype=float),
+        'position': np.arange(len(events)),
+    }).sort_values(by=on, kind='stable')
+    right = sessions[[by, 'start', 'end']].sort_values(by='start', kind='stable')
+
+    matched = pd.merge_asof(left, right, left_on=on, right_on='start', by=by,
+                            direction='backward', allow_exact_matches=False)
+
+    inside = matched['start'].notna() & (matched['end'].isna() | (matched[on] < matched['end']))
+    mask = np.zeros(len(events), dtype=bool)
+    mask[matched['position'].to_numpy()] = inside.to_numpy()
+    return mask
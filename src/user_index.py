@@ -0,0 +1,151 @@
+import datetime
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import text
+
+from .crud import END_DATE
+
+# if set, the /user/* endpoints are answered out of an in-memory index of the users, their logins and sessions
+# (built once the DB is initialized, and rebuilt whenever new events are ingested), without querying the DB
+USER_INDEX = os.getenv("USER_INDEX", "").lower() in ("1", "true", "yes")
+# seconds between checks for events ingested (or a schema version activated) by other processes, to rebuild the index
+USER_INDEX_REFRESH_SECONDS = float(os.getenv("USER_INDEX_REFRESH_SECONDS", "60"))
+
+NO_LOGIN = 'No login at or prior to this date.'
+DAY = 86400
+EPOCH = datetime.date(1970, 1, 1)
+
+
+@dataclass
+class UserIndex:
+    """
+    The users' attributes and their logins & sessions, in arrays: user_positions maps a user_id to its position,
+    countries[country_codes[position]] and names[position] are the user's country and name, and the user's logins are
+    login_starts[login_offsets[position]:login_offsets[position + 1]], sorted, with login_ends the end of each login's
+    session (its logout, or NaN if there is none). Times are in seconds since the epoch, as the DB's (UTC) datetimes.
+
+    Its methods answer as the crud functions of the same names do.
+    """
+    user_positions: dict
+    country_codes: np.ndarray
+    countries: np.ndarray
+    names: np.ndarray
+    login_offsets: np.ndarray
+    login_starts: np.ndarray
+    login_ends: np.ndarray
+    # what the index was built out of, see get_data_version
+    data_version: tuple = None
+
+    def get_logins(self, user_id: str):
+        position = self.user_positions.get(user_id)
+        if position is None:
+            return self.login_starts[:0], self.login_ends[:0]
+        start, end = self.login_offsets[position], self.login_offsets[position + 1]
+        return self.login_starts[start:end], self.login_ends[start:end]
+
+    def get_country_of_user(self, user_id: str):
+        position = self.user_positions.get(user_id)
+        if position is not None and self.country_codes[position] >= 0:
+            return self.countries[self.country_codes[position]]
+
+    def get_name_of_user(self, user_id: str):
+        position = self.user_positions.get(user_id)
+        if position is not None:
+            return self.names[position]
+
+    def get_number_of_logins(self, user_id: str, input_date: datetime.date):
+        starts, _ = self.get_logins(user_id)
+        if not input_date:
+            return len(starts)
+        return int(np.subtract(*np.searchsorted(starts, get_day_range(input_date)[::-1])))
+
+    def get_days_since_last_login(self, user_id: str, input_date: datetime.date):
+        if not input_date:
+            input_date = END_DATE
+        starts, _ = self.get_logins(user_id)
+        logins_before = np.searchsorted(starts, get_day_range(input_date)[1])
+        if not logins_before:
+            return NO_LOGIN
+        last_login_date = EPOCH + datetime.timedelta(days=int(starts[logins_before - 1] // DAY))
+        return str((input_date - last_login_date).days)
+
+    def get_number_of_sessions(self, user_id: str, input_date: datetime.date):
+        # logins with a logout at least a second later (on a date, logins on that date)
+        starts, ends = self.get_logins(user_id)
+        if input_date:
+            first, last = np.searchsorted(starts, get_day_range(input_date))
+            starts, ends = starts[first:last], ends[first:last]
+        return int(np.count_nonzero(ends - starts >= 1))
+
+    def get_time_spent_in_game(self, user_id: str, input_date: datetime.date):
+        # on a date, the parts of the user's sessions on that day (open ones until the end of the day they started on),
+        # otherwise the full closed sessions
+        starts, ends = self.get_logins(user_id)
+        if not input_date:
+            return float(np.nansum(ends - starts))
+        day_start, day_end = get_day_range(input_date)
+        # sessions starting after the day don't overlap it
+        last = np.searchsorted(starts, day_end)
+        starts, ends = starts[:last], ends[:last]
+        ends = np.where(np.isnan(ends), (starts // DAY + 1) * DAY, ends)
+        return float(np.clip(np.minimum(ends, day_end) - np.maximum(starts, day_start), 0, None).sum())
+
+
+def get_day_range(input_date: datetime.date):
+    # [start, end) of the day, in seconds since the epoch
+    start = (input_date - EPOCH).days * DAY
+    return start, start + DAY
+
+
+def build_user_index(db: Session):
+    """
+    Reads the users, and every login with the logout of its session, out of the DB into a UserIndex.
+    """
+    data_version = get_data_version(db)
+    connection = db.connection()
+    users = pd.read_sql(text('SELECT id, country, name FROM "user"'), connection)
+    logins = pd.read_sql(text('''
+        SELECT login.user_id,
+            EXTRACT(EPOCH FROM login.event_datetime)::float8 AS start,
+            EXTRACT(EPOCH FROM logout.event_datetime)::float8 AS "end"
+        FROM login_logout AS login
+        LEFT JOIN login_logout AS logout
+        ON login.matching_login_or_logout_id = logout.id
+        WHERE login.is_login = true
+    '''), connection)
+    db.rollback()
+
+    user_ids = pd.Index(users['id'])
+    countries = pd.Categorical(users['country'])
+    # every login's user is a registered one, so the logins sorted by user position (then time) are split per user
+    login_positions = user_ids.get_indexer(logins['user_id'])
+    order = np.lexsort((logins['start'].to_numpy(), login_positions))
+    login_offsets = np.searchsorted(login_positions[order], np.arange(len(users) + 1))
+    return UserIndex(
+        user_positions=dict(zip(user_ids, range(len(user_ids)))),
+        country_codes=countries.codes,
+        countries=countries.categories.to_numpy(dtype=object),
+        names=users['name'].to_numpy(dtype=object),
+        login_offsets=login_offsets,
+        login_starts=logins['start'].to_numpy()[order],
+        login_ends=logins['end'].to_numpy(dtype=float)[order],
+        data_version=data_version,
+    )
+
+
+def get_data_version(db: Session):
+    # changes whenever events are ingested (into whichever schema version is active)
+    return tuple(db.execute(text('SELECT MAX(ingested_at), MAX(file_offset), COUNT(*) FROM ingestion_watermark')).one())
+
+
+def get_memory_usage(index: UserIndex):
+    # bytes held by the index: its arrays, the user_id mapping and the strings it holds
+    arrays = [index.country_codes, index.countries, index.names, index.login_offsets, index.login_starts, index.login_ends]
+    strings = sum(value.__sizeof__() for value in index.user_positions) + sum(
+        value.__sizeof__() for value in index.names if value is not None
+    )
+    return sum(array.nbytes for array in arrays) + index.user_positions.__sizeof__() + strings
@@ -0,0 +1,104 @@
+import functools
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import pycountry
+
+VALID_DEVICE_OS = ['iOS', 'Android', 'Web']
+VALID_TRANSACTION_AMOUNT = [0.99, 1.99, 2.99, 4.99, 9.99]
+VALID_TRANSACTION_CURRENCY = ['EUR', 'USD']
+
+
+@dataclass(frozen=True)
+class ValidationRule:
+    """
+    A check of a column of the events of a type: events of that type whose value fails the predicate are dropped.
+    A predicate takes a Series of values and returns a boolean array telling which of them are valid.
+    It has to be elementwise, since it may only be run on the distinct values of the column.
+    """
+    name: str
+    event_type: str
+    column: str
+    predicate: Callable[[pd.Series], np.ndarray]
+
+
+def is_one_of(valid_values: list):
+    def predicate(values: pd.Series):
+        return values.isin(valid_values).to_numpy()
+    return predicate
+
+
+def is_country_code(values: pd.Series):
+    # an ISO 3166-1 alpha-2 code
+    return values.isin(get_country_codes()).to_numpy()
+
+
+@functools.cache
+def get_country_codes():
+    return [country.alpha_2 for country in pycountry.countries]
+
+
+# the rules clean_events applies, in order (an event failing several of them is rejected by the first one)
+VALIDATION_RULES = [
+    ValidationRule('drop_invalid_countries', 'registration', 'country', is_country_code),
+    ValidationRule('drop_invalid_device_os', 'registration', 'device_os', is_one_of(VALID_DEVICE_OS)),
+    ValidationRule('drop_invalid_transaction_amounts', 'transaction', 'transaction_amount',
+                   is_one_of(VALID_TRANSACTION_AMOUNT)),
+    ValidationRule('drop_invalid_transaction_currencies', 'transaction', 'transaction_currency',
+                   is_one_of(VALID_TRANSACTION_CURRENCY)),
+]
+
+
+def register_rule(rule: ValidationRule):
+    # adds a rule to the ones clean_events applies (after the built-in ones)
+    if any(registered.name == rule.name for registered in VALIDATION_RULES):
+        raise ValueError(f"A validation rule named {rule.name} is already registered.")
+    VALIDATION_RULES.append(rule)
+    return rule
+
+
+def validate_events(events: pd.DataFrame, rules: list = VALIDATION_RULES):
+    """
+    Runs the rules over the events, each on the events of its type only, and for categorical columns,
+    on every distinct value (category) once instead of on every row.
+    Returns, for every event, the index of the first rule it fails, or -1 if it passes them all.
+    """
+    failed_rules = np.full(len(events), -1, dtype=np.int16)
+    positions_of_type = {}
+    # the first failing rule is the one written last
+    for i, rule in reversed(list(enumerate(rules))):
+        if rule.event_type not in positions_of_type:
+            positions_of_type[rule.event_type] = np.flatnonzero((events['event_type'] == rule.event_type).to_numpy())
+        positions = positions_of_type[rule.event_type]
+        valid = apply_rule(rule, events[rule.column].iloc[positions])
+        failed_rules[positions[~valid]] = i
+    return failed_rules
+
+
+def apply_rule(rule: ValidationRule, values: pd.Series):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # the result of the category a value's code points to, where the code of missing values (-1)
+        # points to the result of a missing value, appended last
+        categories = pd.concat([pd.Series(values.cat.categories, dtype=object), pd.Series([None], dtype=object)],
+                               ignore_index=True)
+        return np.asarray(rule.predicate(categories), dtype=bool)[values.cat.codes.to_numpy()]
+    return np.asarray(rule.predicate(values), dtype=bool)
+
+
+def get_rejected_events(events: pd.DataFrame, failed_rules: np.ndarray, rejected: np.ndarray,
+                        rules: list = VALIDATION_RULES):
+    # the rejected events, with the name of the rule each of them failed and the value it failed on
+    rejected_events = events.loc[rejected, ['event_id', 'event_timestamp', 'event_type', 'user_id']]
+    failed_rules = failed_rules[rejected]
+    values = np.empty(len(rejected_events), dtype=object)
+    for i, rule in enumerate(rules):
+        is_rule = failed_rules == i
+        if is_rule.any():
+            rule_values = events[rule.column][rejected][is_rule]
+            values[is_rule] = rule_values.astype(str).where(rule_values.notna(), None).to_numpy()
+    return rejected_events.assign(
+        rule=np.array([rule.name for rule in rules], dtype=object)[failed_rules],
+        value=values,
+    )
@@ -0,0 +1,108 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy.sql import text
+
+from src import crud, duckdb_db
+from src.db import SessionLocal
+from src.parquet import write_parquet_table
+from benchmarks.duckdb_vs_postgres import seed
+
+N_USERS = 50_000
+N_LOGINS = 150_000
+START_DATE, END_DATE = datetime.date(2010, 5, 8), datetime.date(2010, 5, 14)
+# 4 standard errors of the estimate (each count is off by 1.6% on average)
+MAX_RELATIVE_ERROR = 4 * 1.04 / crud.HLL_REGISTERS ** 0.5
+# the Postgres DB is seeded as in tests/test_query_plans.py, then a growing share of the users stop logging in
+POSTGRES_USERS = 20_000
+POSTGRES_SESSIONS_PER_USER = 10
+
+
+@pytest.fixture(scope='module')
+def duckdb_session(tmp_path_factory):
+    # the DuckDB views (daily_active_users_sketch included) over the Parquet files of random logins of N_USERS users
+    path = str(tmp_path_factory.mktemp('parquet'))
+    rng = np.random.default_rng(0)
+    user_ids = np.array([f'user-{i}' for i in range(N_USERS)], dtype=object)
+    write_parquet_table('user', pd.DataFrame({
+        'id': user_ids,
+        'country': rng.choice(['DE', 'ES', 'IT'], N_USERS),
+        'name': 'name',
+        'device_os': 'iOS',
+        'marketing_campaign': None,
+    }), path)
+    start = pd.Timestamp(START_DATE).timestamp()
+    days = (END_DATE - START_DATE).days + 1
+    write_parquet_table('login_logout', pd.DataFrame({
+        'id': np.arange(N_LOGINS),
+        'event_datetime': pd.to_datetime(start + rng.integers(0, days * 86400, N_LOGINS), unit='s'),
+        'user_id': user_ids[rng.integers(0, N_USERS, N_LOGINS)],
+        'is_login': True,
+        'matching_login_or_logout_id': pd.array([None] * N_LOGINS, dtype='Int64'),
+    }), path)
+    duckdb_db.create_views(path)
+    db = duckdb_db.DuckDBSession(duckdb_db.connection.cursor())
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope='module')
+def postgres_session():
+    # the sketches crud.refresh_daily_stats builds in the DB at DATABASE_URL (which is dropped and re-created, so point it
+    # at a local scratch PostgreSQL)
+    if not os.getenv('DATABASE_URL'):
+        pytest.skip('DATABASE_URL is not set')
+    db = SessionLocal()
+    seed(db, POSTGRES_USERS, POSTGRES_SESSIONS_PER_USER)
+    # (so the users active on each date differ, and the sketches of several dates have to be merged)
+    db.execute(text('''
+        DELETE FROM login_logout
+        WHERE CAST(SUBSTR(user_id, 2) AS INTEGER) % 15 < EXTRACT(DAY FROM event_datetime) - 8
+    '''))
+    db.commit()
+    crud.refresh_daily_stats(db, START_DATE, datetime.date(2010, 5, 22))
+    yield db
+    db.close()
+
+
+@pytest.fixture(params=['duckdb', 'postgres'])
+def db(request):
+    return request.getfixturevalue(f'{request.param}_session')
+
+
+def get_counts(result: dict):
+    # counts by date and country (where returned), as in the rows of either query
+    counts = {}
+    for row in result.values():
+        row = row if isinstance(row, tuple) else (row,)
+        counts[row[1:]] = row[0]
+    return counts
+
+
+def assert_within_error_bound(exact: dict, approximate: dict):
+    exact, approximate = get_counts(exact), get_counts(approximate)
+    assert exact.keys() == approximate.keys()
+    for key, count in exact.items():
+        assert abs(approximate[key] - count) <= MAX_RELATIVE_ERROR * count, (key, count, approximate[key])
+
+
+@pytest.mark.parametrize('input_date', [None, START_DATE, END_DATE])
+@pytest.mark.parametrize('country', [False, True])
+def test_estimates_daily_active_users(db, input_date, country):
+    assert_within_error_bound(crud.get_number_of_daily_active_users(db, input_date, country),
+                              crud.get_approximate_number_of_daily_active_users(db, input_date, country))
+
+
+@pytest.mark.parametrize('granularity', crud.GRANULARITIES)
+@pytest.mark.parametrize('country', [False, True])
+def test_estimates_daily_active_users_series(db, granularity, country):
+    args = START_DATE, END_DATE, granularity, country
+    assert_within_error_bound(crud.get_number_of_daily_active_users_series(db, *args),
+                              crud.get_approximate_number_of_daily_active_users_series(db, *args))
+
+
+def test_estimates_no_active_users(db):
+    assert crud.get_approximate_number_of_daily_active_users(db, datetime.date(2010, 5, 1), False) == {0: 0}
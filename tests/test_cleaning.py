@@ -0,0 +1,92 @@
+import pytest
+
+from src.ingest import flatten_events
+from src.initialize import START_DATE, CleaningState, clean_events
+
+T = int(START_DATE) + 3600
+
+
+def registration(event_id, user_id, timestamp=T, country='DE', device_os='iOS'):
+    return {'event_id': event_id, 'event_timestamp': timestamp, 'event_type': 'registration',
+            'event_data': {'user_id': user_id, 'country': country, 'name': user_id, 'device_os': device_os,
+                           'marketing_campaign': None}}
+
+
+def event(event_id, user_id, timestamp, event_type):
+    return {'event_id': event_id, 'event_timestamp': timestamp, 'event_type': event_type,
+            'event_data': {'user_id': user_id}}
+
+
+def transaction(event_id, user_id, timestamp, amount=0.99, currency='USD'):
+    return {'event_id': event_id, 'event_timestamp': timestamp, 'event_type': 'transaction',
+            'event_data': {'user_id': user_id, 'transaction_amount': amount, 'transaction_currency': currency}}
+
+
+def session(first_event_id, user_id, *transactions):
+    # a login, the given transactions and a logout of the user, an hour after registering
+    return [
+        event(first_event_id, user_id, T + 100, 'login'),
+        *transactions,
+        event(first_event_id + 1, user_id, T + 200, 'logout'),
+    ]
+
+
+def clean(*records, workers=1):
+    registration_events, login_logout_events, transaction_events, _, rejected_events = clean_events(
+        flatten_events(list(records)), CleaningState(), workers=workers
+    )
+    return (
+        set(registration_events['event_id']), set(login_logout_events['event_id']),
+        set(transaction_events['event_id']), set(rejected_events['event_id']),
+    )
+
+
+def test_keeps_valid_events():
+    registrations, login_logouts, transactions, rejected = clean(
+        registration(1, 'a'),
+        *session(2, 'a', transaction(4, 'a', T + 150)),
+    )
+    assert (registrations, login_logouts, transactions, rejected) == ({1}, {2, 3}, {4}, set())
+
+
+@pytest.mark.parametrize('invalid', [{'country': 'XX'}, {'device_os': 'Symbian'}])
+def test_drops_the_events_of_users_whose_registration_is_invalid(invalid):
+    # the registration is rejected before the events of unregistered users are filtered, so the user's other
+    # events go with it (rather than reaching the DB without a user)
+    registrations, login_logouts, transactions, rejected = clean(
+        registration(1, 'a', **invalid),
+        *session(2, 'a', transaction(4, 'a', T + 150)),
+        registration(5, 'b'),
+        *session(6, 'b'),
+    )
+    assert (registrations, login_logouts, transactions, rejected) == ({5}, {6, 7}, set(), {1})
+
+
+@pytest.mark.parametrize('invalid', [{'amount': 3.5}, {'currency': 'GBP'}])
+def test_drops_invalid_transactions_inside_sessions(invalid):
+    # the transaction is rejected before the events are split by type, so it isn't loaded (which its CHECK
+    # constraints wouldn't allow) even though it is done inside a session
+    registrations, login_logouts, transactions, rejected = clean(
+        registration(1, 'a'),
+        *session(2, 'a', transaction(4, 'a', T + 150, **invalid), transaction(5, 'a', T + 160)),
+    )
+    assert (registrations, login_logouts, transactions, rejected) == ({1}, {2, 3}, {5}, {4})
+
+
+def test_repeated_registrations_are_dropped_before_validation():
+    # so an invalid repeat isn't counted as rejected
+    registrations, login_logouts, _, rejected = clean(
+        registration(1, 'a'),
+        registration(2, 'a', timestamp=T + 50, country='XX'),
+        *session(3, 'a'),
+    )
+    assert (registrations, login_logouts, rejected) == (set(), set(), set())
+
+
+def test_parallel_cleaning_validates_first_too():
+    records = [
+        registration(1, 'a', country='XX'), *session(2, 'a'),
+        registration(4, 'b'), *session(5, 'b', transaction(7, 'b', T + 150, currency='GBP')),
+        registration(8, 'c'), *session(9, 'c', transaction(11, 'c', T + 150)),
+    ]
+    assert clean(*records, workers=2) == clean(*records) == ({4, 8}, {5, 6, 9, 10}, {11}, {1, 7})
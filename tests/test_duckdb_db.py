@@ -0,0 +1,39 @@
+import datetime
+import glob
+
+import duckdb
+import pytest
+
+from src import crud, duckdb_db
+from src.parquet import get_parquet_glob
+
+INPUT_DATE = datetime.date(2010, 5, 8)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    # a session of a fresh DuckDB connection, as a worker's first one
+    if any(glob.glob(get_parquet_glob(table)) for table in duckdb_db.TABLE_COLUMNS):
+        pytest.skip('there are Parquet files under PARQUET_PATH')
+    monkeypatch.setattr(duckdb_db, 'connection', duckdb.connect())
+    monkeypatch.setattr(duckdb_db, 'views_created', False)
+    monkeypatch.setattr(duckdb_db, 'empty_tables', set(duckdb_db.TABLE_COLUMNS))
+    monkeypatch.setattr(duckdb_db, 'loaded_mtime', None)
+    db = duckdb_db.get_duckdb_session()
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize('query', [
+    crud.get_number_of_daily_active_users,
+    crud.get_approximate_number_of_daily_active_users,
+    crud.get_number_of_logins_for_game,
+    crud.get_total_revenue_in_usd,
+    crud.get_number_of_paid_users,
+    crud.get_average_number_of_sessions_for_users_with_sessions,
+    crud.get_average_total_time_spent_in_game,
+])
+@pytest.mark.parametrize('country', [False, True])
+def test_queries_before_any_parquet_is_written(db, query, country):
+    # no rows rather than no tables
+    assert query(db, INPUT_DATE, country) == ({} if country else {0: 0})
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.load import CsvStream
+
+
+@pytest.fixture
+def df():
+    n = 1000
+    return pd.DataFrame({
+        'id': np.arange(n),
+        'user_id': [f'user-{i}' for i in range(n)],
+        'matching_login_or_logout_id': pd.array([None if i % 3 else i for i in range(n)], dtype='Int64'),
+    })
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000, 5000])
+@pytest.mark.parametrize('read_size', [-1, 1, 13, 8192])
+def test_streams_the_csv_of_the_whole_dataframe(df, chunk_size, read_size):
+    stream = CsvStream(df, chunk_size)
+    parts = []
+    while data := stream.read(read_size):
+        assert read_size < 0 or len(data) <= read_size
+        parts.append(data)
+    assert b''.join(parts) == df.to_csv(header=False, index=False).encode()
+    assert stream.read(read_size) == b''
+
+
+def test_streams_an_empty_dataframe():
+    assert CsvStream(pd.DataFrame({'id': []})).read(8192) == b''
@@ -0,0 +1,153 @@
+"""
+Query plan regression tests: seed the DB at DATABASE_URL (which is dropped and re-created, so point it at a local
+scratch PostgreSQL) and check with EXPLAIN that none of the date-filtered queries the endpoints run does a sequential
+scan on a large table, and that those queries (and the rebuild of the rollups of a day) only read the partitions
+of the partitioned tables for their dates. Skipped if DATABASE_URL isn't set.
+"""
+import datetime
+import json
+import os
+
+import pytest
+from sqlalchemy import event
+
+from src import crud
+from src.db import SessionLocal, engine
+from src.partitions import PARTITION_NAME, get_partition_table, get_partitioned_tables
+from benchmarks.duckdb_vs_postgres import seed
+
+pytestmark = pytest.mark.skipif(not os.getenv('DATABASE_URL'), reason='DATABASE_URL is not set')
+
+N_USERS = 20_000
+SESSIONS_PER_USER = 10
+INPUT_DATE = datetime.date(2010, 5, 15)
+USER_ID = 'u42'
+
+# tables that grow with the number of events or users
+# (daily_game_stats and daily_revenue only have a row per day and country, so scanning them is fine)
+LARGE_TABLES = ['event', 'user', 'registration', 'login_logout', 'transaction', 'daily_user_stats']
+
+# the time spent in game is summed out of the sessions, which have no country, so the averages join the users
+# of all the sessions of the date (about half of them in the seeded DB), for which Postgres rightly scans "user" whole
+SCANS_USER = pytest.mark.xfail(reason='joins the users of all sessions of the date', strict=True)
+
+# every date-filtered query the endpoints run
+HOT_QUERIES = [
+    pytest.param(crud.get_number_of_logins, (USER_ID, INPUT_DATE), id='get_number_of_logins'),
+    pytest.param(crud.get_days_since_last_login, (USER_ID, INPUT_DATE), id='get_days_since_last_login'),
+    pytest.param(crud.get_number_of_sessions, (USER_ID, INPUT_DATE), id='get_number_of_sessions'),
+    pytest.param(crud.get_time_spent_in_game, (USER_ID, INPUT_DATE), id='get_time_spent_in_game'),
+] + [
+    pytest.param(query, (INPUT_DATE, country), id=f'{query.__name__}{" by country" if country else ""}')
+    for country in [False, True]
+    for query in [crud.get_number_of_daily_active_users, crud.get_number_of_logins_for_game,
+                  crud.get_total_revenue_in_usd, crud.get_number_of_paid_users,
+                  crud.get_average_number_of_sessions_for_users_with_sessions]
+] + [
+    pytest.param(crud.get_average_total_time_spent_in_game, (INPUT_DATE, country), marks=SCANS_USER,
+                 id=f'get_average_total_time_spent_in_game{" by country" if country else ""}')
+    for country in [False, True]
+]
+
+
+@pytest.fixture(scope='module')
+def db():
+    db = SessionLocal()
+    seed(db, N_USERS, SESSIONS_PER_USER)
+    yield db
+    db.close()
+
+
+def record_statements(run):
+    # the statements run by crud, with their parameters, as actually executed
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        run()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return statements
+
+
+def get_plans(db, run):
+    # the plans of the statements run, with the statements and their parameters
+    cursor = db.connection().connection.cursor()
+    try:
+        for statement, parameters in record_statements(run):
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+            plan = cursor.fetchone()[0]
+            yield (plan if isinstance(plan, list) else json.loads(plan))[0]['Plan'], statement, parameters
+    finally:
+        cursor.close()
+
+
+def get_sequential_scans(plan):
+    # (scans of a partition count as scans of its table)
+    relation = get_partition_table(plan.get('Relation Name', ''))
+    scans = [relation] if plan['Node Type'] == 'Seq Scan' and relation in LARGE_TABLES else []
+    for child in plan.get('Plans', []):
+        scans += get_sequential_scans(child)
+    return scans
+
+
+def get_partition_scans(plan):
+    # the partitions read by each reference to a partitioned table: the scans appended together, or a single one
+    relations = [child.get('Relation Name', '') for child in plan.get('Plans', [])]
+    if plan['Node Type'] in ('Append', 'Merge Append') and relations and all(map(PARTITION_NAME.match, relations)):
+        return [relations]
+    if PARTITION_NAME.match(plan.get('Relation Name', '')):
+        return [[plan['Relation Name']]]
+    return [scans for child in plan.get('Plans', []) for scans in get_partition_scans(child)]
+
+
+def is_in_range(partition: str, start: datetime.date | None, end: datetime.date):
+    # whether the partition's week overlaps [start, end)
+    week_start = datetime.datetime.strptime(PARTITION_NAME.match(partition)['week_start'], '%Y%m%d').date()
+    return week_start < end and (start is None or week_start + datetime.timedelta(days=7) > start)
+
+
+def get_unpruned_tables(plan, statement: str, parameters: dict):
+    """
+    The partitioned tables of which a date-filtered statement reads partitions out of its range of dates
+    in every reference to them (at least one has to be filtered, as the logouts paired with logins aren't).
+    """
+    start = parameters['start'] if '%(start)s' in statement else None
+    end = parameters['end']
+    scans = get_partition_scans(plan)
+    return [table for table in get_partitioned_tables() if any(
+        get_partition_table(partitions[0]) == table for partitions in scans
+    ) and not any(
+        get_partition_table(partitions[0]) == table and all(is_in_range(p, start, end) for p in partitions)
+        for partitions in scans
+    )]
+
+
+def assert_partitions_pruned(db, run):
+    checked = 0
+    for plan, statement, parameters in get_plans(db, run):
+        if '%(end)s' not in statement:
+            continue
+        checked += 1
+        assert not get_unpruned_tables(plan, statement, parameters), ' '.join(statement.split())
+    assert checked
+
+
+@pytest.mark.parametrize('query, args', HOT_QUERIES)
+def test_no_sequential_scans(db, query, args):
+    for plan, statement, _ in get_plans(db, lambda: query(db, *args)):
+        assert not get_sequential_scans(plan), ' '.join(statement.split())
+
+
+@pytest.mark.parametrize('query', [crud.get_number_of_logins, crud.get_days_since_last_login, crud.get_number_of_sessions])
+def test_user_queries_read_the_partitions_of_their_dates(db, query):
+    # (the time spent in game is read from the sessions, which aren't partitioned)
+    assert_partitions_pruned(db, lambda: query(db, USER_ID, INPUT_DATE))
+
+
+def test_rollups_rebuild_reads_the_partitions_of_its_dates(db):
+    # the rebuild of the sessions and rollups of a day on ingestion
+    assert_partitions_pruned(db, lambda: crud.refresh_daily_stats(db, INPUT_DATE, INPUT_DATE))
@@ -0,0 +1,217 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.sessions import pair_login_logout_events, get_sessions, mark_events_in_sessions
+from benchmarks.session_pairing import generate_login_logout_events
+from benchmarks.transactions_in_sessions import generate_transaction_events
+
+
+def login_logout_events(*events):
+    # (event_id, user_id, event_timestamp, event_type) tuples
+    return pd.DataFrame(events, columns=['event_id', 'user_id', 'event_timestamp', 'event_type'])
+
+
+def sessions(*sessions):
+    # (user_id, start, end) tuples, with end None for an open session
+    return pd.DataFrame(sessions, columns=['user_id', 'start', 'end']).astype({'start': float, 'end': float})
+
+
+def transactions(*transactions):
+    # (user_id, event_timestamp) tuples
+    return pd.DataFrame(transactions, columns=['user_id', 'event_timestamp'])
+
+
+def get_pairs(paired_events: pd.DataFrame):
+    # event_id -> (valid, matching_login_or_logout_id)
+    return {
+        row.event_id: (row.valid, None if np.isnan(row.matching_login_or_logout_id) else row.matching_login_or_logout_id)
+        for row in paired_events.itertuples()
+    }
+
+
+def test_pairs_logins_with_the_next_logouts():
+    paired = pair_login_logout_events(login_logout_events(
+        (1, 'a', 100, 'login'), (2, 'a', 200, 'logout'), (3, 'a', 300, 'login'), (4, 'a', 400, 'logout'),
+    ))
+    assert get_pairs(paired) == {1: (True, 2), 2: (True, 1), 3: (True, 4), 4: (True, 3)}
+
+
+def test_pairs_events_in_chronological_order():
+    paired = pair_login_logout_events(login_logout_events(
+        (2, 'a', 200, 'logout'), (1, 'a', 100, 'login'),
+    ))
+    assert paired['event_id'].tolist() == [1, 2]
+    assert get_pairs(paired) == {1: (True, 2), 2: (True, 1)}
+
+
+def test_ignores_repeated_logins_and_logouts():
+    paired = pair_login_logout_events(login_logout_events(
+        (1, 'a', 100, 'login'), (2, 'a', 150, 'login'), (3, 'a', 200, 'logout'), (4, 'a', 250, 'logout'),
+    ))
+    assert get_pairs(paired) == {1: (True, 3), 2: (False, None), 3: (True, 1), 4: (False, None)}
+
+
+def test_ignores_a_users_leading_logouts():
+    paired = pair_login_logout_events(login_logout_events(
+        (1, 'a', 100, 'logout'), (2, 'a', 150, 'logout'), (3, 'a', 200, 'login'), (4, 'a', 300, 'logout'),
+    ))
+    assert get_pairs(paired) == {1: (False, None), 2: (False, None), 3: (True, 4), 4: (True, 3)}
+
+
+def test_leaves_the_last_session_open():
+    paired = pair_login_logout_events(login_logout_events(
+        (1, 'a', 100, 'login'), (2, 'a', 200, 'logout'), (3, 'a', 300, 'login'),
+    ))
+    assert get_pairs(paired) == {1: (True, 2), 2: (True, 1), 3: (True, None)}
+
+
+def test_pairs_each_users_events_separately():
+    paired = pair_login_logout_events(login_logout_events(
+        (1, 'a', 100, 'login'), (2, 'b', 150, 'logout'), (3, 'b', 160, 'login'), (4, 'a', 200, 'logout'),
+        (5, 'c', 300, 'login'),
+    ))
+    assert get_pairs(paired) == {1: (True, 4), 2: (False, None), 3: (True, None), 4: (True, 1), 5: (True, None)}
+
+
+def test_pairs_no_events():
+    paired = pair_login_logout_events(login_logout_events())
+    assert paired.empty
+    assert {'valid', 'matching_login_or_logout_id'} <= set(paired.columns)
+
+
+def test_gets_sessions_of_paired_events():
+    paired = pair_login_logout_events(login_logout_events(
+        (1, 'a', 100, 'login'), (2, 'a', 200, 'logout'), (3, 'a', 300, 'login'),
+    ))
+    actual = get_sessions(paired[paired['valid']])
+    pd.testing.assert_frame_equal(actual, sessions(('a', 100, 200), ('a', 300, None)))
+
+
+@pytest.mark.parametrize('timestamp, inside', [
+    (99, False),
+    # strictly inside: neither at the login nor at the logout
+    (100, False),
+    (101, True),
+    (199, True),
+    (200, False),
+    # between sessions
+    (250, False),
+    (300, False),
+    (350, True),
+])
+def test_marks_events_strictly_inside_sessions(timestamp, inside):
+    mask = mark_events_in_sessions(transactions(('a', timestamp)), sessions(('a', 100, 200), ('a', 300, 400)))
+    assert mask.tolist() == [inside]
+
+
+def test_marks_events_in_open_sessions():
+    mask = mark_events_in_sessions(transactions(('a', 150), ('a', 10_000_000)), sessions(('a', 100, 200), ('a', 300, None)))
+    assert mask.tolist() == [True, True]
+
+
+def test_doesnt_mark_events_of_users_without_sessions():
+    mask = mark_events_in_sessions(transactions(('a', 150), ('b', 150), ('c', 150)), sessions(('a', 100, 200), ('b', 300, None)))
+    assert mask.tolist() == [True, False, False]
+
+
+def test_marks_events_without_any_sessions():
+    mask = mark_events_in_sessions(transactions(('a', 150)), sessions())
+    assert mask.tolist() == [False]
+
+
+def test_mask_is_aligned_with_the_events():
+    events = transactions(('b', 350), ('a', 50), ('a', 150), ('b', 150)).set_axis([7, 3, 5, 1])
+    mask = mark_events_in_sessions(events, sessions(('a', 100, 200), ('b', 300, 400)))
+    assert mask.tolist() == [True, False, True, False]
+
+
+def legacy_pair_login_logout_events(login_logout_events: pd.DataFrame):
+    # the original row-by-row implementation from initialize(), kept as the reference for the parity test
+    login_logout_events = login_logout_events.copy()
+    login_logout_events.sort_values(by=['user_id', 'event_timestamp'], inplace=True)
+    login_logout_events['matching_login_or_logout_id'] = np.nan
+    login_logout_events['valid'] = False
+    login_logout_events = login_logout_events.reset_index(drop=True)
+
+    for idx, row in enumerate(login_logout_events.itertuples()):
+        if row.event_type == 'login':
+            if idx == 0:
+                login_logout_events.loc[idx, 'valid'] = True
+            else:
+                for prev_idx in range(idx-1, -1, -1):
+                    prev_row = login_logout_events.iloc[prev_idx]
+                    if (prev_row['event_type'] == 'logout' and
+                        prev_row['user_id'] == row.user_id and
+                        prev_row['valid'] == True):
+                        login_logout_events.loc[idx, 'valid'] = True
+                        break
+                    elif prev_row['user_id'] != row.user_id:
+                        login_logout_events.loc[idx, 'valid'] = True
+                        break
+                    elif (prev_row['event_type'] == 'login' and
+                          prev_row['user_id'] == row.user_id and
+                          prev_row['valid'] == True):
+                        break
+        else:
+            if idx != 0:
+                for prev_idx in range(idx-1, -1, -1):
+                    prev_row = login_logout_events.iloc[prev_idx]
+                    if (prev_row['event_type'] == 'login' and
+                        prev_row['user_id'] == row.user_id and
+                        prev_row['valid'] == True):
+                        login_logout_events.loc[idx, 'valid'] = True
+                        login_logout_events.loc[idx, 'matching_login_or_logout_id'] = prev_row['event_id']
+                        login_logout_events.loc[prev_idx, 'matching_login_or_logout_id'] = row.event_id
+                        break
+                    elif prev_row['user_id'] != row.user_id:
+                        break
+                    elif (prev_row['event_type'] == 'logout' and
+                          prev_row['user_id'] == row.user_id and
+                          prev_row['valid'] == True):
+                        break
+
+    return login_logout_events
+
+
+def legacy_mark_transactions_in_sessions(transaction_events: pd.DataFrame, login_logout_events: pd.DataFrame):
+    # the original per-transaction implementation from initialize(), kept as the reference for the parity test
+    transaction_events = transaction_events.copy()
+    transaction_events['valid'] = False
+    transaction_events = transaction_events.reset_index(drop=True)
+
+    for idx, row in enumerate(transaction_events.itertuples()):
+        matching_login_logout_for_user = login_logout_events.loc[login_logout_events['user_id'] == row.user_id]
+        for matching_idx, matching_login_logout_row in enumerate(matching_login_logout_for_user.itertuples()):
+            if matching_login_logout_row.event_type == 'login':
+                if row.event_timestamp > matching_login_logout_row.event_timestamp:
+                    shifted_timestamp = matching_login_logout_for_user['event_timestamp'].shift(-1).iloc[matching_idx]
+                    if np.isnan(shifted_timestamp):
+                        transaction_events.loc[idx, 'valid'] = True
+                    elif row.event_timestamp < shifted_timestamp:
+                        transaction_events.loc[idx, 'valid'] = True
+
+    return transaction_events['valid'].to_numpy()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pairs_events_as_the_original_implementation(seed):
+    events = generate_login_logout_events(2000, n_users=200, seed=seed)
+    expected = legacy_pair_login_logout_events(events)
+    actual = pair_login_logout_events(events)
+    # the original loop never validated anything for the very first user (in sort order) whose events
+    # start with a logout, as its backwards scan ran off the start of the frame, so that user is left out
+    first_user = expected['user_id'] == expected['user_id'].iloc[0]
+    expected, actual = expected.loc[~first_user], actual.loc[~first_user]
+    pd.testing.assert_series_equal(expected['valid'], actual['valid'])
+    pd.testing.assert_series_equal(expected['matching_login_or_logout_id'], actual['matching_login_or_logout_id'])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_marks_transactions_as_the_original_implementation(seed):
+    login_logout_events = pair_login_logout_events(generate_login_logout_events(1000, n_users=100, seed=seed))
+    login_logout_events = login_logout_events.loc[login_logout_events['valid']]
+    transaction_events = generate_transaction_events(1000, n_users=100, seed=seed)
+    expected = legacy_mark_transactions_in_sessions(transaction_events, login_logout_events)
+    actual = mark_events_in_sessions(transaction_events, get_sessions(login_logout_events))
+    np.testing.assert_array_equal(expected, actual)